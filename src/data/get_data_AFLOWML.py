@@ -1,5 +1,8 @@
 from typing import Optional, Iterable, Dict
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import pickle
@@ -13,13 +16,85 @@ try:
 except:
     raise NameError("AFLOWmlAPI not present. Have you remembered to download it?")
 
-from pymatgen import Structure
+from pymatgen.core import Structure
 from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.io.cif import CifParser
 
 from src.data.get_data_MP import data_MP
 from src.data import get_data_base
 
+def _prepare_poscar(cif: Optional[str],
+                    structure: Optional[Structure] = None)-> str:
+    """
+    Builds the POSCAR payload AFLOW-ML expects for a single entry. Uses the
+    already deserialized structure when present, and only parses the CIF
+    otherwise. Runs inside the worker processes of the preparation stage.
+    """
+    if structure is None:
+        structure = CifParser.from_string(cif).get_structures()[0]
+    return str(Poscar(structure=structure))
+
+def _put(payloads: queue.Queue, item, stop: threading.Event)-> bool:
+    """
+    Puts "item" into the bounded queue, waking up regularly to check whether
+    the submission stage has stopped. Returns False if it has, in which case
+    the item is dropped.
+    """
+    while not stop.is_set():
+        try:
+            payloads.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _poscar_producer(entries: pd.DataFrame,
+                     pool: ProcessPoolExecutor,
+                     payloads: queue.Queue,
+                     stop: threading.Event)-> None:
+    """
+    Submits POSCAR preparation of every entry to the process pool and hands
+    the pending results to the submission stage in entry order. Blocks when
+    the bounded queue is full, such that only a limited number of payloads
+    are prepared ahead of the network calls. Entries with neither a
+    structure nor a CIF are logged and skipped. Returns as soon as "stop" is
+    set.
+    """
+    try:
+        for index, entry in entries.iterrows():
+            if stop.is_set():
+                break
+            structure = entry.get("structure")
+            if not isinstance(structure, Structure):
+                structure = None
+            cif = entry.get("cif")
+            if structure is None and not isinstance(cif, str):
+                LOG.warning("No structure or CIF for {}, skipping it."
+                            .format(entry["material_id"]))
+                continue
+            future = pool.submit(_prepare_poscar, cif, structure)
+            item = (index, entry["full_formula"], entry["material_id"], future)
+            if not _put(payloads, item, stop):
+                future.cancel()
+                break
+    except Exception as e:
+        _put(payloads, e, stop)
+    finally:
+        _put(payloads, None, stop)
+
+def _drain(payloads: queue.Queue)-> None:
+    """
+    Empties the queue of a stopped producer, cancelling the preparations
+    that have not started yet.
+    """
+    while True:
+        try:
+            item = payloads.get_nowait()
+        except queue.Empty:
+            return
+        if isinstance(item, tuple):
+            item[-1].cancel()
+
 class data_AFLOWML(get_data_base.data_base):
     def __init__(self, API_KEY: Optional[str] = None, MAPI_KEY: Optional[str] = None):
 
@@ -30,9 +105,17 @@ class data_AFLOWML(get_data_base.data_base):
         self.interim_data_path = self.data_dir / "interim" / "AFLOWML" / "AFLOWML.pkl"
         super().__init__()
 
-    def calculate_data(self, entries: pd.DataFrame)-> Dict:
+    def calculate_data(self,
+                       entries: pd.DataFrame,
+                       n_jobs: Optional[int] = None,
+                       queue_size: int = 32)-> Dict:
         """
         A function used to initialise AFLOW-ML with appropiate inputs.
+
+        The POSCAR payloads are prepared in a separate stage by a pool of
+        worker processes, which feeds the submission stage through a bounded
+        queue. Parsing of upcoming entries thereby overlaps with the network
+        waits of the current one.
         ...
         Args
         ----------
@@ -40,11 +123,19 @@ class data_AFLOWML(get_data_base.data_base):
         {
             "cif": {}
                 - Materials Project parameter "cif", which is a dict
+            "structure": {}
+                - Optional pymatgen Structure, used instead of parsing "cif"
+                  Entries with neither are skipped.
             "compound": []
                 - list of strings
             "material id": []
                 - list of strings
         }
+        n_jobs : int
+            Number of worker processes preparing POSCAR files. If "None",
+            "os.cpu_count()" is used.
+        queue_size : int
+            Maximum number of prepared payloads waiting for submission.
 
         Returns
         -------
@@ -54,30 +145,56 @@ class data_AFLOWML(get_data_base.data_base):
             Labeled Material Fragments.
         """
 
+        payloads = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        aflowml_dict = {"full_formula": [], "material_id": []}
+        checkpoint = self.data_dir / "raw" / "AFLOWML" / "new_AFLOW.pkl"
+
         firstIteration = True
-        for index, entry in tqdm(entries.iterrows()):
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            producer = threading.Thread(target=_poscar_producer,
+                                        args=(entries, pool, payloads, stop),
+                                        name="poscar_producer",
+                                        daemon=True)
+            producer.start()
 
-            struc = CifParser.from_string(entry["cif"]).get_structures()[0]
+            pbar = tqdm(total=len(entries))
+            try:
+                while True:
+                    item = payloads.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    index, full_formula, material_id, future = item
 
-            poscar = Poscar(structure=struc)
+                    poscar = future.result()
 
-            ml = AFLOWmlAPI()
+                    ml = AFLOWmlAPI()
 
-            prediction = ml.get_prediction(poscar, 'plmf')
+                    prediction = ml.get_prediction(poscar, 'plmf')
 
-            if firstIteration:
-                aflowml_dict = {k: [] for k in prediction.keys()}
-                aflowml_dict["full_formula"] = []
-                aflowml_dict["material_id"]  = []
-                firstIteration = False
+                    if firstIteration:
+                        aflowml_dict = {**{k: [] for k in prediction.keys()},
+                                        **aflowml_dict}
+                        firstIteration = False
 
-            for key in prediction.keys():
-                aflowml_dict[key].append(prediction[key])
+                    for key in prediction.keys():
+                        aflowml_dict[key].append(prediction[key])
 
-            aflowml_dict["full_formula"].append(entry["full_formula"])
-            aflowml_dict["material_id"].append(entry["material_id"])
-            if (index % 10 == 0):
-                pd.DataFrame.from_dict(aflowml_dict).to_pickle(self.data_dir / "raw"  / "AFLOWML" / "new_AFLOW.pkl")
+                    aflowml_dict["full_formula"].append(full_formula)
+                    aflowml_dict["material_id"].append(material_id)
+                    if (index % 10 == 0):
+                        frame = pd.DataFrame.from_dict(aflowml_dict)
+                        frame.to_pickle(checkpoint)
+                    pbar.update(1)
+            finally:
+                pbar.close()
+                # Unblock a producer waiting on the full queue, and cancel
+                # the preparations nobody is going to submit.
+                stop.set()
+                producer.join()
+                _drain(payloads)
 
         return aflowml_dict
 
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from pymatgen import MPRester
+from pymatgen.ext.matproj import MPRester
 from typing import Optional, Iterable
 import os
 import pandas as pd
@@ -0,0 +1,63 @@
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+
+def assemble_features(blocks: Dict[str, pd.DataFrame],
+                      index: pd.Index,
+                      dtype: np.dtype = np.float32) -> Tuple[np.ndarray, pd.Index]:
+    """ Concatenate the feature blocks of the featurizer groups once, along
+    columns, into a single contiguous float matrix.
+    Every block is aligned to the material ids in "index", such that rows
+    missing from a block are filled with NaN. Non-numeric columns are left
+    out, as they can not be part of a float matrix.
+    Arguments:
+        blocks: group name -> feature block of that group, indexed by
+            material id. Empty blocks are skipped.
+        index: the material ids of the rows, in order.
+        dtype: the float dtype of the matrix.
+    Returns:
+        The C-contiguous (n_materials x n_features) float matrix, and the
+        index of its column names.
+    Raises:
+        ValueError: if two groups produce a column with the same name.
+    """
+    owners = {}
+    numeric_blocks = []
+    for group, block in blocks.items():
+        if block.shape[1] == 0:
+            continue
+
+        non_numeric = [column for column, dtype in block.dtypes.items()
+                       if not (pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype))]
+        if non_numeric:
+            LOG.info("Leaving out non-numeric columns of {}: {}".format(group, non_numeric))
+            block = block.drop(columns=non_numeric)
+
+        for column in block.columns:
+            if column in owners:
+                raise ValueError("Feature column {} is produced by both the {} and {} group."
+                                 .format(column, owners[column], group))
+            owners[column] = group
+        numeric_blocks.append(block)
+
+    columns = pd.Index(list(owners.keys()))
+    matrix = np.empty((len(index), len(columns)), dtype=dtype)
+
+    start = 0
+    for block in numeric_blocks:
+        if not block.index.equals(index):
+            block = block.reindex(index)
+        width = block.shape[1]
+        matrix[:, start:start+width] = block.to_numpy(dtype=dtype, na_value=np.nan)
+        start += width
+
+    return matrix, columns
+
+
+def to_frame(matrix: np.ndarray, columns: pd.Index, index: pd.Index) -> pd.DataFrame:
+    """ Wrap an assembled feature matrix in a DataFrame without copying it. """
+    return pd.DataFrame(matrix, index=index, columns=columns, copy=False)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+# Rough in-memory size of one site of a "pymatgen.Structure".
+_BYTES_PER_SITE = 1024
+
+
+def _object_nbytes(obj) -> int:
+    """ Estimate the memory held by a downloaded object without serializing
+    it: the number of sites of a structure, or the numpy arrays a dos or
+    band structure holds directly or in dicts, e.g. its densities or bands.
+    """
+    if hasattr(obj, "num_sites"):
+        return obj.num_sites * _BYTES_PER_SITE
+    nbytes = 0
+    for value in getattr(obj, "__dict__", {}).values():
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, dict):
+            nbytes += sum(array.nbytes for array in value.values() if isinstance(array, np.ndarray))
+    return nbytes
+
+
+def payload_nbytes(df: pd.DataFrame) -> int:
+    """ Estimate the in-memory payload of a downloaded portion, which is
+    dominated by the dos and bandstructure objects. The estimate only
+    inspects the objects' arrays, and costs far less than pickling them.
+    Arguments:
+        df: the downloaded DataFrame.
+    Returns:
+        The estimated number of bytes of the DataFrame.
+    """
+    nbytes = int(df.memory_usage(index=True, deep=False).sum())
+    for column in df.columns[df.dtypes == object]:
+        nbytes += sum(_object_nbytes(obj) for obj in df[column])
+    return nbytes
+
+
+class AdaptiveBatchSizer:
+    """ Chooses the number of materials to download and featurize together.
+    The size of the next batch is estimated from the observed payload
+    bytes and latency per material, such that a batch stays within both a
+    latency target and a memory budget.
+    Attributes:
+        min_size: The smallest batch size ever returned.
+        max_size: The largest batch size ever returned.
+        target_seconds: The wanted wall time of downloading and featurizing
+            one batch.
+        max_bytes: Upper bound on the downloaded payload of one batch.
+        smoothing: Weight of the latest observation in the exponentially
+            weighted averages of bytes and seconds per material.
+    """
+
+    def __init__(self,
+                 initial_size: int = 1,
+                 min_size: int = 1,
+                 max_size: int = 500,
+                 target_seconds: float = 120.0,
+                 max_bytes: int = 2 * 1024**3,
+                 smoothing: float = 0.5):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.smoothing = smoothing
+
+        self._size = max(min_size, min(initial_size, max_size))
+        self._bytes_per_material = None
+        self._seconds_per_material = None
+
+    def next_size(self) -> int:
+        """ Returns the size of the next batch. """
+        return self._size
+
+    def update(self, n_materials: int, n_bytes: int, seconds: float):
+        """ Register the observed cost of a finished batch and resize.
+        Arguments:
+            n_materials: Number of materials in the finished batch.
+            n_bytes: Downloaded payload of the batch in bytes.
+            seconds: Wall time spent downloading and featurizing the batch.
+        """
+        if n_materials <= 0:
+            return
+
+        self._bytes_per_material = self._smooth(
+            self._bytes_per_material, n_bytes / n_materials
+        )
+        self._seconds_per_material = self._smooth(
+            self._seconds_per_material, seconds / n_materials
+        )
+
+        size = self.max_size
+        if self._seconds_per_material > 0:
+            size = min(size, self.target_seconds / self._seconds_per_material)
+        if self._bytes_per_material > 0:
+            size = min(size, self.max_bytes / self._bytes_per_material)
+
+        self._size = int(max(self.min_size, min(size, self.max_size)))
+        LOG.info("Next batch size: {} ({:.0f} bytes/material, {:.2f} s/material)"
+                 .format(self._size, self._bytes_per_material, self._seconds_per_material))
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * average
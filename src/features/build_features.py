@@ -8,6 +8,12 @@ import pickle
 
 from src.features import preset
 from src.features import featurizer
+from src.features import batching
+from src.features import costmodel
+from src.features import pipeline
+from src.features import scheduling
+from src.features.objects import ObjectStore
+from src.features.store import FeatureStore
 from src.data.utils import LOG
 
 from matminer.data_retrieval.retrieve_MP import MPDataRetrieval
@@ -16,92 +22,280 @@ from pathlib import Path
 from src.data.get_data_MP import data_MP
 import dotenv
 
+from typing import Dict, List, Optional
+
+FEATURIZER_DIR = Path(__file__).resolve().parents[2] / "data" / "raw" / "featurizer"
+# The number of materials the fittable featurizers learning from the
+# materials, e.g. "BondFractions", are fitted to.
+FIT_SAMPLE = 5000
+# The worker processes of "run_featurizer", the materials of a batch per
+# worker, and the memory in bytes and wall time in seconds a single material
+# may take before it is aborted.
+N_WORKERS = os.cpu_count()
+BATCH_PER_WORKER = 4
+MEMORY_LIMIT = 8 * 2**30
+TIMEOUT = 3600.0
+
 def featurize_by_material_id(material_ids: np.array,
                             featurizerObject: featurizer.extendedMODFeaturizer,
                             MAPI_KEY: str,
-                            writeToFile: bool = True) -> pd.DataFrame:
+                            writeToFile: bool = True,
+                            **options) -> pd.DataFrame:
     """ Run all of the preset featurizers on the input dataframe.
     Arguments:
-        df: the input dataframe with a `"structure"` column
-            containing `pymatgen.Structure` objects.
+        material_ids: the Materials Project ids of the entries to featurize.
+        featurizerObject: the preset used to featurize each batch.
+        MAPI_KEY: the Materials Project API key.
+        writeToFile: whether or not to write each featurized batch as a
+            shard to the feature store, see "featurize_to_store". The
+            featurized entries are then read back from the store.
+        options: the options of "featurize_to_store", e.g. "steps",
+            "n_workers" or "store".
     Returns:
-        The featurized DataFrame.
+        The featurized DataFrame, with a "material_id" column.
     """
-    def apply_featurizers(criterion, properties, mpdr, featurizerObject):
-        LOG.info("Downloading dos and bandstructure objects..")
-
-        timeDownloadStart = time.time()
-        df_portion = mpdr.get_dataframe(criteria=criterion, properties=properties)
-        timeDownloadEnd = time.time()
+    if writeToFile:
+        store = featurize_to_store(material_ids, featurizerObject, MAPI_KEY, **options)
+        return store.read(material_ids)
+    portions = _featurize_batches(material_ids, featurizerObject, MAPI_KEY, None, **options)
+    return pd.concat(portions) if portions else pd.DataFrame({})
+
+def featurize_to_store(material_ids: np.array,
+                       featurizerObject: featurizer.extendedMODFeaturizer,
+                       MAPI_KEY: str,
+                       store: Optional[FeatureStore] = None,
+                       **options) -> FeatureStore:
+    """ Run all of the preset featurizers on the entries, writing every
+    featurized batch as a shard to the feature store. Written batches are
+    not kept in memory.
+    Arguments:
+        material_ids: the Materials Project ids of the entries to featurize.
+        featurizerObject: the preset used to featurize each batch. Only the
+            properties its tier reads are downloaded.
+        MAPI_KEY: the Materials Project API key.
+        store: the feature store to write to. Defaults to the store in
+            "data/raw/featurizer".
+        options:
+            steps: the number of materials downloaded in one query and
+                featurized together. Used as initial batch size if adaptive.
+            adaptive: if true, the batch size is chosen from the observed
+                payload bytes and latency of previous batches.
+            prefetch: the number of downloaded batches a background
+                downloader may keep ready while the current batch is
+                featurized. If 0, downloading and featurizing alternate.
+            max_attempts: the number of times a material is downloaded and
+                featurized before it is given up. Failing materials are
+                deferred to the end of the queue with an exponential backoff.
+            n_workers: if given, the materials of every batch are featurized
+                across a persistent pool of this many worker processes.
+            profile: if true, the wall time, CPU time and failures of every
+                featurizer on every material are recorded, and written with
+                a summary report next to the shards.
+            cache_compositions: if true, composition features are cached by
+                normalized formula, in memory and on disk across runs.
+            cache_symmetry: if true, the space group analysis of every
+                structure is cached by structure fingerprint, and kept next
+                to the shards.
+            costs: optional predicted featurization time per material id.
+                If given, the materials are queued longest predicted time
+                first.
+            cost_model: optional model of the featurization time, used by
+                the worker pool to submit the materials of a batch longest
+                predicted time first.
+            memory_limit: optional ceiling in bytes on the memory a single
+                material may add to a worker. Requires "n_workers".
+            timeout: optional wall time in seconds a single material may
+                take. Requires "n_workers". Materials exceeding either are
+                aborted, given up with their measured cost and their worker
+                recycled, while the rest of the batch continues.
+            object_store: optional local store of the downloaded structure,
+                dos and band structure objects. Downloaded objects are added
+                to it, and materials of which every object is stored are not
+                downloaded again.
+    Returns:
+        The feature store holding the shards.
+    """
+    store = store or FeatureStore(FEATURIZER_DIR)
+    _featurize_batches(material_ids, featurizerObject, MAPI_KEY, store, **options)
+    return store
+
+def _featurize_batches(material_ids: np.array,
+                       featurizerObject: featurizer.extendedMODFeaturizer,
+                       MAPI_KEY: str,
+                       store: Optional[FeatureStore],
+                       steps: int = 1,
+                       adaptive: bool = False,
+                       prefetch: int = 0,
+                       max_attempts: int = 3,
+                       n_workers: Optional[int] = None,
+                       profile: bool = False,
+                       cache_compositions: bool = True,
+                       cache_symmetry: bool = True,
+                       costs: Optional[pd.Series] = None,
+                       cost_model: Optional[costmodel.CostModel] = None,
+                       memory_limit: Optional[int] = None,
+                       timeout: Optional[float] = None,
+                       object_store: Optional[ObjectStore] = None) -> List[pd.DataFrame]:
+    """ Download and featurize the entries batch by batch, see
+    "featurize_to_store" for the options. Every featurized batch is written
+    to the store, or kept and returned if the store is None.
+    """
+    def download_objects(batch):
+        # Materials of which every object is stored are loaded locally.
+        local = object_store.complete(batch, objectKinds) if object_store is not None else []
+        remote = [mpid for mpid in batch if mpid not in local]
+
+        try:
+            timeDownloadStart = time.time()
+            portions = []
+            if remote:
+                LOG.info("Downloading {}..".format(", ".join(properties)))
+                LOG.info(remote)
+                criteria = {"task_id":{"$in":remote}}
+                df_remote = mpdr.get_dataframe(criteria=criteria, properties=properties)
+                if object_store is not None:
+                    object_store.put_frame(df_remote, objectKinds)
+                portions.append(df_remote)
+            if local:
+                LOG.info("Loading {} stored materials..".format(len(local)))
+                portions.append(object_store.load_frame(local, objectKinds))
+            df_portion = pd.concat(portions) if len(portions) > 1 else portions[0]
+            timeDownloadEnd = time.time()
+        except Exception as e:
+            scheduler.failure(batch, e, stage="download")
+            return None, None
+        return df_portion, timeDownloadEnd-timeDownloadStart
+
+    def apply_featurizers(df_portion, featurizerObject):
+        # The payload is only needed to size the next batch.
+        payloadBytes = batching.payload_nbytes(df_portion) if adaptive else None
 
         LOG.info(df_portion)
-        df_time, df_portion = featurizerObject.featurize(df_portion)
-        df_time["download_objects"] = [timeDownloadEnd-timeDownloadStart]
-
-        return df_time, df_portion
+        df_time, df_featurized = featurizerObject.featurize(df_portion)
+        if adaptive:
+            df_time["payload_bytes"] = [payloadBytes]
 
-    properties = ["material_id","full_formula", "bandstructure", "dos", "structure"]
-
-    mpdr = MPDataRetrieval(MAPI_KEY)
+        return df_time, df_featurized
 
-    steps = 1
-    leftover = len(material_ids)%steps
+    def batches():
+        while True:
+            batch = scheduler.next_batch(sizer.next_size() if adaptive else steps)
+            if batch is None:
+                return
+            yield batch
 
-    df        = pd.DataFrame({})
-    df_timers = pd.DataFrame({})
+    # Only the properties read by the featurizer groups of the preset's tier.
+    properties = featurizerObject.required_properties()
+    objectKinds = [p for p in properties if p not in ("material_id", "full_formula")]
 
-    for i in tqdm(range(0,len(material_ids),steps)):
-        portionReturned = True
-        if not (i+steps > len(material_ids)):
-
-            LOG.info(list(material_ids[i:i+steps]))
-            criteria = {"task_id":{"$in":list(material_ids[i:i+steps])}}
-
-            while (portionReturned):
-                try:
-                    df_time, df_portion = apply_featurizers(criteria, properties, mpdr, featurizerObject)
-                    portionReturned = False
-                except:
-                    LOG.info("Except - try again.")
-
-            # Add ID to recognize afterwards
-            df_portion["material_id"] = material_ids[i:i+steps]
-
-            df        = pd.concat([df,df_portion])
-            df_timers = pd.concat([df_timers,df_time])
-
-            LOG.info("CURRENT SHAPE:{}".format(df.shape))
-            if writeToFile:
-                df.to_pickle(Path(__file__).resolve().parents[2] / "data" / "raw" / "featurizer" / "featurized.pkl")
-                df_timers.to_csv(Path(__file__).resolve().parents[2] / "data" / "raw" / "featurizer" / "timing.csv")
-
-    if (leftover):
-        LOG.info(list(material_ids[i:i+leftover]))
-        criteria = {"task_id":{"$in":list(material_ids[i:i+leftover])}}
-        df_time, df_portion = apply_featurizers(criteria, properties, mpdr, featurizerObject)
-        df_portion["material_id"] = material_ids[i:i+leftover]
-
-        df        = pd.concat([df,df_portion])
-        df_timers = pd.concat([df_timers,df_time])
-        if writeToFile:
-            df.to_pickle(Path(__file__).resolve().parents[2] / "data" / "raw" / "featurizer" / "featurized.pkl")
-            df_timers.to_csv(Path(__file__).resolve().parents[2] / "data" / "raw" / "featurizer" / "timing.csv")
+    mpdr = MPDataRetrieval(MAPI_KEY)
 
-    return df
+    sizer = batching.AdaptiveBatchSizer(initial_size=steps) if adaptive else None
+    if costs is not None:
+        material_ids = costmodel.lpt_order(costs, material_ids)
+    scheduler = scheduling.RetryScheduler(material_ids, max_attempts=max_attempts)
+
+    portions = []
+    nRows = 0
+
+    # Batches apply the featurizers fitted once to all materials, if fitted.
+    if not featurizerObject.is_fitted():
+        featurizerObject.load_fitted()
+    if cache_compositions:
+        featurizerObject.enable_composition_cache()
+    if cache_symmetry:
+        featurizerObject.enable_symmetry_cache(store.directory / "symmetry.pkl" if store else None,
+                                               persist=store is not None)
+    if profile:
+        profiler = featurizerObject.enable_profiling()
+    if n_workers:
+        featurizerObject.start_pool(n_workers, cost_model=cost_model,
+                                    memory_limit=memory_limit, timeout=timeout)
+    try:
+        pbar = tqdm(total=len(scheduler))
+        for batch, (df_portion, timeDownload) in pipeline.prefetch_batches(batches(),
+                                                                           download_objects,
+                                                                           prefetch=prefetch):
+            if df_portion is None:
+                # Download failed, the batch has been deferred by the scheduler.
+                continue
+
+            timeFeaturizeStart = time.time()
+            try:
+                df_time, df_portion = apply_featurizers(df_portion, featurizerObject)
+            except Exception as e:
+                scheduler.failure(batch, e, stage="featurization")
+                del df_portion
+                continue
+            timeFeaturize = time.time()-timeFeaturizeStart
+
+            aborted = {record["material_id"]: record for record in featurizerObject.take_aborted()}
+            for mpid, record in aborted.items():
+                scheduler.abort(mpid, record["error_class"], record["error"])
+            # Materials the response left out never reach a shard, and are
+            # retried until given up and recorded as failures.
+            featurized = set(df_portion.index)
+            missing = [mpid for mpid in batch if mpid not in aborted and mpid not in featurized]
+            scheduler.success([mpid for mpid in batch if mpid not in aborted and mpid in featurized])
+            if missing:
+                scheduler.failure(missing, scheduling.MissingMaterialError(
+                    "Not in the Materials Project response"), stage="download")
+
+            df_time["download_objects"] = [timeDownload]
+            df_time["batch_size"]       = [len(batch)]
+
+            if adaptive:
+                sizer.update(len(batch), df_time["payload_bytes"].iloc[0], timeDownload+timeFeaturize)
+
+            nRows += df_portion.shape[0]
+
+            LOG.info("CURRENT SHAPE:({}, {})".format(nRows, df_portion.shape[1]))
+            if store is not None:
+                # Shards hold the conformed float features only, the
+                # material ids are the index.
+                store.write_shard(df_portion, df_time, schema=featurizerObject.get_schema().name,
+                                  featurizers=list(featurizerObject.featurizer_ids()))
+            else:
+                # Add ID to recognize afterwards. Rows of a batch are returned
+                # indexed by material id, but not necessarily in requested order.
+                df_portion["material_id"] = df_portion.index
+                portions.append(df_portion)
+
+            pbar.update(len(batch))
+        pbar.close()
+    finally:
+        if n_workers:
+            featurizerObject.stop_pool()
+        if profile:
+            featurizerObject.disable_profiling()
+        featurizerObject.save_caches()
+
+    if profile and store is not None:
+        profiler.write(store.directory / "profile.pkl.gz")
+        profiler.summary().to_csv(store.directory / "profile-summary.csv")
+
+    if scheduler.failed:
+        LOG.info("Featurization failed for {} entries: {}".format(len(scheduler.failed),
+                                                                   list(scheduler.failed.keys())))
+        if store is not None:
+            store.write_failures(scheduler.failures_frame())
+
+    return portions
 
 def run_featurizer():
     """ Function used to run, and rerun a featurization process of a large amount of entries.
         As default, we use the initial query from Materials Project. Initialised by
         "make features"
 
-        If program stops, identify mistake (most likely an error in Materials Project
-        (add to filterIDs)), remove raw data in Materials Project data folder, and
-        rerun with "make features" command.
+        Every featurized batch is written as a shard to the feature store in
+        "data/raw/featurizer". If program stops, identify mistake (most likely an
+        error in Materials Project (add to filterIDs)) and rerun with "make features"
+        command. Entries already present in the manifest of the store are skipped,
+        and the shards are compacted into "featurized.pkl" when done.
 
     """
 
     project_dir = Path(__file__).resolve().parents[2]
-    data_dir = project_dir / "data"
 
     dotenv.load_dotenv(project_dir / ".env")
 
@@ -109,84 +303,174 @@ def run_featurizer():
     MP = data_MP(API_KEY=MAPI_KEY)
     entries = MP.get_dataframe()
     material_ids = entries["material_id"]
-    del entries, MP
-
-    featurizerObject = preset.PRESET_HEBNES_2021()
-
-    if Path(data_dir / "raw" / "featurizer" / "featurized.pkl").is_file():
-
-        # If errors met, just rerun and this if-test will run.
-        LOG.info("In-progress featurized data identified. Reading now...")
 
-        entries_featurized = pd.read_pickle(data_dir / "raw" / "featurizer" / "featurized.pkl")
-        time_featurized    = pd.read_csv(data_dir / "raw" / "featurizer" / "timing.csv")
+    store = FeatureStore(FEATURIZER_DIR)
 
-        LOG.info("Last featurized MPID: {}".format(entries_featurized.index[-1]))
+    # Predict the featurization time of every material from the batch
+    # timings of previous runs, such that the largest cells are featurized
+    # first.
+    structures = entries.set_index("material_id")["structure"]
+    cost_model = costmodel.CostModel.fit_batches(store.read_timings(), structures)
+    costs = cost_model.predict_structures(structures)
+    del structures
 
-        howFar = material_ids[material_ids == entries_featurized.index[-1]].index.values
-
-        # Test if mpid index is the same, true if using the same dataset
-        assert material_ids[howFar[0]] == entries_featurized.index[-1], "Are you sure this is the same dataset as earlier?"
+    featurizerObject = preset.PRESET_HEBNES_2021()
 
-        LOG.info("Index: {}".format(howFar))
-        LOG.info("Preparing for new featurized data starting with MPID: {}".format(material_ids[howFar[0]]))
+    # Fit the fittable featurizers once, such that every batch shares the
+    # same fitted state and thereby the same columns.
+    if not featurizerObject.load_fitted():
+        featurizerObject.fit(entries, sample=FIT_SAMPLE)
+        featurizerObject.save_fitted()
+    # The schema follows from the fitted featurizers, and is registered in
+    # "data/interim/schemas" on the first run.
+    LOG.info("Featurizing into schema {}".format(featurizerObject.get_schema().name))
+    del entries, MP
 
-        entries_featurized.to_pickle(data_dir / "raw" / "featurizer" / Path("featurized-upto-" + str(howFar[0]) + ".pkl"))
-        time_featurized.to_csv(data_dir / "raw" / "featurizer" / Path("timing-upto-" + str(howFar[0]) + ".csv"))
+    legacy_path = FEATURIZER_DIR / "featurized.pkl"
+    if legacy_path.is_file() and not store.records:
+        # Featurized data from before the store was introduced, add as first shard.
+        LOG.info("In-progress featurized data identified. Adding to feature store...")
+        store.write_shard(pd.read_pickle(legacy_path))
+
+    completed = store.completed_ids()
+    if completed:
+        LOG.info("{} featurized entries identified in manifest.".format(len(completed)))
+    material_ids = material_ids[~material_ids.isin(completed)]
+    LOG.info("Featurizing {} remaining entries.".format(len(material_ids)))
+
+    featurize_to_store(material_ids, featurizerObject, MAPI_KEY, store=store,
+                       steps=BATCH_PER_WORKER*N_WORKERS, n_workers=N_WORKERS,
+                       memory_limit=MEMORY_LIMIT, timeout=TIMEOUT,
+                       costs=costs, cost_model=cost_model, object_store=ObjectStore())
+
+    store.compact()
+
+
+def featurize_delta(featurizerObject: featurizer.extendedMODFeaturizer,
+                    MAPI_KEY: str,
+                    store: Optional[FeatureStore] = None,
+                    **kwargs) -> List[str]:
+    """ Apply only the featurizers of a preset that are missing from the
+    shards of the feature store, e.g. after switching from
+    PRESET_HEBNES_2021 to FUTURE_PROSPECTS_2021, and merge their columns
+    into the shards by material id.
+    The featurizers of a shard are read from its provenance in the
+    manifest. Shards written before provenance was recorded are matched
+    to the featurizers by the prefixes of their columns.
+    Arguments:
+        featurizerObject: the extended or switched preset.
+        MAPI_KEY: the Materials Project API key.
+        store: the feature store. Defaults to the store in
+            "data/raw/featurizer".
+        kwargs: passed on to "featurize_by_material_id", e.g.
+            "object_store" to featurize from the local objects.
+    Returns:
+        The identifiers of the featurizers that were applied.
+    """
+    store = store or FeatureStore(FEATURIZER_DIR)
+    preset_ids = featurizerObject.featurizer_ids()
+
+    # Material ids of the shards by the set of featurizers they miss.
+    missing_ids = {}
+    for record in store.records:
+        present = record.get("featurizers")
+        if present is None:
+            columns = pd.read_pickle(store.shard_dir / record["shard"]).columns
+            prefixes = {fid: featurizerObject.featurizer_prefix(fid) + "|" for fid in preset_ids}
+            present = [fid for fid, prefix in prefixes.items()
+                       if any(str(column).startswith(prefix) for column in columns)]
+        missing = frozenset(preset_ids) - set(present)
+        if missing:
+            missing_ids.setdefault(missing, []).extend(record["material_ids"])
+
+    applied = set()
+    for missing, material_ids in missing_ids.items():
+        material_ids = pd.Series(material_ids).drop_duplicates()
+        LOG.info("Applying {} missing featurizers to {} entries: {}"
+                 .format(len(missing), len(material_ids), sorted(missing)))
+
+        df_new = featurize_by_material_id(material_ids, featurizerObject.subset(missing), MAPI_KEY,
+                                          writeToFile=False, **kwargs)
+        if df_new.shape[0] == 0:
+            continue
+        df_new = df_new.drop(columns=["material_id"], errors="ignore")
+
+        # Merged shards are conformed to the schema of the full preset.
+        store.merge_columns(df_new, sorted(missing), conform=featurizerObject.conform,
+                            schema=featurizerObject.schema_name())
+        applied |= missing
+
+    if not applied:
+        LOG.info("No featurizers missing from the feature store.")
+    return sorted(applied)
+
+def updateFeatureStore(entries: pd.DataFrame,
+                       MAPI_KEY: str,
+                       featurizerObject: Optional[featurizer.extendedMODFeaturizer] = None,
+                       store: Optional[FeatureStore] = None,
+                       compact: bool = False,
+                       **kwargs) -> Dict[str, List[str]]:
+    """ Synchronise the feature store with the current Materials Project
+    entries. The material ids are diffed against the manifest of the store,
+    without loading any featurized data: added entries and entries
+    featurized with another schema version are featurized, and entries
+    removed from the Materials Project are tombstoned. The cost thereby
+    scales with the number of changed entries.
+    Replaces "updateNumberFeaturizedEntries", which took and returned the
+    featurized entries as a DataFrame; the store holds them instead. Read
+    the synchronised entries with "FeatureStore.read", which only
+    consolidates the shards when they changed, or pass "compact" to do so
+    right away.
+    Arguments:
+        entries: the current entries, with a "material_id" column.
+        MAPI_KEY: the Materials Project API key.
+        featurizerObject: the preset to featurize with. Defaults to
+            PRESET_HEBNES_2021.
+        store: the feature store. Defaults to the store in
+            "data/raw/featurizer".
+        compact: whether or not to consolidate the shards into
+            "featurized.pkl" after the sync, which reads every shard.
+        kwargs: passed on to "featurize_to_store".
+    Returns:
+        The "added", "stale" and "removed" material ids.
+    """
+    featurizerObject = featurizerObject or preset.PRESET_HEBNES_2021()
+    store = store or FeatureStore(FEATURIZER_DIR)
 
-        del entries_featurized, time_featurized
+    diff = store.diff(entries["material_id"], schema=featurizerObject.schema_name())
+    LOG.info("Feature store diff: {} added, {} stale, {} removed entries.".format(
+        len(diff["added"]), len(diff["stale"]), len(diff["removed"])))
 
-        df = featurize_by_material_id(material_ids[howFar[0]+1:], featurizerObject, MAPI_KEY)
+    store.tombstone(diff["removed"])
+    changed = diff["added"] + diff["stale"]
+    if changed:
+        featurize_to_store(pd.Series(changed), featurizerObject, MAPI_KEY, store=store, **kwargs)
+    if compact:
+        store.compact()
 
-    else:
-        # First time running featurizers.
-        df = featurize_by_material_id(entries["material_id"], featurizerObject, MAPI_KEY)
+    return diff
 
+def testUpdateFeatureStore(entries: pd.DataFrame,
+                           MAPI_KEY: str,
+                           store: Optional[FeatureStore] = None):
+    """ Test to see if updateFeatureStore work as intended
 
-def updateNumberFeaturizedEntries(entries:pd.DataFrame,
-                                  featurizedEntries:pd.DataFrame,
-                                  MAPI_KEY: str) -> pd.DataFrame:
-    """ Function that checks if new entries that have not been featurized,
-        and if true will featurize.
-    """
-    if entries.shape[0] > featurizedEntries.shape[0]:
-        # Find new entries
-        newEntries = entries.material_id[~entries.material_id.isin(featurizedEntries.material_id.values)]
-        # Define featurizer preset
-        featurizerObject = preset.PRESET_HEBNES_2021()
-        # Update with new entries
-        newEntries = featurize_by_material_id(newEntries, featurizerObject, MAPI_KEY, writeToFile=False)
-        # Add new entries
-        featurizedEntries = pd.concat([featurizedEntries, newEntries])
-    elif entries.shape[0] < featurizedEntries.shape[0]:
-        featurizedEntries = featurizedEntries[featurizedEntries.material_id.isin(entries.material_id.values)]
-        featurizedEntries = featurizedEntries.reset_index(drop=True)
-
-    if entries.shape[0] == featurizedEntries.shape[0]:
-        print("Updated featurized entries, shape: {}".format(featurizedEntries.shape))
-    assert (entries.shape[0] == featurizedEntries.shape[0]), "Not equal length, {}!={}"\
-                                  .format(entries.shape[0], featurizedEntries.shape[0])
-
-    return featurizedEntries
-
-def testUpdateFeaturisedEntries(entries: pd.DataFrame,
-                                featurizedEntries: pd.DataFrame,
-                                MAPI_KEY: str):
-    """ Test to see if updateNumberFeaturizedEntries work as intended
-
-        Removes one entry and checks if the resulting featurized entry is equal to the
-        removed one.
+        Tombstones one entry and checks if it is featurized again. Other
+        entries may have been added to the Materials Project meanwhile.
     """
-    # Choosing an arbitrary featurizedEntry
-    suddenlyLostEntry      = featurizedEntries.iloc[0]
+    store = store or FeatureStore(FEATURIZER_DIR)
+    # Choosing an arbitrary featurized entry still in the Materials Project
+    current = set(entries["material_id"])
+    suddenlyLostEntry = sorted(store.completed_ids() & current)[0]
     # Woops! Where did it go?
-    featurizedEntries      = featurizedEntries[1:]
+    store.tombstone([suddenlyLostEntry])
     # Puh, we can get it back!
-    featurizedEntries      = updateNumberFeaturizedEntries(entries, featurizedEntries, MAPI_KEY)
+    diff = updateFeatureStore(entries, MAPI_KEY, store=store)
     # But is it back, though?
-    assert featurizedEntries.iloc[0].equals(suddenlyLostEntry)
+    assert suddenlyLostEntry in diff["added"], diff["added"]
+    assert suddenlyLostEntry in store.completed_ids()
     # Yey, it's back!
-    print("Test passed.")
+    LOG.info("Test passed.")
 
 def does_file_exist(filepath:Path)-> bool:
     """
@@ -201,10 +485,13 @@ def does_file_exist(filepath:Path)-> bool:
         LOG.info("Data path\n{}\nnot detected. Downloading now...".format(filepath))
         return False
 
-def get_featurized_data()-> pd.DataFrame:
+def get_featurized_data(dtype: Optional[np.dtype] = None)-> pd.DataFrame:
     """ A function that checks if featurized data is present in folder, if not,
         will download and store the data.
 
+        If "dtype" is given, e.g. np.float32, the float features are cast to it,
+        halving the memory of the featurized data.
+
         Returns a dataframe
     """
     featurized_data_path = Path(__file__).resolve().parents[2] / \
@@ -226,6 +513,10 @@ def get_featurized_data()-> pd.DataFrame:
     else:
         LOG.info("Reading data..")
         df = pd.read_pickle(featurized_data_path)
+
+    if dtype is not None:
+        floats = df.select_dtypes(include="floating").columns
+        df = df.astype({column: dtype for column in floats})
     return df
 
 def main():
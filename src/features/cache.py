@@ -0,0 +1,270 @@
+import enum
+import hashlib
+import inspect
+import os
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from src.data.utils import LOG
+
+CACHE_DIR = Path(__file__).resolve().parents[2] / "data" / "interim" / "cache"
+
+
+def _describe(value, seen: frozenset = frozenset()) -> str:
+    """ Description of a featurizer parameter that is the same across
+    instances and processes. Plain scalars are described by their repr,
+    containers by their members, and objects, e.g. the "Gaussian" bins of
+    "GRDF" or the neighbor finding method of a site featurizer, by their
+    class name and their own parameters, recursively. Object reprs are
+    never used, as they may hold memory addresses.
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return repr(value)
+    if isinstance(value, np.generic):
+        return repr(value.item())
+    if isinstance(value, enum.Enum):
+        return str(value)
+    if isinstance(value, np.ndarray):
+        return _describe(value.tolist(), seen)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        members = [_describe(member, seen) for member in value]
+        if isinstance(value, (set, frozenset)):
+            members.sort()
+        return "[{}]".format(",".join(members))
+    if isinstance(value, dict):
+        return "{{{}}}".format(",".join(sorted("{}:{}".format(_describe(key, seen), _describe(member, seen))
+                                               for key, member in value.items())))
+    if isinstance(value, type) or inspect.isroutine(value):
+        return "{}.{}".format(getattr(value, "__module__", ""), getattr(value, "__qualname__", ""))
+    if id(value) in seen or not hasattr(value, "__dict__"):
+        return value.__class__.__name__
+    return "{}{}".format(value.__class__.__name__, _parameters(value, seen | {id(value)}))
+
+
+def _parameters(obj, seen: frozenset = frozenset()) -> str:
+    # Private and fitted attributes (e.g. "_max_eigs", "fitted_bonds_") are
+    # not parameters, such that fitting does not change the signature.
+    return "({})".format(",".join("{}={}".format(key, _describe(value, seen))
+                                  for key, value in sorted(vars(obj).items())
+                                  if not (key.startswith("_") or key.endswith("_"))))
+
+
+def featurizer_signature(featurizers: Iterable) -> str:
+    """ Short hash identifying a set of featurizers by their class names and
+    parameters, used to keep caches of different featurizer sets apart and
+    to identify featurizers in the feature store.
+    """
+    description = ";".join(_describe(featurizer) for featurizer in featurizers)
+    return hashlib.md5(description.encode("utf-8")).hexdigest()[:8]
+
+
+def composition_key(composition) -> str:
+    """ The normalized formula used as cache key. Polymorphs and supercells
+    of the same compound share the reduced formula, and the composition
+    features only depend on the element fractions.
+    """
+    return composition.reduced_formula
+
+
+class CompositionCache:
+    """ Composition features keyed by normalized formula.
+    The features live in memory during a run, and are read from and
+    written to a pickle on disk across runs. The keys added since the last
+    "take_added" are tracked, such that a copy of the cache in a worker
+    process can return its new features to the parent.
+    Attributes:
+        path: the pickle holding the cached features, or None to only
+            cache in memory.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self._features = pd.DataFrame({})
+        self._dirty = False
+        self._added = set()
+        self.hits = 0
+        self.misses = 0
+
+        if self.path and self.path.is_file():
+            self._features = pd.read_pickle(self.path)
+            LOG.info("Read {} cached compositions from {}".format(len(self._features), self.path))
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def missing(self, keys: pd.Series) -> List[str]:
+        """ Returns the unique keys without cached features. """
+        unique = pd.unique(keys)
+        unseen = [key for key in unique if key not in self._features.index]
+        self.hits += len(keys) - keys.isin(unseen).sum()
+        self.misses += len(unseen)
+        return unseen
+
+    def add(self, df_features: pd.DataFrame):
+        """ Cache the features of new keys.
+        Arguments:
+            df_features: the features, indexed by key.
+        """
+        if df_features.shape[0] == 0:
+            return
+        self._features = pd.concat([self._features, df_features])
+        self._features = self._features[~self._features.index.duplicated(keep="last")]
+        self._added.update(df_features.index)
+        self._dirty = True
+
+    def take_added(self) -> pd.DataFrame:
+        """ Returns the features added since the last call, indexed by key. """
+        added, self._added = self._added, set()
+        return self._features.loc[sorted(added)]
+
+    def subset(self, keys: Iterable[str]) -> "CompositionCache":
+        """ An in-memory cache holding the features of the given keys only,
+        cheap to pickle into a worker process.
+        """
+        subset = CompositionCache()
+        subset._features = self._features[self._features.index.isin(list(keys))]
+        return subset
+
+    def lookup(self, keys: pd.Series) -> pd.DataFrame:
+        """ Broadcast the cached features to every row.
+        Arguments:
+            keys: the key of every row, indexed as the rows.
+        Returns:
+            The features of every row, indexed as "keys".
+        """
+        df = self._features.reindex(keys.values)
+        df.index = keys.index
+        return df
+
+    def save(self):
+        """ Write the cache to disk, if anything was added. """
+        if not (self.path and self._dirty):
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._features.to_pickle(tmp_path)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        LOG.info("Wrote {} cached compositions to {} (hits: {}, misses: {})"
+                 .format(len(self._features), self.path, self.hits, self.misses))
+
+
+def structure_key(structure, decimals: int = 4) -> str:
+    """ Fingerprint of a structure used as cache key: a hash of the lattice,
+    the species and the fractional coordinates, rounded such that the same
+    structure loaded twice maps to the same key.
+    """
+    coordinates = np.round(np.mod(structure.frac_coords, 1.0), decimals) % 1.0
+    description = "{};{};{}".format(
+        np.round(structure.lattice.matrix, decimals).tolist(),
+        [str(species) for species in structure.species],
+        coordinates.tolist()
+    )
+    return hashlib.md5(description.encode("utf-8")).hexdigest()
+
+
+class SymmetryCache:
+    """ Space group analysis of structures keyed by structure fingerprint,
+    such that spglib runs once per structure for every consumer, e.g.
+    "GlobalSymmetryFeatures" and the symmetry-reduced site featurization.
+    Every record holds the space group number and symbol, the point group,
+    the crystal system, whether the point group is a Laue group, the number
+    of symmetry operations, and the symmetrized structure as the indices of
+    its sets of equivalent sites together with their Wyckoff symbols.
+    The structures of a batch are analysed in the parent process by
+    "analyse", and featurizers, which may be pickled into worker processes,
+    are handed a "subset" holding the records of the batch only.
+    Attributes:
+        path: the pickle holding the records, or None to only cache in
+            memory.
+        symprec: the symmetry tolerance of the analysis.
+    """
+
+    def __init__(self, path: Optional[Path] = None, symprec: float = 0.01,
+                 records: Optional[Dict[str, Dict]] = None):
+        self.path = Path(path) if path else None
+        self.symprec = symprec
+        self._records: Dict[str, Dict] = dict(records or {})
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+        if self.path and self.path.is_file():
+            cached = pd.read_pickle(self.path)
+            if cached["symprec"] == symprec:
+                self._records = cached["records"]
+                LOG.info("Read {} cached symmetry analyses from {}".format(len(self._records), self.path))
+            else:
+                LOG.info("Ignoring symmetry analyses of {}, analysed with symprec {}"
+                         .format(self.path, cached["symprec"]))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, structure) -> Dict:
+        """ Returns the symmetry analysis of a structure, analysing it if
+        it is not cached.
+        Raises:
+            The errors of "SpacegroupAnalyzer", which are not cached.
+        """
+        key = structure_key(structure)
+        record = self._records.get(key)
+        if record is not None:
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        analyzer = SpacegroupAnalyzer(structure, symprec=self.symprec)
+        symmetrized = analyzer.get_symmetrized_structure()
+        record = {
+            "spacegroup_number":  analyzer.get_space_group_number(),
+            "spacegroup_symbol":  analyzer.get_space_group_symbol(),
+            "point_group":        analyzer.get_point_group_symbol(),
+            "crystal_system":     analyzer.get_crystal_system(),
+            "is_laue":            analyzer.is_laue(),
+            "n_symmetry_ops":     len(analyzer.get_symmetry_operations()),
+            "equivalent_indices": [list(indices) for indices in symmetrized.equivalent_indices],
+            "wyckoff_symbols":    list(symmetrized.wyckoff_symbols),
+        }
+        self._records[key] = record
+        self._dirty = True
+        return record
+
+    def analyse(self, structures: Iterable):
+        """ Analyse the structures not cached yet. Failing analyses are left
+        to the consumers, which handle them.
+        """
+        for structure in structures:
+            try:
+                self.get(structure)
+            except Exception as e:
+                LOG.info("Symmetry analysis failed: {!r}".format(e))
+
+    def records_for(self, structures: Iterable) -> Dict[str, Dict]:
+        """ Returns the cached records of the structures, by structure key. """
+        keys = (structure_key(structure) for structure in structures)
+        return {key: self._records[key] for key in keys if key in self._records}
+
+    def subset(self, structures: Iterable) -> "SymmetryCache":
+        """ An in-memory cache holding the records of the given structures
+        only, cheap to pickle into worker processes.
+        """
+        return SymmetryCache(symprec=self.symprec, records=self.records_for(structures))
+
+    def save(self):
+        """ Write the records to disk, if anything was added. """
+        if not (self.path and self._dirty):
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        pd.to_pickle({"symprec": self.symprec, "records": self._records}, tmp_path)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        LOG.info("Wrote {} cached symmetry analyses to {} (hits: {}, misses: {})"
+                 .format(len(self._records), self.path, self.hits, self.misses))
@@ -0,0 +1,146 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+# Featurization time proportional to the number of sites, used until timings
+# have been recorded.
+_DEFAULT_COEFFICIENTS = (0.0, 1.0, 0.0)
+# The featurizer group times of a batch timing, summed to the work of a batch.
+_GROUP_TIMES = ("composition", "structure", "site", "dos", "bandstructure")
+
+
+class CostModel:
+    """ Predicts the featurization time of a material from cheap structural
+    descriptors, as the power law
+        wall = exp(c0) * nsites**c1 * nelements**c2,
+    fitted by least squares on the logarithms of per-material timings.
+    Attributes:
+        coefficients: (c0, c1, c2).
+    """
+
+    def __init__(self, coefficients: tuple = _DEFAULT_COEFFICIENTS):
+        self.coefficients = np.asarray(coefficients, dtype=float)
+
+    @staticmethod
+    def _design(nsites, nelements) -> np.ndarray:
+        nsites = np.maximum(np.asarray(nsites, dtype=float), 1)
+        nelements = np.maximum(np.asarray(nelements, dtype=float), 1)
+        return np.column_stack([np.ones_like(nsites), np.log(nsites), np.log(nelements)])
+
+    @staticmethod
+    def _descriptors(structures: pd.Series):
+        nsites = structures.apply(len).to_numpy()
+        nelements = structures.apply(lambda s: len(s.composition.elements)).to_numpy()
+        return nsites, nelements
+
+    @classmethod
+    def _least_squares(cls, nsites, nelements, wall, what: str) -> "CostModel":
+        coefficients, *_ = np.linalg.lstsq(cls._design(nsites, nelements),
+                                           np.log(np.asarray(wall, dtype=float)), rcond=None)
+        LOG.info("Fitted cost model to {} {}: wall = {:.3g} * nsites^{:.2f} * nelements^{:.2f}"
+                 .format(len(wall), what, np.exp(coefficients[0]), coefficients[1], coefficients[2]))
+        return cls(coefficients)
+
+    @classmethod
+    def fit(cls, df_profile: pd.DataFrame, min_materials: int = 10) -> "CostModel":
+        """ Fit the model to the records of a "FeaturizerProfiler".
+        Arguments:
+            df_profile: the profiler records, one row per featurizer and
+                material.
+            min_materials: the number of timed materials needed for a fit.
+                With fewer, the default model is returned.
+        Returns:
+            The fitted model.
+        """
+        df = df_profile[df_profile["nsites"] > 0].groupby("material_id", observed=True).agg(
+            wall=("wall", "sum"), nsites=("nsites", "first"), nelements=("nelements", "first")
+        )
+        df = df[df["wall"] > 0]
+        if df.shape[0] < min_materials:
+            LOG.info("Only {} timed materials, using the default cost model.".format(df.shape[0]))
+            return cls()
+        return cls._least_squares(df["nsites"], df["nelements"], df["wall"], "materials")
+
+    @classmethod
+    def fit_batches(cls, df_timing: pd.DataFrame, structures: pd.Series,
+                    min_batches: int = 10) -> "CostModel":
+        """ Fit the model to the timings of featurized batches, as written
+        next to the shards of the feature store, such that every run
+        improves the model of the next without profiling. The work of a
+        batch, its featurizer group times summed over the workers, is
+        divided over its materials, described by the geometric means of
+        their descriptors. Batches of a single material are fitted exactly.
+        Arguments:
+            df_timing: one row per batch, holding the "material_ids" of the
+                batch and its group times, see "FeatureStore.read_timings".
+            structures: the "pymatgen.Structure" objects by material id.
+            min_batches: the number of timed batches needed for a fit. With
+                fewer, the default model is returned.
+        Returns:
+            The fitted model.
+        """
+        groups = [column for column in _GROUP_TIMES if column in df_timing.columns]
+        if df_timing.empty or not (groups or "all" in df_timing.columns):
+            LOG.info("No batch timings, using the default cost model.")
+            return cls()
+        work = df_timing[groups].fillna(0).sum(axis=1) if groups else df_timing["all"]
+
+        nsites, nelements = cls._descriptors(structures)
+        log_nsites = pd.Series(np.log(np.maximum(nsites, 1)), index=structures.index)
+        log_nelements = pd.Series(np.log(np.maximum(nelements, 1)), index=structures.index)
+
+        batch_nsites, batch_nelements, batch_wall = [], [], []
+        for material_ids, wall in zip(df_timing["material_ids"], work):
+            material_ids = log_nsites.index.intersection(material_ids)
+            if len(material_ids) == 0 or not wall > 0:
+                continue
+            batch_nsites.append(np.exp(log_nsites[material_ids].mean()))
+            batch_nelements.append(np.exp(log_nelements[material_ids].mean()))
+            batch_wall.append(wall / len(material_ids))
+
+        if len(batch_wall) < min_batches:
+            LOG.info("Only {} timed batches, using the default cost model.".format(len(batch_wall)))
+            return cls()
+        return cls._least_squares(batch_nsites, batch_nelements, batch_wall, "batches")
+
+    @classmethod
+    def from_profile(cls, path: Path) -> "CostModel":
+        """ Fit the model to a written profile, e.g. "profile.pkl.gz", or
+        return the default model if there is none.
+        """
+        if not Path(path).is_file():
+            return cls()
+        return cls.fit(pd.read_pickle(path))
+
+    def predict(self, nsites, nelements) -> np.ndarray:
+        """ Returns the predicted featurization time in seconds. """
+        return np.exp(self._design(nsites, nelements) @ self.coefficients)
+
+    def predict_structures(self, structures: pd.Series) -> pd.Series:
+        """ Predict the featurization time of "pymatgen.Structure" objects.
+        Returns:
+            The predicted time, indexed as the structures.
+        """
+        nsites, nelements = self._descriptors(structures)
+        return pd.Series(self.predict(nsites, nelements), index=structures.index)
+
+
+def lpt_order(costs: pd.Series, labels: Optional[pd.Index] = None) -> pd.Index:
+    """ Longest-processing-time-first order: the labels sorted by descending
+    predicted cost, such that the largest cells start first and the cheap
+    ones fill the gaps at the end. Labels without a prediction go last, in
+    their original order.
+    Arguments:
+        costs: the predicted cost, indexed by label.
+        labels: the labels to order. Defaults to the index of "costs".
+    Returns:
+        The ordered labels.
+    """
+    labels = costs.index if labels is None else pd.Index(labels)
+    known = costs.reindex(labels)
+    order = np.argsort(-known.fillna(-np.inf).to_numpy(), kind="stable")
+    return labels[order]
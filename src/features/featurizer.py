@@ -1,16 +1,30 @@
 import abc
+import copy
+import os
 import time
 
-from typing import Optional, Iterable, Tuple, Dict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Iterable, Tuple, Dict, List
 
 import pandas as pd
 from src.data.utils import LOG
+from src.features import assembly
+from src.features import cache
+from src.features import costmodel
+from src.features import objects
+from src.features import profiling
+from src.features import schema
+from src.features import site
+from src.features import symmetry
+from src.features import workers
 
 from matminer.featurizers.base import MultipleFeaturizer, BaseFeaturizer
 from matminer.featurizers.structure import SiteStatsFingerprint
 from matminer.featurizers.conversions import CompositionToOxidComposition
 from matminer.data_retrieval.retrieve_MP import MPDataRetrieval
 
+from sklearn.exceptions import NotFittedError
 from tqdm import tqdm
 import numpy as np
 
@@ -49,14 +63,85 @@ class extendedMODFeaturizer(abc.ABC):
 
     site_stats: Tuple[str] = ("mean", "std_dev")
 
-    def __init__(self, n_jobs=None):
+    groups: Tuple[str] = ("composition", "structure", "site", "dos", "bandstructure")
+    # Order of the groups' feature blocks in the featurized DataFrame.
+    assembly_order: Tuple[str] = ("dos", "bandstructure", "composition", "structure", "site")
+
+    # The featurizer groups of every tier, each tier adding to the previous.
+    tiers: Dict[str, Tuple[str]] = {
+        "composition": ("composition",),
+        "structure":   ("composition", "structure"),
+        "site":        ("composition", "structure", "site"),
+        "full":        ("composition", "structure", "site", "dos", "bandstructure"),
+    }
+    tier: str = "full"
+    # The featurizer attributes of every group.
+    group_featurizers: Dict[str, Tuple[str]] = {
+        "composition":   ("composition_featurizers", "oxid_composition_featurizers"),
+        "structure":     ("structure_featurizers",),
+        "site":          ("site_featurizers",),
+        "dos":           ("dos_featurizers",),
+        "bandstructure": ("band_featurizers",),
+    }
+    # Aliases of the site featurizers' label prefixes, see "featurize_site".
+    site_aliases: Optional[Dict[str, str]] = None
+    # The Materials Project property every featurizer group reads.
+    group_properties: Dict[str, str] = {
+        "composition":   "structure",
+        "structure":     "structure",
+        "site":          "structure",
+        "dos":           "dos",
+        "bandstructure": "bandstructure",
+    }
+    concurrent_groups: bool = False
+    symmetrize_sites: bool = False
+
+    # Float dtype of the features, np.float64 for reproducibility checks.
+    feature_dtype: np.dtype = np.float32
+
+    # Version of the preset's feature layout. Bump it whenever the
+    # featurizers or their post-processing change the output columns.
+    version: int = 1
+    # Whether "featurize" conforms its output to the schema. Disabled in
+    # pool workers, as the parent process conforms the joined batch.
+    conform_features: bool = True
+
+    _pool: Optional["workers.FeaturizerPool"] = None
+    _group_executor: Optional[ProcessPoolExecutor] = None
+    _group_processes: int = 0
+    _profiler: Optional[profiling.FeaturizerProfiler] = None
+    _composition_cache: Optional[cache.CompositionCache] = None
+    _symmetry_cache: Optional[cache.SymmetryCache] = None
+    _schema: Optional[schema.FeatureSchema] = None
+    # The input columns of which the featurizers have been fitted once, see
+    # "fit". Their featurizers are not fitted again to every batch.
+    _fitted_columns: frozenset = frozenset()
+    # The featurizer attributes fitted by "fit", with their input column.
+    fit_attributes: Dict[str, str] = {
+        "composition_featurizers": "composition",
+        "structure_featurizers":   "structure",
+    }
+    # Fittable featurizers whose fit only sizes them to the largest
+    # structure, from the number of sites, always fitted to every material.
+    size_bounded_featurizers: Tuple[str] = ("CoulombMatrix", "SineCoulombMatrix")
+
+    def __init__(self, n_jobs=None, concurrent_groups: bool = False, symmetrize_sites: bool = False,
+                 tier: str = "full"):
         """ Initialise the extendedMODFeaturizer object with a requested
         number of threads to use during featurization.
         Arguments:
             n_jobs: The number of threads to use. If "None", matminer
             will use "multiprocessing.cpu_count()" by default.
+            concurrent_groups: Whether or not to run the independent
+            featurizer groups concurrently.
+            symmetrize_sites: Whether or not to only featurize the
+            symmetrically distinct sites of each structure.
+            tier: The featurizer groups to apply, see "set_tier".
         """
         self.set_n_jobs(n_jobs)
+        self.set_concurrent_groups(concurrent_groups)
+        self.symmetrize_sites = symmetrize_sites
+        self.set_tier(tier)
 
     def set_n_jobs(self, n_jobs: Optional[int]):
         """ Set the no. of threads to pass to matminer for featurizer
@@ -67,50 +152,568 @@ class extendedMODFeaturizer(abc.ABC):
         """
         self._n_jobs = n_jobs
 
+    def set_concurrent_groups(self, concurrent_groups: bool):
+        """ Set whether the composition, structure, site, dos and
+        bandstructure groups are scheduled concurrently on a shared process
+        executor instead of one after another. They do not depend on each
+        other's output, such that the smaller groups can finish in the
+        shadow of the dominating one, usually the site featurizers, which
+        run in a single process to share their neighbor lists. The
+        processes split the "n_jobs" of matminer between them. Only useful
+        with more than one CPU.
+        Arguments:
+            concurrent_groups: Whether or not to run the groups concurrently.
+        """
+        self.concurrent_groups = concurrent_groups
+
+    def _has_featurizers(self, group: str) -> bool:
+        return any(getattr(self, attribute) for attribute in self.group_featurizers[group])
+
+    def set_tier(self, tier: str):
+        """ Select the featurizer groups to apply. Tiers "composition",
+        "structure" and "site" only need the structures of the materials,
+        such that large-scale pre-screening never downloads the dos and band
+        structure objects, which are the largest by far. Tier "full" adds
+        the electronic structure features. Set the tier before starting the
+        worker pool, as the workers hold a copy of the preset.
+        Arguments:
+            tier: One of "composition", "structure", "site" and "full".
+        """
+        if tier not in self.tiers:
+            raise ValueError("Unknown tier {}, expected one of {}".format(tier, list(self.tiers)))
+        self.tier = tier
+        self.groups = self.tiers[tier]
+        # Every tier has its own feature layout.
+        self._schema = None
+
+    def required_properties(self) -> List[str]:
+        """ The Materials Project properties to download for the tier. Groups
+        without featurizers, e.g. in a subset of the preset, need nothing.
+        """
+        properties = ["material_id", "full_formula"]
+        for group in self.groups:
+            if not self._has_featurizers(group):
+                continue
+            if self.group_properties[group] not in properties:
+                properties.append(self.group_properties[group])
+        return properties
+
+    def set_feature_dtype(self, dtype: np.dtype):
+        """ Set the float dtype the features are cleaned and assembled into.
+        Float32 halves the memory of the featurized data, float64 can be
+        used to check results for reproducibility. The dtype overrides the
+        dtypes recorded in the feature schema.
+        Arguments:
+            dtype: np.float32 or np.float64.
+        """
+        self.feature_dtype = np.dtype(dtype).type
+
+    def enable_profiling(self,
+                         profiler: Optional[profiling.FeaturizerProfiler] = None
+                         ) -> profiling.FeaturizerProfiler:
+        """ Record the wall time, CPU time and failures of every individual
+        featurizer on every material. While profiling, featurizers are
+        applied one material at a time in this process, and the worker pool
+        is not used.
+        Arguments:
+            profiler: The profiler to record into. A new one if "None".
+        Returns:
+            The profiler holding the records.
+        """
+        self._profiler = profiler or profiling.FeaturizerProfiler()
+        return self._profiler
+
+    def disable_profiling(self):
+        self._profiler = None
+
+    def enable_composition_cache(self, path: Optional[Path] = None, persist: bool = True):
+        """ Cache composition and oxidation state features by normalized
+        formula, such that the featurizers, and especially the oxidation
+        state guessing, only run once per composition.
+        Arguments:
+            path: The pickle the cache is kept in across runs. Defaults to a
+            file in "data/interim/cache" specific to this preset and its
+            composition featurizers.
+            persist: Whether or not to read and write the cache on disk.
+        """
+        if persist and path is None:
+            signature = cache.featurizer_signature(
+                tuple(self.composition_featurizers or ()) + tuple(self.oxid_composition_featurizers or ())
+            )
+            path = cache.CACHE_DIR / "composition-{}-{}.pkl".format(self.__class__.__name__, signature)
+        self._composition_cache = cache.CompositionCache(path if persist else None)
+
+    def take_cache_updates(self) -> Dict[str, pd.DataFrame]:
+        """ The entries added to the caches since the last call. Pool
+        workers return them with every chunk, as their copies of the caches
+        are discarded with the worker.
+        """
+        updates = {}
+        if self._composition_cache is not None:
+            updates["composition"] = self._composition_cache.take_added()
+        return updates
+
+    def merge_cache_updates(self, updates: Dict[str, pd.DataFrame]):
+        """ Add the cache entries returned by a pool worker. """
+        if self._composition_cache is not None and "composition" in updates:
+            self._composition_cache.add(updates["composition"])
+
+    def enable_symmetry_cache(self, path: Optional[Path] = None, persist: bool = True,
+                              symprec: float = 0.01):
+        """ Cache the space group analysis of every structure by structure
+        fingerprint, shared by "GlobalSymmetryFeatures" and the
+        symmetry-reduced site featurization.
+        Arguments:
+            path: The pickle the cache is kept in across runs. Defaults to
+            "data/interim/cache/symmetry.pkl".
+            persist: Whether or not to read and write the cache on disk.
+            symprec: The symmetry tolerance of the analysis.
+        """
+        if persist and path is None:
+            path = cache.CACHE_DIR / "symmetry.pkl"
+        self._symmetry_cache = cache.SymmetryCache(path if persist else None, symprec=symprec)
+
+    def set_symmetry_records(self, records: Dict[str, Dict]):
+        """ Replace the symmetry cache by the given records, e.g. the ones
+        of the chunk a pool worker featurizes, analysed by the parent.
+        """
+        symprec = self._symmetry_cache.symprec if self._symmetry_cache is not None else 0.01
+        self._symmetry_cache = cache.SymmetryCache(symprec=symprec, records=records)
+
+    def save_caches(self):
+        """ Write the enabled caches to disk. """
+        if self._composition_cache is not None:
+            self._composition_cache.save()
+        if self._symmetry_cache is not None:
+            self._symmetry_cache.save()
+
+    @staticmethod
+    def _fittable(featurizer: BaseFeaturizer) -> bool:
+        return type(featurizer).fit is not BaseFeaturizer.fit
+
+    def fit(self, df: pd.DataFrame, sample: Optional[int] = None, random_state: int = 0):
+        """ Fit the fittable featurizers, e.g. "BondFractions" and
+        "CoulombMatrix", once to the full set of materials instead of to
+        every batch. Featurizers fitted to a batch learn batch dependent
+        state, such as the bonds or the matrix size that determine their
+        columns. The fitted featurizers replace copies of the preset's
+        featurizers, and batches apply them without fitting.
+        Arguments:
+            df: the materials with a "structure" column containing
+                "pymatgen.Structure" objects.
+            sample: The number of materials the featurizers learning from
+                the materials are fitted to, all if "None". The
+                "size_bounded_featurizers" are always fitted to all
+                materials, such that no structure exceeds their size.
+            random_state: The seed of the sample.
+        """
+        df_sample = df
+        if sample is not None and df.shape[0] > sample:
+            df_sample = df.sample(sample, random_state=random_state)
+
+        inputs = {}
+
+        def _inputs(column, full):
+            if (column, full) not in inputs:
+                structures = (df if full else df_sample)["structure"]
+                inputs[column, full] = structures if column == "structure" else \
+                    structures.apply(lambda s: s.composition)
+            return inputs[column, full]
+
+        fitted_columns = set(self._fitted_columns)
+        for attribute, column in self.fit_attributes.items():
+            featurizers = getattr(self, attribute) or ()
+            fitted = []
+            for featurizer in featurizers:
+                if self._fittable(featurizer):
+                    values = _inputs(column, featurizer.__class__.__name__ in self.size_bounded_featurizers)
+                    LOG.info("Fitting {} to {} materials...".format(featurizer.__class__.__name__, len(values)))
+                    featurizer = copy.deepcopy(featurizer).fit(values)
+                fitted.append(featurizer)
+            setattr(self, attribute, tuple(fitted))
+            fitted_columns.add(column)
+        self._fitted_columns = frozenset(fitted_columns)
+        self._schema = None
+
+    def fitted_path(self) -> Path:
+        """ The pickle the fitted featurizers of this preset version are kept in. """
+        return cache.CACHE_DIR / "fitted-{}.pkl".format(self.schema_name())
+
+    def save_fitted(self, path: Optional[Path] = None):
+        """ Write the featurizers fitted by "fit", keyed by the preset
+        version, such that every later run and batch worker uses the same
+        fitted state.
+        """
+        path = Path(path or self.fitted_path())
+        state = {"columns": sorted(self._fitted_columns),
+                 "featurizers": {attribute: getattr(self, attribute) for attribute in self.fit_attributes}}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        pd.to_pickle(state, tmp_path)
+        tmp_path.replace(path)
+        LOG.info("Saved fitted featurizers of {} in {}".format(self.schema_name(), path))
+
+    def is_fitted(self) -> bool:
+        return bool(self._fitted_columns)
+
+    def load_fitted(self, path: Optional[Path] = None) -> bool:
+        """ Load the featurizers fitted by "fit" for this preset version.
+        Only the fitted counterparts of the preset's current featurizers
+        are taken, such that a "subset" stays a subset.
+        Returns:
+            Whether or not a fitted state was found.
+        """
+        path = Path(path or self.fitted_path())
+        if not path.is_file():
+            return False
+        state = pd.read_pickle(path)
+        for attribute, featurizers in state["featurizers"].items():
+            current = {self._featurizer_id(attribute, featurizer) for featurizer in getattr(self, attribute) or ()}
+            setattr(self, attribute, tuple(featurizer for featurizer in featurizers
+                                           if self._featurizer_id(attribute, featurizer) in current))
+        self._fitted_columns = frozenset(state["columns"])
+        self._schema = None
+        LOG.info("Loaded fitted featurizers of {} from {}".format(self.schema_name(), path))
+        return True
+
+    def schema_preset(self) -> str:
+        """ The name the feature schema of this preset and tier is registered by. """
+        if self.tier == "full":
+            return self.__class__.__name__
+        return "{}-{}".format(self.__class__.__name__, self.tier)
+
+    def schema_name(self) -> str:
+        return "{}-v{}".format(self.schema_preset(), self.version)
+
+    @staticmethod
+    def _featurizer_id(attribute: str, featurizer: BaseFeaturizer) -> str:
+        return "{}/{}-{}".format(attribute, featurizer.__class__.__name__, cache.featurizer_signature([featurizer]))
+
+    def featurizer_ids(self) -> Dict[str, BaseFeaturizer]:
+        """ The featurizers of the preset's tier by identifier, as recorded
+        as provenance in the feature store: the featurizer attribute, the
+        class name and a hash of the parameters of the featurizer, e.g.
+        "dos_featurizers/SiteDOS-1a2b3c4d".
+        """
+        ids = {}
+        for group in self.groups:
+            for attribute in self.group_featurizers[group]:
+                for featurizer in getattr(self, attribute) or ():
+                    ids[self._featurizer_id(attribute, featurizer)] = featurizer
+        return ids
+
+    def featurizer_prefix(self, featurizer_id: str) -> str:
+        """ The prefix of the feature columns of a featurizer, as in
+        "<prefix>|<feature>".
+        """
+        attribute, name = featurizer_id.split("/", 1)
+        class_name = name.rsplit("-", 1)[0]
+        if attribute == "site_featurizers" and self.site_aliases:
+            return self.site_aliases.get(class_name, class_name)
+        return class_name
+
+    def subset(self, featurizer_ids: Iterable[str]) -> "extendedMODFeaturizer":
+        """ A copy of the preset applying only the given featurizers, e.g.
+        the ones missing from the feature store. The copy does not conform
+        its output to the schema, as it only produces part of its columns.
+        Arguments:
+            featurizer_ids: Identifiers as returned by "featurizer_ids".
+        Returns:
+            The copy of the preset.
+        """
+        featurizer_ids = set(featurizer_ids)
+        preset = copy.copy(self)
+        for attributes in self.group_featurizers.values():
+            for attribute in attributes:
+                setattr(preset, attribute, tuple(
+                    featurizer for featurizer in getattr(self, attribute) or ()
+                    if self._featurizer_id(attribute, featurizer) in featurizer_ids
+                ))
+        preset._pool = None
+        preset._group_executor = None
+        preset._schema = None
+        preset.conform_features = False
+        return preset
+
+    def postprocess(self, group: str, df: pd.DataFrame) -> pd.DataFrame:
+        """ Post-process the raw features of a group, e.g. encode categorical
+        features as numbers. Presets implement "postprocess_<group>"
+        methods, groups without one keep their raw features.
+        Arguments:
+            group: The featurizer group.
+            df: The raw features of the group.
+        Returns:
+            pandas.DataFrame: the post-processed features.
+        """
+        postprocess = getattr(self, "postprocess_" + group, None)
+        return df if postprocess is None else postprocess(df)
+
+    def _raw_feature_labels(self, group: str) -> List[str]:
+        """ The columns a group produces before post-processing. """
+        if group == "site":
+            return self._site_labels(self.site_aliases)
+        return ["{}|{}".format(featurizer.__class__.__name__, label)
+                for attribute in self.group_featurizers[group]
+                for featurizer in getattr(self, attribute) or ()
+                for label in featurizer.feature_labels()]
+
+    def feature_labels(self) -> List[str]:
+        """ The feature columns of the preset's tier in assembly order, from
+        the featurizers' "feature_labels" passed through the post-processing
+        of every group, independent of any featurized batch.
+        Raises:
+            NotFittedError: if a featurizer whose columns depend on its fit,
+                e.g. "CoulombMatrix", is not fitted, see "fit".
+        """
+        labels = []
+        for group in self.assembly_order:
+            if group not in self.groups or not self._has_featurizers(group):
+                continue
+            template = pd.DataFrame(np.nan, index=[0], columns=self._raw_feature_labels(group))
+            labels.extend(self.postprocess(group, template).columns)
+        return labels
+
+    def _unfitted_featurizers(self) -> List[str]:
+        """ The fittable featurizers of the tier "fit" has not fitted. Until
+        fitted, they are fitted to every batch, and their columns depend on
+        the batch at hand.
+        """
+        return [featurizer.__class__.__name__
+                for attribute, column in self.fit_attributes.items()
+                if column not in self._fitted_columns and
+                any(attribute in self.group_featurizers[group] for group in self.groups)
+                for featurizer in getattr(self, attribute) or () if self._fittable(featurizer)]
+
+    def get_schema(self) -> schema.FeatureSchema:
+        """ The feature schema of this preset version and tier. If the
+        version is not registered yet, it is built from "feature_labels"
+        and registered in the generated schemas, see
+        "schema.register_schema".
+        Returns:
+            The schema.
+        Raises:
+            NotFittedError: if the tier has fittable featurizers that "fit"
+                has not fitted, or loaded by "load_fitted".
+            ValueError: if the registered schema does not match the
+                "feature_labels".
+        """
+        unfitted = self._unfitted_featurizers()
+        if unfitted:
+            raise NotFittedError("The schema of {} depends on the fit of {}, call \"fit\" first."
+                                 .format(self.schema_name(), unfitted))
+        if self._schema is not None:
+            return self._schema
+        name = self.schema_preset()
+        labels = self.feature_labels()
+        registered = schema.load_schema(name, self.version)
+        if registered is None:
+            registered = schema.FeatureSchema.from_labels(labels, name, self.version,
+                                                          dtype=np.dtype(self.feature_dtype).name)
+            schema.register_schema(registered)
+        elif list(registered.columns) != labels:
+            # E.g. the featurizers were fitted again to other materials.
+            raise ValueError("Schema {} does not match the feature labels of the featurizers, "
+                             "bump the preset version.".format(registered.name))
+        self._schema = registered
+        return self._schema
+
+    def conform(self, df_featurized: pd.DataFrame) -> pd.DataFrame:
+        """ Conform a featurized batch to the feature schema, such that every
+        batch has the same ordered columns, dtypes and fill values.
+        """
+        return self.get_schema().conform(df_featurized, dtype=self.feature_dtype)
+
+    def start_pool(self, n_workers: Optional[int] = None, chunksize: int = 1,
+                   cost_model: Optional[costmodel.CostModel] = None,
+                   memory_limit: Optional[int] = None,
+                   timeout: Optional[float] = None):
+        """ Start a persistent pool of worker processes, each warmed once
+        with a copy of this preset. Until "stop_pool" is called, "featurize"
+        distributes the materials of every batch across the workers.
+        Arguments:
+            n_workers: The number of worker processes. If "None",
+            "os.cpu_count()" is used.
+            chunksize: The number of materials sent to a worker at a time.
+            cost_model: Optional model of the featurization time, used to
+            submit the materials longest predicted time first.
+            memory_limit: Optional ceiling in bytes on the memory a single
+            material may add to a worker.
+            timeout: Optional wall time in seconds a single material may
+            take. Materials exceeding either are aborted, see
+            "take_aborted".
+        """
+        self.stop_pool()
+        self._pool = workers.FeaturizerPool(self, n_workers=n_workers, chunksize=chunksize,
+                                            cost_model=cost_model, memory_limit=memory_limit,
+                                            timeout=timeout)
+
+    def take_aborted(self) -> List[Dict]:
+        """ Returns the records of the materials the worker pool aborted in
+        the last batch, for exceeding their memory ceiling or timeout, and
+        clears them. The aborted materials are left out of the batch.
+        """
+        if self._pool is None:
+            return []
+        aborted, self._pool.aborted = self._pool.aborted, []
+        return aborted
+
+    def stop_pool(self):
+        """ Shut down the persistent worker pool, if started. """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        if self._pool is None:
+            self.start_pool(self._n_jobs)
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_pool()
+        self.stop_group_executor()
+
+    def __getstate__(self):
+        # The pool and group executor stay with the parent process. The
+        # symmetry records are handed to workers per chunk instead.
+        state = self.__dict__.copy()
+        state.pop("_pool", None)
+        state.pop("_group_executor", None)
+        state.pop("_profiler", None)
+        if state.get("_symmetry_cache") is not None:
+            state["_symmetry_cache"] = cache.SymmetryCache(symprec=state["_symmetry_cache"].symprec)
+        return state
+
+    def _uses_symmetry(self, df: pd.DataFrame) -> bool:
+        """ Whether the symmetry cache is enabled and read by the structure
+        or site featurizers of the tier, which need the "structure" column.
+        Subsets featurizing e.g. the dos only have neither.
+        """
+        return (self._symmetry_cache is not None and "structure" in df.columns and
+                any(group in self.groups and self._has_featurizers(group) for group in ("structure", "site")))
+
     def featurize(self, df: pd.DataFrame) -> pd.DataFrame:
         """ Run all of the preset featurizers on the input dataframe.
+        If a worker pool is started, the materials are featurized across
+        its workers.
         Arguments:
             df: the input dataframe with a ""structure"" column
                 containing "pymatgen.Structure" objects.
         Returns:
             The featurized DataFrame.
         """
+        # Every structure is analysed once, in this process, such that the
+        # analyses end up in the cache that is saved.
+        symmetry_cache = self._symmetry_cache if self._uses_symmetry(df) else None
+        if symmetry_cache is not None:
+            symmetry_cache.analyse(df["structure"])
+
+        if self._pool is not None and self._profiler is None:
+            df_time, df_featurized = self._pool.featurize(df, symmetry_cache=symmetry_cache)
+            for updates in self._pool.take_cache_updates():
+                self.merge_cache_updates(updates)
+            if self.conform_features:
+                df_featurized = self.conform(df_featurized)
+            return df_time, df_featurized
+
+        if self._profiler is not None:
+            self._profiler.set_sizes(df["structure"])
+
         time0 = time.time()
-        df_composition    = self.featurize_composition(df)
+        if self.concurrent_groups and self._profiler is None:
+            results, group_times = self._featurize_groups_concurrently(df)
+        else:
+            results, group_times = self._featurize_groups_sequentially(df)
         time1 = time.time()
-        df_structure      = self.featurize_structure(df)
-        time2 = time.time()
-        df_site           = self.featurize_site(df)
-        time3 = time.time()
-        df_dos            = self.featurize_dos(df)
-        time4 = time.time()
-        df_bandstructure = self.featurize_bandstructure(df)
-        time5 = time.time()
-
-        df_featurized = df_dos.join(df_bandstructure
-                     .join(df_composition
-                     .join(df_structure
-                     .join(df_site,
-                     lsuffix="l"), rsuffix="r"), lsuffix="l"), rsuffix="r")
+
+        matrix, columns = assembly.assemble_features(
+            {group: results[group] for group in self.assembly_order if group in results}, df.index,
+            dtype=self.feature_dtype
+        )
+        df_featurized = assembly.to_frame(matrix, columns, df.index)
+        if self.conform_features:
+            df_featurized = self.conform(df_featurized)
 
         df_time = pd.DataFrame({})
-        df_time["composition"]   = [time1-time0]
-        df_time["structure"]     = [time2-time1]
-        df_time["site"]          = [time3-time2]
-        df_time["dos"]           = [time4-time3]
-        df_time["bandstructure"] = [time5-time4]
-        df_time["all"]           = [time5-time0]
+        for group in self.groups:
+            df_time[group] = [group_times[group]["run"]]
+        if self.concurrent_groups:
+            for group in self.groups:
+                df_time[group + ".queue"] = [group_times[group]["queue"]]
+            df_time["critical_path"] = [max(group_times[group]["queue"] + group_times[group]["run"]
+                                            for group in self.groups)]
+        df_time["all"]           = [time1-time0]
         df_time["df.rows"]       = [df_featurized.shape[0]]
         df_time["df.features"]   = [df_featurized.shape[1]]
 
         return df_time, df_featurized
 
+    def _featurize_group(self, group: str, df: pd.DataFrame) -> pd.DataFrame:
+        return getattr(self, "featurize_" + group)(df)
+
+    def _featurize_groups_sequentially(self, df: pd.DataFrame):
+        results, group_times = {}, {}
+        for group in self.groups:
+            start = time.time()
+            results[group] = self._featurize_group(group, df)
+            group_times[group] = {"queue": 0.0, "run": time.time()-start}
+        return results, group_times
+
+    def _featurize_groups_concurrently(self, df: pd.DataFrame):
+        """ Schedule the independent featurizer groups on a shared process
+        executor and join their results. Every group is sent a copy of the
+        preset, with the cache entries of the batch only, and the column it
+        reads. Besides the run time of each group, the time it waited in
+        the executor queue, including the transfer, is recorded.
+        """
+        groups = [group for group in self.groups if self._has_featurizers(group)]
+        # One process per group with featurizers in the tier, bounded by the
+        # number of CPUs, resized when the tier or featurizers change.
+        n_processes = max(1, min(len(groups), os.cpu_count() or 1))
+        if self._group_executor is not None and self._group_processes != n_processes:
+            self.stop_group_executor()
+        if self._group_executor is None:
+            self._group_executor = ProcessPoolExecutor(max_workers=n_processes)
+            self._group_processes = n_processes
+
+        preset = copy.copy(self)
+        preset.set_n_jobs(max(1, (self._n_jobs or os.cpu_count() or 1) // n_processes))
+        if self._composition_cache is not None and "structure" in df.columns:
+            preset._composition_cache = self._composition_cache.subset(
+                df["structure"].apply(lambda s: cache.composition_key(s.composition))
+            )
+        symmetry_records = None
+        if self._symmetry_cache is not None and "structure" in df.columns:
+            symmetry_records = self._symmetry_cache.records_for(df["structure"])
+
+        submitted = time.time()
+        futures = {group: self._group_executor.submit(workers._featurize_group, preset, group,
+                                                      df[[self.group_properties[group]]], symmetry_records)
+                   for group in groups}
+
+        results, group_times = {}, {}
+        for group in self.groups:
+            if group not in futures:
+                results[group], group_times[group] = pd.DataFrame([]), {"queue": 0.0, "run": 0.0}
+                continue
+            results[group], updates, run = futures[group].result()
+            self.merge_cache_updates(updates)
+            group_times[group] = {"queue": max(0.0, time.time() - submitted - run), "run": run}
+        return results, group_times
+
+    def stop_group_executor(self):
+        """ Shut down the processes of the concurrent groups, if started. """
+        if self._group_executor is not None:
+            self._group_executor.shutdown()
+            self._group_executor = None
+            self._group_processes = 0
+
     def _fit_apply_featurizers(
         self,
         df: pd.DataFrame,
         featurizers: Iterable[BaseFeaturizer],
         column: str,
-        fit_to_df: bool = True
+        fit_to_df: bool = True,
+        group: Optional[str] = None
     ) -> pd.DataFrame:
         """ For the list of featurizers, fit each to the chosen column of
         the input pd.DataFrame and then apply them as a MultipleFeaturizer.
@@ -122,16 +725,24 @@ class extendedMODFeaturizer(abc.ABC):
             fit_to_df: Whether or not to fit the featurizers to the
                 input dataframe. If not true, it will be assumed that
                 any featurizers that required fitting have already been
-                fitted.
+                fitted. Featurizers fitted once by "fit" are never fitted
+                to the input dataframe.
+            group: The featurizer group, recorded when profiling. Defaults
+                to the column name.
         Returns:
             pandas.DataFrame: the decorated DataFrame.
         """
         #LOG.info("Applying featurizers {} to column {}".format(featurizers, column))
-        if fit_to_df:
+        if fit_to_df and column not in self._fitted_columns:
             _featurizers = MultipleFeaturizer([feat.fit(df[column]) for feat in featurizers])
         else:
             _featurizers = MultipleFeaturizer(featurizers)
 
+        if self._profiler is not None:
+            return self._profiler.featurize_dataframe(
+                df, _featurizers.featurizers, column, group or column
+            )
+
         if self._n_jobs is not None:
             _featurizers.set_n_jobs(self._n_jobs)
 
@@ -139,41 +750,87 @@ class extendedMODFeaturizer(abc.ABC):
             df, column, multiindex=True, ignore_errors=True
         )
 
+    @staticmethod
+    def _project(df: pd.DataFrame, column: str) -> pd.DataFrame:
+        """ Select the single input column a featurizer group reads, keeping
+        the index. Only references to the objects in the column are copied,
+        never the large dos and bandstructure objects of other columns.
+        Objects loaded from the local object store are decoded here, such
+        that only the group reading them pays for it.
+        """
+        df = df[[column]]
+        if column in objects.LAZY_KINDS:
+            df = df.assign(**{column: objects.resolve(df[column])})
+        return df
+
     def featurize_composition(self, df: pd.DataFrame) -> pd.DataFrame:
         """ Decorate input "pandas.DataFrame" of structures with composition
         features from matminer, specified by the extendedMODFeaturizer preset.
         Currently applies the set of all matminer composition features.
+        If the composition cache is enabled, the featurizers only run for
+        compositions not seen before, and the cached features are broadcast
+        to every row.
         Arguments:
             df: the input dataframe with a ""structure"" column
                 containing "pymatgen.Structure" objects.
         Returns:
-            pandas.DataFrame: the decorated DataFrame, or an empty
-                DataFrame if no composition/oxidation featurizers
+            pandas.DataFrame: the composition features, indexed as the input,
+                or an empty DataFrame if no composition/oxidation featurizers
                 exist for this class.
         """
         if not (self.composition_featurizers or self.oxid_composition_featurizers):
             return pd.DataFrame([])
 
-        df = df.copy()
+        compositions = df["structure"].apply(lambda s: s.composition)
+
+        if self._composition_cache is None:
+            return self._featurize_compositions(compositions)
+
+        keys = compositions.apply(cache.composition_key)
+        unseen = self._composition_cache.missing(keys)
+        if unseen:
+            LOG.info("Featurizing {} unseen of {} compositions...".format(len(unseen), len(keys)))
+            first = keys.isin(unseen) & ~keys.duplicated()
+            df_unseen = self._featurize_compositions(compositions[first])
+            df_unseen.index = keys[first].values
+            self._composition_cache.add(df_unseen)
+
+        return self._composition_cache.lookup(keys)
+
+    def _featurize_compositions(self, compositions: pd.Series) -> pd.DataFrame:
+        """ Apply the composition and oxidation state featurizers.
+        Arguments:
+            compositions: "pymatgen.Composition" objects.
+        Returns:
+            pandas.DataFrame: the composition features, indexed as the input.
+        """
+        df = pd.DataFrame({"composition": compositions}, index=compositions.index)
 
         if self.composition_featurizers:
 
             LOG.info("Applying composition featurizers...")
-            df['composition'] = df['structure'].apply(lambda s: s.composition)
 
-            df = self._fit_apply_featurizers(df, self.composition_featurizers, "composition")
+            df = self._fit_apply_featurizers(df, self.composition_featurizers, "composition",
+                                             group="composition")
             #df = df.replace([np.inf, -np.inf, np.nan], 0)
             df = df.rename(columns={'Input Data': ''})
             df.columns = df.columns.map('|'.join).str.strip('|')
 
         if self.oxid_composition_featurizers:
             LOG.info("Applying oxidation state featurizers...")
-            df = CompositionToOxidComposition().featurize_dataframe(df, "composition")
-            df = self._fit_apply_featurizers(df, self.oxid_composition_featurizers, "composition_oxid")
+            if self._profiler is not None:
+                # The oxidation state guessing is timed as a featurizer of its own.
+                df = self._profiler.featurize_dataframe(
+                    df, [CompositionToOxidComposition()], "composition", "composition", multiindex=False
+                )
+            else:
+                df = CompositionToOxidComposition().featurize_dataframe(df, "composition")
+            df = self._fit_apply_featurizers(df, self.oxid_composition_featurizers, "composition_oxid",
+                                             group="composition")
             df = df.rename(columns={'Input Data': ''})
             df.columns = df.columns.map('|'.join).str.strip('|')
 
-        return df
+        return df.drop(columns=["composition", "composition_oxid"], errors="ignore")
 
     def featurize_structure(self, df: pd.DataFrame) -> pd.DataFrame:
         """ Decorate input "pandas.DataFrame" of structures with structural
@@ -183,18 +840,26 @@ class extendedMODFeaturizer(abc.ABC):
             df: the input dataframe with a ""structure"" column
                 containing "pymatgen.Structure" objects.
         Returns:
-            pandas.DataFrame: the decorated DataFrame.
+            pandas.DataFrame: the structure features, indexed as the input.
         """
 
         if not self.structure_featurizers:
             return pd.DataFrame([])
 
         LOG.info("Applying structure featurizers...")
-        df = df.copy()
-        df = self._fit_apply_featurizers(df, self.structure_featurizers, "structure")
+        structure_featurizers = self.structure_featurizers
+        if self._symmetry_cache is not None:
+            # Only the records of the batch, as the featurizers are pickled
+            # into matminer's worker processes.
+            structure_featurizers = symmetry.use_symmetry_cache(structure_featurizers,
+                                                                self._symmetry_cache.subset(df["structure"]))
+
+        df = self._project(df, "structure")
+        df = self._fit_apply_featurizers(df, structure_featurizers, "structure")
+        df = df.rename(columns={'Input Data': ''})
         df.columns = df.columns.map('|'.join).str.strip('|')
 
-        return df
+        return df.drop(columns=["structure"])
 
     def featurize_dos(self, df: pd.DataFrame) -> pd.DataFrame:
         """ Decorate input "pandas.DataFrame" of structures with density of state
@@ -203,13 +868,13 @@ class extendedMODFeaturizer(abc.ABC):
             df: the input dataframe with a "dos" column
                 containing "pymatgen.dos" objects.
         Returns:
-            pandas.DataFrame: the decorated DataFrame.
+            pandas.DataFrame: the density of state features, indexed as the input.
         """
         if not (self.dos_featurizers):
             return pd.DataFrame([])
 
         LOG.info("Applying dos featurizers...")
-        df = df.copy()
+        df = self._project(df, "dos")
 
         try:
             df = self._fit_apply_featurizers(df, self.dos_featurizers, "dos")
@@ -222,7 +887,7 @@ class extendedMODFeaturizer(abc.ABC):
         df = df.rename(columns={'Input Data': ''})
         df.columns = df.columns.map('|'.join).str.strip('|')
 
-        return df
+        return df.drop(columns=["dos"])
     def featurize_bandstructure(self, df:pd.DataFrame) -> pd.DataFrame:
         """ Decorate input "pandas.DataFrame" of structures with bandstructure
         features from matminer, specified by the extendedMODFeaturizer preset.
@@ -230,13 +895,13 @@ class extendedMODFeaturizer(abc.ABC):
             df: the input dataframe with a "bandstructure" column
                 containing "pymatgen.electronic_structure.bandstructure" objects.
         Returns:
-            pandas.DataFrame: the decorated DataFrame.
+            pandas.DataFrame: the bandstructure features, indexed as the input.
         """
         if not (self.band_featurizers):
             return pd.DataFrame([])
 
         LOG.info("Applying bandstructure featurizers...")
-        df = df.copy()
+        df = self._project(df, "bandstructure")
         try:
             df = self._fit_apply_featurizers(df, self.band_featurizers, "bandstructure")
         except:
@@ -246,10 +911,30 @@ class extendedMODFeaturizer(abc.ABC):
         df = df.rename(columns={'Input Data': ''})
         df.columns = df.columns.map('|'.join).str.strip('|')
 
-        return df
+        return df.drop(columns=["bandstructure"])
+
+    @staticmethod
+    def _site_prefix(fingerprint: BaseFeaturizer, aliases: Optional[Dict[str, str]] = None) -> str:
+        """ The prefix of the feature labels of a site featurizer. """
+        fingerprint_name = fingerprint.__class__.__name__
+        if aliases:
+            fingerprint_name = aliases.get(fingerprint_name, fingerprint_name)
+        if "|" not in fingerprint_name:
+            fingerprint_name += "|"
+        return fingerprint_name
+
+    def _site_labels(self, aliases: Optional[Dict[str, str]] = None) -> List[str]:
+        """ The labels of the site statistics, prefixed per site featurizer. """
+        return [self._site_prefix(fingerprint, aliases) + label
+                for fingerprint in self.site_featurizers
+                for label in SiteStatsFingerprint(fingerprint, stats=self.site_stats).feature_labels()]
+
     def featurize_site(self, df: pd.DataFrame, aliases: Optional[Dict[str, str]] = None) -> pd.DataFrame:
         """ Decorate input "pandas.DataFrame" of structures with site
         features, specified by the extendedMODFeaturizer preset.
+        If "symmetrize_sites" is set, only the symmetrically distinct sites
+        of each structure are featurized, and the statistics are weighted by
+        the site multiplicities.
         Arguments:
             df: the input dataframe with a ""structure"" column
                 containing "pymatgen.Structure" objects.
@@ -257,7 +942,7 @@ class extendedMODFeaturizer(abc.ABC):
                 names to new aliases, mostly used for
                 backwards-compatibility.
         Returns:
-            pandas.DataFrame: the decorated DataFrame.
+            pandas.DataFrame: the site features, indexed as the input.
         """
 
         if not self.site_featurizers:
@@ -265,26 +950,65 @@ class extendedMODFeaturizer(abc.ABC):
 
         LOG.info("Applying site featurizers...")
 
-        df = df.copy()
-        df.columns = ["Input data|" + x for x in df.columns]
+        # The input column needs a "|" to not be prefixed below.
+        df = self._project(df, "structure").rename(columns={"structure": "Input data|structure"})
 
-        for fingerprint in self.site_featurizers:
-            site_stats_fingerprint = SiteStatsFingerprint(
-                fingerprint,
-                stats=self.site_stats
+        if self.symmetrize_sites:
+            symmetrized_site_stats = site.SymmetrizedSiteStats(
+                self.site_featurizers,
+                [self._site_prefix(fingerprint, aliases) for fingerprint in self.site_featurizers],
+                stats=self.site_stats,
+                symmetry_cache=(self._symmetry_cache.subset(df["Input data|structure"])
+                                if self._symmetry_cache is not None else None)
             )
-            df = site_stats_fingerprint.featurize_dataframe(
+            if self._profiler is not None:
+                df = self._profiler.featurize_dataframe(
+                    df,
+                    [symmetrized_site_stats],
+                    "Input data|structure",
+                    "site",
+                    multiindex=False
+                )
+            else:
+                # In-process, such that the neighbor caches are shared.
+                symmetrized_site_stats.set_n_jobs(1)
+                df = symmetrized_site_stats.featurize_dataframe(
+                    df,
+                    "Input data|structure",
+                    multiindex=False,
+                    ignore_errors=True
+                )
+            site.log_neighbor_caches(symmetrized_site_stats.neighbor_caches)
+            return df.drop(columns=["Input data|structure"])
+
+        # Featurizers with the same neighbor finding method share the
+        # neighbor lists of the structure at hand. All site featurizers are
+        # applied to a structure before moving to the next, such that the
+        # neighbor caches, holding the current structure only, are hit.
+        site_featurizers, neighbor_caches = site.share_neighbors(self.site_featurizers)
+        site_stats_fingerprints = [SiteStatsFingerprint(shared_fingerprint, stats=self.site_stats)
+                                   for shared_fingerprint in site_featurizers]
+        labels = self._site_labels(aliases)
+        if self._profiler is not None:
+            df = self._profiler.featurize_dataframe(
                 df,
+                site_stats_fingerprints,
                 "Input data|structure",
-                multiindex=False,
-                ignore_errors=True
+                "site",
+                names=[fingerprint.__class__.__name__ for fingerprint in self.site_featurizers],
+                multiindex=False
             )
-
-            fingerprint_name = fingerprint.__class__.__name__
-            if aliases:
-                fingerprint_name = aliases.get(fingerprint_name, fingerprint_name)
-            if "|" not in fingerprint_name:
-                fingerprint_name += "|"
-            df.columns = [f"{fingerprint_name}{x}" if "|" not in x else x for x in df.columns]
-
-        return df
+        else:
+            # In-process, as the neighbor caches are only shared within a
+            # process. Pool workers featurize across materials instead.
+            # The rows are labelled here, as fingerprints share feature
+            # names, e.g. "CrystalNNFingerprint" and "ChemEnvSiteFingerprint",
+            # which "featurize_dataframe" can not tell apart.
+            multiple_featurizer = MultipleFeaturizer(site_stats_fingerprints, iterate_over_entries=True)
+            multiple_featurizer.set_n_jobs(1)
+            rows = multiple_featurizer.featurize_many(df["Input data|structure"], ignore_errors=True, pbar=False)
+            df = pd.concat([df, pd.DataFrame(rows, index=df.index, columns=labels)], axis=1)
+        df.columns = ["Input data|structure"] + labels
+
+        site.log_neighbor_caches(neighbor_caches)
+        return df.drop(columns=["Input data|structure"])
@@ -0,0 +1,212 @@
+import collections
+import json
+import os
+import threading
+import warnings
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from monty.json import MontyDecoder, MontyEncoder
+
+OBJECT_DIR = Path(__file__).resolve().parents[2] / "data" / "raw" / "objects"
+
+# Numeric lists of at least this size are stored as compressed arrays.
+_ARRAY_MIN_SIZE = 16
+
+# The kinds decoded on access only, as they are large and each read by a
+# single featurizer group.
+LAZY_KINDS = ("dos", "bandstructure")
+
+
+def _split_arrays(obj, arrays: Dict[str, np.ndarray]):
+    """ Replace the numeric lists of a serialized object, e.g. energies,
+    densities and eigenvalues, by references into "arrays".
+    """
+    if isinstance(obj, dict):
+        return {key: _split_arrays(value, arrays) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        if len(obj) > 0:
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    array = np.asarray(obj)
+            except (ValueError, TypeError):
+                array = None
+            if array is not None and array.dtype.kind in "biuf" and array.size >= _ARRAY_MIN_SIZE:
+                key = "a{}".format(len(arrays))
+                arrays[key] = array
+                return {"@array": key}
+        return [_split_arrays(value, arrays) for value in obj]
+    return obj
+
+
+def _join_arrays(obj, arrays: Dict[str, np.ndarray]):
+    """ Put the arrays referenced by "_split_arrays" back, as numpy arrays,
+    which the "from_dict" methods of the objects convert to anyway.
+    """
+    if isinstance(obj, dict):
+        if set(obj) == {"@array"}:
+            return arrays[obj["@array"]]
+        return {key: _join_arrays(value, arrays) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_join_arrays(value, arrays) for value in obj]
+    return obj
+
+
+class ObjectStore:
+    """ Local store of the downloaded Materials Project objects, such that
+    they are downloaded once and can be featurized again locally.
+    Every object is kept in "<kind>/<material_id>.npz": its serialized form
+    as a JSON skeleton, with the numeric arrays (energies, densities,
+    eigenvalues, projections) taken out and compressed. Objects the
+    Materials Project does not have, e.g. the band structure of many
+    materials, are marked by an empty "<kind>/<material_id>.absent" file,
+    such that they are not downloaded again either. Objects are decoded on
+    request. As a featurization reads every object once, none are kept in
+    memory by default.
+    Attributes:
+        directory: the directory of the store.
+        cache_size: the number of decoded objects kept in memory.
+    """
+
+    def __init__(self, directory: Path = OBJECT_DIR, cache_size: int = 0):
+        self.directory = Path(directory)
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, kind: str, material_id: str) -> Path:
+        return self.directory / kind / "{}.npz".format(material_id)
+
+    def absent_path(self, kind: str, material_id: str) -> Path:
+        return self.directory / kind / "{}.absent".format(material_id)
+
+    def is_absent(self, kind: str, material_id: str) -> bool:
+        return not self.path(kind, material_id).is_file() and self.absent_path(kind, material_id).is_file()
+
+    def has(self, kind: str, material_id: str) -> bool:
+        """ Whether the object is stored, or known to be absent. """
+        return self.path(kind, material_id).is_file() or self.absent_path(kind, material_id).is_file()
+
+    def complete(self, material_ids: Iterable[str], kinds: Iterable[str]) -> List[str]:
+        """ Returns the material ids of which every kind of object is stored. """
+        kinds = list(kinds)
+        return [mpid for mpid in material_ids if all(self.has(kind, mpid) for kind in kinds)]
+
+    def put(self, kind: str, material_id: str, obj):
+        """ Store an object, replacing a stored one. Missing objects, e.g.
+        materials without a band structure, are marked as absent.
+        """
+        path = self.path(kind, material_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if obj is None or (isinstance(obj, float) and np.isnan(obj)):
+            self.absent_path(kind, material_id).touch()
+            return
+        arrays = {}
+        skeleton = _split_arrays(obj.as_dict(), arrays)
+
+        tmp_path = path.with_name(path.stem + ".tmp.npz")
+        np.savez_compressed(tmp_path, skeleton=np.array(json.dumps(skeleton, cls=MontyEncoder)), **arrays)
+        os.replace(tmp_path, path)
+        if self.absent_path(kind, material_id).is_file():
+            os.remove(self.absent_path(kind, material_id))
+
+    def get(self, kind: str, material_id: str):
+        """ Decode a stored object, or take it from the memory cache.
+        Returns None for an object marked as absent.
+        """
+        if self.is_absent(kind, material_id):
+            return None
+        key = (kind, material_id)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        with np.load(self.path(kind, material_id), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files if name != "skeleton"}
+            skeleton = json.loads(str(data["skeleton"]))
+        obj = MontyDecoder().process_decoded(_join_arrays(skeleton, arrays))
+
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = obj
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return obj
+
+    def ref(self, kind: str, material_id: str) -> "ObjectRef":
+        return ObjectRef(self.directory, kind, material_id)
+
+    def put_frame(self, df: pd.DataFrame, kinds: Iterable[str]):
+        """ Store the objects of the given columns of a downloaded batch,
+        indexed by material id.
+        """
+        for kind in kinds:
+            for mpid, obj in df[kind].items():
+                self.put(kind, mpid, obj)
+
+    def load_frame(self, material_ids: Iterable[str], kinds: Iterable[str]) -> pd.DataFrame:
+        """ Load stored materials as a downloaded batch, indexed by material
+        id. The dos and band structure objects are only referenced, and
+        decoded when a featurizer group reads them.
+        """
+        material_ids = list(material_ids)
+        df = pd.DataFrame({"material_id": material_ids}, index=pd.Index(material_ids, name="material_id"))
+        for kind in kinds:
+            if kind in LAZY_KINDS:
+                df[kind] = [None if self.is_absent(kind, mpid) else self.ref(kind, mpid)
+                            for mpid in material_ids]
+            else:
+                df[kind] = [self.get(kind, mpid) for mpid in material_ids]
+        if "structure" in df.columns:
+            df["full_formula"] = df["structure"].apply(lambda s: s.composition.formula.replace(" ", ""))
+        return df
+
+
+# One store per directory and process, decoding the references of worker
+# processes without a memory cache, as every object is read once.
+_STORES: Dict[Path, ObjectStore] = {}
+
+
+class ObjectRef:
+    """ Reference to a stored object, decoded by "load". References are
+    cheap to pickle, such that pool workers decode the objects themselves.
+    """
+
+    __slots__ = ("directory", "kind", "material_id")
+
+    def __init__(self, directory: Path, kind: str, material_id: str):
+        self.directory = Path(directory)
+        self.kind = kind
+        self.material_id = material_id
+
+    def __getstate__(self) -> Tuple:
+        return self.directory, self.kind, self.material_id
+
+    def __setstate__(self, state: Tuple):
+        self.directory, self.kind, self.material_id = state
+
+    def __repr__(self) -> str:
+        return "ObjectRef({}, {})".format(self.kind, self.material_id)
+
+    def load(self):
+        store = _STORES.get(self.directory)
+        if store is None:
+            store = _STORES.setdefault(self.directory, ObjectStore(self.directory))
+        return store.get(self.kind, self.material_id)
+
+
+def resolve(values: pd.Series) -> pd.Series:
+    """ Decode the object references in a column, leaving other values. """
+    if not any(isinstance(value, ObjectRef) for value in values):
+        return values
+    return values.apply(lambda value: value.load() if isinstance(value, ObjectRef) else value)
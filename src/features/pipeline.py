@@ -0,0 +1,65 @@
+import queue
+import threading
+
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+from src.data.utils import LOG
+
+_DONE = object()
+
+
+class _DownloadError:
+    """ Carries an exception raised in the downloader thread over to the
+    consuming thread.
+    """
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def prefetch_batches(batches: Iterable[Any],
+                     download: Callable[[Any], Any],
+                     prefetch: int = 2) -> Iterator[Tuple[Any, Any]]:
+    """ Download batches on a background thread while the caller processes
+    the previous ones.
+    The downloader stage puts finished downloads into a bounded queue and
+    blocks once "prefetch" downloads are waiting, such that no more than
+    "prefetch" + 2 batches (waiting, being downloaded and being processed)
+    are held in memory at any time.
+    Arguments:
+        batches: iterable of batches, consumed lazily by the downloader.
+        download: function returning the downloaded objects of a batch.
+        prefetch: number of downloaded batches allowed to wait in the queue.
+            If 0, batches are downloaded on the calling thread, one at a
+            time, alternating with processing.
+    Yields:
+        Tuples of (batch, downloaded objects), in order of the batches.
+    """
+    if prefetch <= 0:
+        for batch in batches:
+            yield batch, download(batch)
+        return
+
+    downloaded = queue.Queue(maxsize=prefetch)
+
+    def downloader():
+        try:
+            for batch in batches:
+                downloaded.put((batch, download(batch)))
+        except BaseException as e:
+            downloaded.put(_DownloadError(e))
+        finally:
+            downloaded.put(_DONE)
+
+    thread = threading.Thread(target=downloader, name="downloader", daemon=True)
+    thread.start()
+
+    while True:
+        item = downloaded.get()
+        if item is _DONE:
+            break
+        if isinstance(item, _DownloadError):
+            raise item.exception
+        LOG.info("Downloaded batches waiting: {}".format(downloaded.qsize()))
+        yield item
+
+    thread.join()
@@ -7,7 +7,7 @@ from matminer.data_retrieval.retrieve_MP import MPDataRetrieval
 
 from src.features import featurizer
 from src.data.utils import LOG
-from src.features.utils.utils import clean_df
+from src.features.utils.utils import clean_df, expand_rdf, one_hot_elements, split_locations
 from datetime import datetime
 from tqdm import tqdm
 
@@ -129,50 +129,58 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
         BandFeaturizer(),
         BranchPointEnergy()
     )
-    def __init__(self, n_jobs=None):
-            self._n_jobs = n_jobs
+    site_aliases = {
+        "GeneralizedRadialDistributionFunction": "GeneralizedRDF",
+        "AGNIFingerprints": "AGNIFingerPrint",
+        "BondOrientationalParameter": "BondOrientationParameter",
+        "GaussianSymmFunc": "ChemEnvSiteFingerprint|GaussianSymmFunc",
+    }
+
+    def __init__(self, n_jobs=None, **kwargs):
+            super().__init__(n_jobs=n_jobs, **kwargs)
 
     def featurize_composition(self, df):
         """Applies the preset composition featurizers to the input dataframe,
         renames some fields and cleans the output dataframe.
         """
         df = super().featurize_composition(df)
+        return clean_df(self.postprocess_composition(df), self.feature_dtype)
 
-        _orbitals = {"s": 1, "p": 2, "d": 3, "f": 4}
-        df["AtomicOrbitals|HOMO_character"] = df["AtomicOrbitals|HOMO_character"].map(
-            _orbitals
-        )
-        df["AtomicOrbitals|LUMO_character"] = df["AtomicOrbitals|LUMO_character"].map(
-            _orbitals
-        )
-
-        df["AtomicOrbitals|HOMO_element"] = df["AtomicOrbitals|HOMO_element"].apply(
-            lambda x: -1 if not isinstance(x, str) else Element(x).Z
-        )
-        df["AtomicOrbitals|LUMO_element"] = df["AtomicOrbitals|LUMO_element"].apply(
-            lambda x: -1 if not isinstance(x, str) else Element(x).Z
-        )
-
-        return clean_df(df)
+    def postprocess_composition(self, df):
+        """Encodes the orbital characters and elements of the composition
+        features as numbers.
+        """
+        # Featurizers may be left out when featurizing a subset of the preset.
+        if "AtomicOrbitals|HOMO_character" in df.columns:
+            _orbitals = {"s": 1, "p": 2, "d": 3, "f": 4}
+            df["AtomicOrbitals|HOMO_character"] = df["AtomicOrbitals|HOMO_character"].map(
+                _orbitals
+            )
+            df["AtomicOrbitals|LUMO_character"] = df["AtomicOrbitals|LUMO_character"].map(
+                _orbitals
+            )
+
+            df["AtomicOrbitals|HOMO_element"] = df["AtomicOrbitals|HOMO_element"].apply(
+                lambda x: -1 if not isinstance(x, str) else Element(x).Z
+            )
+            df["AtomicOrbitals|LUMO_element"] = df["AtomicOrbitals|LUMO_element"].apply(
+                lambda x: -1 if not isinstance(x, str) else Element(x).Z
+            )
+
+        return df
 
     def featurize_structure(self, df):
         """Applies the preset structural featurizers to the input dataframe,
         renames some fields and cleans the output dataframe.
         """
         df = super().featurize_structure(df)
+        return clean_df(self.postprocess_structure(df), self.feature_dtype)
 
-        dist = df["RadialDistributionFunction|radial distribution function"].iloc[0][
-            "distances"
-        ][:50]
-        for i, d in enumerate(dist):
-            _rdf_key = "RadialDistributionFunction|radial distribution function|d_{:.2f}".format(
-                d
-            )
-            df[_rdf_key] = df[
-                "RadialDistributionFunction|radial distribution function"
-            ].apply(lambda x: x["distribution"][i])
-
-        df = df.drop("RadialDistributionFunction|radial distribution function", axis=1)
+    def postprocess_structure(self, df):
+        """Expands the radial distribution function and encodes the crystal
+        system as numbers.
+        """
+        df = expand_rdf(df, "RadialDistributionFunction|radial distribution function", n_bins=50)
 
         _crystal_system = {
             "cubic": 1,
@@ -192,14 +200,15 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
             else:
                 return 0
 
-        df["GlobalSymmetryFeatures|crystal_system"] = df[
-            "GlobalSymmetryFeatures|crystal_system"
-        ].map(_crystal_system)
-        df["GlobalSymmetryFeatures|is_centrosymmetric"] = df[
-            "GlobalSymmetryFeatures|is_centrosymmetric"
-        ].map(_int_map)
+        if "GlobalSymmetryFeatures|crystal_system" in df.columns:
+            df["GlobalSymmetryFeatures|crystal_system"] = df[
+                "GlobalSymmetryFeatures|crystal_system"
+            ].map(_crystal_system)
+            df["GlobalSymmetryFeatures|is_centrosymmetric"] = df[
+                "GlobalSymmetryFeatures|is_centrosymmetric"
+            ].map(_int_map)
 
-        return clean_df(df)
+        return df
 
     def featurize_dos(self, df):
         """Applies the presetdos featurizers to the input dataframe,
@@ -207,36 +216,32 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
         """
 
         df = super().featurize_dos(df)
+        return clean_df(self.postprocess_dos(df), self.feature_dtype)
 
+    def postprocess_dos(self, df):
+        """One-hot encodes the band edge species, encodes the orbital
+        characters as numbers and splits the band edge locations.
+        """
 
         hotencodeColumns = ["DOSFeaturizer|vbm_specie_1","DOSFeaturizer|cbm_specie_1"]
 
-        one_hot = pd.get_dummies(df[hotencodeColumns])
-        df = df.drop(hotencodeColumns, axis = 1).join(one_hot)
+        df = one_hot_elements(df, hotencodeColumns)
 
         _orbitals = {"s": 1, "p": 2, "d": 3, "f": 4}
 
-        df["DOSFeaturizer|vbm_character_1"] = df[
-           "DOSFeaturizer|vbm_character_1"
-           ].map(_orbitals)
-        df["DOSFeaturizer|cbm_character_1"] = df[
-           "DOSFeaturizer|cbm_character_1"
-           ].map(_orbitals)
+        if "DOSFeaturizer|vbm_character_1" in df.columns:
+            df["DOSFeaturizer|vbm_character_1"] = df[
+               "DOSFeaturizer|vbm_character_1"
+               ].map(_orbitals)
+            df["DOSFeaturizer|cbm_character_1"] = df[
+               "DOSFeaturizer|cbm_character_1"
+               ].map(_orbitals)
 
         # Splitting one feature into several floating features
         # e.g. number;number;number into three columns
         splitColumns = ["DOSFeaturizer|cbm_location_1", "DOSFeaturizer|vbm_location_1"]
 
-        for column in splitColumns:
-            try:
-                newColumns = df[column].str.split(";", n = 2, expand = True)
-                for i in range(0,3):
-                    df[column + "_" + str(i)] = np.array(newColumns[i]).astype(np.float)
-            except:
-                continue
-        df = df.drop(splitColumns, axis=1)
-        df = df.drop(["dos"], axis=1)
-        return clean_df(df)
+        return split_locations(df, splitColumns, n=3)
 
     def featurize_bandstructure(self, df):
         """Applies the preset band structure featurizers to the input dataframe,
@@ -244,6 +249,10 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
         """
 
         df = super().featurize_bandstructure(df)
+        return clean_df(self.postprocess_bandstructure(df), self.feature_dtype)
+
+    def postprocess_bandstructure(self, df):
+        """Encodes whether the gap is direct as a number."""
 
         def _int_map(x):
             if str(x) == "False":
@@ -251,14 +260,12 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
             elif str(x) == "True":
                 return 1
 
-        df["BandFeaturizer|is_gap_direct"] = df[
-            "BandFeaturizer|is_gap_direct"
-        ].map(_int_map)
-
+        if "BandFeaturizer|is_gap_direct" in df.columns:
+            df["BandFeaturizer|is_gap_direct"] = df[
+                "BandFeaturizer|is_gap_direct"
+            ].map(_int_map)
 
-        df = df.drop(["bandstructure"], axis=1)
-
-        return clean_df(df)
+        return df
 
 
     def featurize_site(self, df):
@@ -266,13 +273,6 @@ class FUTURE_PROSPECTS_2021(featurizer.extendedMODFeaturizer):
         renames some fields and cleans the output dataframe.
         """
 
-        aliases = {
-            "GeneralizedRadialDistributionFunction": "GeneralizedRDF",
-            "AGNIFingerprints": "AGNIFingerPrint",
-            "BondOrientationalParameter": "BondOrientationParameter",
-            "GaussianSymmFunc": "ChemEnvSiteFingerprint|GaussianSymmFunc",
-        }
-        df = super().featurize_site(df, aliases=aliases)
-        df = df.loc[:, (df != 0).any(axis=0)]
+        df = super().featurize_site(df, aliases=self.site_aliases)
 
-        return clean_df(df)
+        return clean_df(df, self.feature_dtype)
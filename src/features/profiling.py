@@ -0,0 +1,163 @@
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+_SIZE_BINS = (0, 10, 25, 50, 100, 200, np.inf)
+
+
+class FeaturizerProfiler:
+    """ Records the cost of every individual featurizer on every material.
+    Each record holds the wall time, the CPU time of the featurizing thread,
+    whether the featurizer failed, and the number of sites and elements of
+    the material, such that the cost can be related to the structure size.
+    Recording is thread safe, as featurizer groups may run concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: Dict[str, List] = {key: [] for key in
+            ("material_id", "group", "featurizer", "wall", "cpu", "failed", "nsites", "nelements")}
+        self._sizes: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._records["material_id"])
+
+    def set_sizes(self, structures: pd.Series):
+        """ Register the number of sites and elements of the materials of
+        the current batch.
+        Arguments:
+            structures: "pymatgen.Structure" objects indexed by material id.
+        """
+        sizes = {mpid: (len(s), len(s.composition.elements)) for mpid, s in structures.items()}
+        with self._lock:
+            self._sizes.update(sizes)
+
+    def record(self, material_id: str, group: str, featurizer: str,
+               wall: float, cpu: float, failed: bool):
+        nsites, nelements = self._sizes.get(material_id, (-1, -1))
+        with self._lock:
+            for key, value in (("material_id", material_id), ("group", group),
+                               ("featurizer", featurizer), ("wall", wall), ("cpu", cpu),
+                               ("failed", failed), ("nsites", nsites), ("nelements", nelements)):
+                self._records[key].append(value)
+
+    def featurize_dataframe(self,
+                            df: pd.DataFrame,
+                            featurizers: Iterable,
+                            column: str,
+                            group: str,
+                            names: Optional[List[str]] = None,
+                            multiindex: bool = True) -> pd.DataFrame:
+        """ Apply the featurizers to a column one material at a time, timing
+        every featurizer on every material. The output is labelled as by
+        matminer's "featurize_dataframe" with "ignore_errors=True", but a
+        failing featurizer yields NaN for its own features only.
+        Featurizers wrapping several others, like "SymmetrizedSiteStats",
+        may report the (name, wall, cpu, failed) of their parts in a
+        "last_timings" attribute, which are then recorded instead.
+        Arguments:
+            df: the DataFrame to featurize, indexed by material id.
+            featurizers: the matminer featurizers to apply.
+            column: the name of the input column.
+            group: the featurizer group, used in the records.
+            names: the names recorded for the featurizers. Defaults to their
+                class names.
+            multiindex: whether or not to label the columns with a
+                (featurizer, feature) MultiIndex, as matminer does.
+        Returns:
+            The input DataFrame with the feature columns appended.
+        """
+        featurizers = list(featurizers)
+        names = names or [f.__class__.__name__ for f in featurizers]
+        labels = [f.feature_labels() for f in featurizers]
+
+        rows = []
+        for mpid, x in df[column].items():
+            row = []
+            for featurizer, name, feature_labels in zip(featurizers, names, labels):
+                wall0, cpu0 = time.perf_counter(), time.thread_time()
+                failed = False
+                try:
+                    values = featurizer.featurize(x)
+                except Exception:
+                    values = [np.nan] * len(feature_labels)
+                    failed = True
+                parts = getattr(featurizer, "last_timings", None)
+                if parts and not failed:
+                    for part, wall, cpu, part_failed in parts:
+                        self.record(mpid, group, part, wall, cpu, part_failed)
+                else:
+                    self.record(mpid, group, name, time.perf_counter()-wall0, time.thread_time()-cpu0, failed)
+                row.extend(values)
+            rows.append(row)
+
+        if multiindex:
+            columns = pd.MultiIndex.from_tuples(
+                [(f.__class__.__name__, label) for f, feature_labels in zip(featurizers, labels)
+                 for label in feature_labels]
+            )
+            df = df.copy()
+            df.columns = pd.MultiIndex.from_tuples([("Input Data", c) for c in df.columns])
+        else:
+            columns = [label for feature_labels in labels for label in feature_labels]
+
+        return pd.concat([df, pd.DataFrame(rows, index=df.index, columns=columns)], axis=1)
+
+    def frame(self) -> pd.DataFrame:
+        """ Returns the records as a compact columnar DataFrame. """
+        with self._lock:
+            df = pd.DataFrame({key: list(values) for key, values in self._records.items()})
+        return df.astype({
+            "material_id": "category",
+            "group":       "category",
+            "featurizer":  "category",
+            "wall":        np.float32,
+            "cpu":         np.float32,
+            "failed":      bool,
+            "nsites":      np.int32,
+            "nelements":   np.int16,
+        })
+
+    def write(self, path: Path):
+        """ Write the records to a compressed pickle, e.g. "profile.pkl.gz". """
+        self.frame().to_pickle(path)
+        LOG.info("Wrote {} featurizer timings to {}".format(len(self), path))
+
+    def summary(self) -> pd.DataFrame:
+        """ Summarise the cost of every featurizer versus structure size.
+        Returns:
+            A DataFrame indexed by (group, featurizer) with the number of
+            calls and failures, the total and mean wall and CPU time, the
+            mean wall time per range of "nsites", and the exponent b of a
+            fitted power law wall ~ nsites**b.
+        """
+        df = self.frame()
+        grouped = df.groupby(["group", "featurizer"], observed=True)
+
+        summary = grouped.agg(calls=("wall", "size"),
+                              failures=("failed", "sum"),
+                              wall_total=("wall", "sum"),
+                              wall_mean=("wall", "mean"),
+                              cpu_total=("cpu", "sum"),
+                              cpu_mean=("cpu", "mean"))
+
+        df["nsites_bin"] = pd.cut(df["nsites"], _SIZE_BINS)
+        by_size = df.pivot_table(index=["group", "featurizer"], columns="nsites_bin",
+                                 values="wall", aggfunc="mean", observed=True)
+        by_size.columns = ["wall_mean|nsites {}".format(c) for c in by_size.columns]
+
+        def _exponent(records):
+            valid = records[(records["nsites"] > 0) & (records["wall"] > 0)]
+            if valid["nsites"].nunique() < 2:
+                return np.nan
+            return np.polyfit(np.log(valid["nsites"]), np.log(valid["wall"]), 1)[0]
+
+        summary["nsites_exponent"] = grouped.apply(_exponent)
+        return summary.join(by_size).sort_values("wall_total", ascending=False)
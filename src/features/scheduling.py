@@ -0,0 +1,200 @@
+import collections
+import random
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from src.data.utils import LOG
+
+NETWORK    = "network"
+FEATURIZER = "featurizer"
+MEMORY     = "memory"
+TIMEOUT    = "timeout"
+MISSING    = "missing"
+
+_NETWORK_MODULES = ("requests", "urllib", "urllib3", "http", "socket", "ssl")
+_NETWORK_ERRORS  = ("MPRestError", "AFLOWmlAPIError")
+
+
+class MissingMaterialError(LookupError):
+    """ Raised for materials of a batch that the Materials Project response
+    left out, e.g. ones deprecated since the ids were queried.
+    """
+
+
+def classify_error(error: BaseException) -> str:
+    """ Classify an exception raised while downloading or featurizing a
+    batch as a network, memory, missing material or featurizer error.
+    Arguments:
+        error: the raised exception.
+    Returns:
+        One of "network", "memory", "missing" or "featurizer".
+    """
+    if isinstance(error, MemoryError):
+        return MEMORY
+    if isinstance(error, MissingMaterialError):
+        return MISSING
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return NETWORK
+    for cls in type(error).__mro__:
+        if cls.__name__ in _NETWORK_ERRORS or \
+           cls.__module__.split(".")[0] in _NETWORK_MODULES:
+            return NETWORK
+    return FEATURIZER
+
+
+class RetryScheduler:
+    """ Work queue of material ids with a bounded number of attempts per
+    material and exponential backoff between them.
+    Materials of a failed batch are deferred to the end of the queue and
+    become ready again after a backoff delay, such that healthy materials
+    keep flowing in the meantime. After a featurizer or memory error in a
+    batch of several materials, the batch is split and its materials are
+    retried one by one to isolate the culprit, without charging any of them
+    an attempt. Only failures of a single material, network errors and
+    materials missing from the response count as attempts. A material that fails "max_attempts" times is given
+    up and reported in "failed".
+    The scheduler is thread safe, such that a downloader thread may take
+    batches while the featurizing thread reports their outcome.
+    Attributes:
+        max_attempts: number of attempts per material before giving up.
+        base_delay: backoff in seconds after the first failure, doubled
+            for every following failure of the same material.
+        max_delay: upper bound on the backoff in seconds.
+        failed: material id -> (error class, error message) of the
+            materials that were given up.
+    """
+
+    def __init__(self,
+                 material_ids: Iterable[str],
+                 max_attempts: int = 3,
+                 base_delay: float = 5.0,
+                 max_delay: float = 300.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._queue = collections.deque(material_ids)
+        self._attempts: Dict[str, int] = collections.Counter()
+        self._not_before: Dict[str, float] = {}
+        self._isolated = set()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+        self.failed: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._queue) + self._in_flight
+
+    def next_batch(self, size: int) -> Optional[List[str]]:
+        """ Take up to "size" ready materials from the front of the queue.
+        Waits while no material is ready, either because all are backing
+        off or because the outcome of batches in flight is still unknown.
+        Arguments:
+            size: the maximum number of materials in the batch.
+        Returns:
+            A list of material ids, or None when all work is done.
+        """
+        with self._condition:
+            while True:
+                if not self._queue and self._in_flight == 0:
+                    return None
+
+                now = time.time()
+                batch = []
+                for _ in range(len(self._queue)):
+                    mpid = self._queue.popleft()
+                    if self._not_before.get(mpid, 0) > now or \
+                       (mpid in self._isolated and batch):
+                        self._queue.append(mpid)
+                        continue
+                    batch.append(mpid)
+                    if mpid in self._isolated or len(batch) >= size:
+                        break
+
+                if batch:
+                    self._in_flight += len(batch)
+                    return batch
+
+                timeout = None
+                if self._queue:
+                    timeout = max(0, min(self._not_before.get(mpid, 0) for mpid in self._queue) - now)
+                self._condition.wait(timeout=timeout)
+
+    def success(self, batch: List[str]):
+        """ Report that the batch was featurized. """
+        with self._condition:
+            self._in_flight -= len(batch)
+            for mpid in batch:
+                self._not_before.pop(mpid, None)
+                self._isolated.discard(mpid)
+            self._condition.notify_all()
+
+    def failure(self, batch: List[str], error: BaseException, stage: str = ""):
+        """ Report that the batch failed. A batch of several materials
+        failing with a featurizer or memory error is split into singletons,
+        which are retried without backoff. Otherwise each material is
+        charged an attempt and deferred to the end of the queue with a
+        backoff, or given up if its attempt budget is spent.
+        Arguments:
+            batch: the material ids of the failed batch.
+            error: the raised exception.
+            stage: name of the failing stage, used for logging.
+        """
+        kind = classify_error(error)
+        LOG.info("{} error in {} of {}: {!r}".format(kind, stage or "batch", batch, error))
+
+        with self._condition:
+            self._in_flight -= len(batch)
+            if kind in (FEATURIZER, MEMORY) and len(batch) > 1:
+                # Which material failed is unknown, none is charged.
+                self._isolated.update(batch)
+                self._queue.extend(batch)
+                self._condition.notify_all()
+                return
+
+            now = time.time()
+            for mpid in batch:
+                self._attempts[mpid] += 1
+                attempts = self._attempts[mpid]
+                if attempts >= self.max_attempts:
+                    self.failed[mpid] = (kind, repr(error))
+                    self._not_before.pop(mpid, None)
+                    self._isolated.discard(mpid)
+                    LOG.info("Giving up on {} after {} attempts.".format(mpid, attempts))
+                    continue
+
+                delay = min(self.max_delay, self.base_delay * 2**(attempts - 1))
+                self._not_before[mpid] = now + delay * random.uniform(0.5, 1.0)
+                self._queue.append(mpid)
+            self._condition.notify_all()
+
+    def abort(self, mpid: str, kind: str, message: str):
+        """ Report that a material of a batch in flight was aborted for
+        exceeding its resources. It is given up without retrying, as it
+        would exceed them again.
+        Arguments:
+            mpid: the aborted material id.
+            kind: the exceeded resource, e.g. "memory" or "timeout".
+            message: the error message, including the measured cost.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._attempts[mpid] += 1
+            self.failed[mpid] = (kind, message)
+            self._not_before.pop(mpid, None)
+            self._isolated.discard(mpid)
+            self._condition.notify_all()
+
+    def failures_frame(self) -> pd.DataFrame:
+        """ Returns the given up materials with their attempts and errors. """
+        return pd.DataFrame({
+            "material_id": list(self.failed.keys()),
+            "attempts":    [self._attempts[mpid] for mpid in self.failed],
+            "error_class": [kind for kind, _ in self.failed.values()],
+            "error":       [message for _, message in self.failed.values()],
+        })
@@ -0,0 +1,170 @@
+import json
+import os
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+# Schemas committed along with the presets, read-only at runtime.
+SCHEMA_DIR = Path(__file__).resolve().parent / "schemas"
+# Schemas generated at runtime, e.g. of fitted presets, see "register_schema".
+GENERATED_DIR = Path(__file__).resolve().parents[2] / "data" / "interim" / "schemas"
+
+# Value of features a batch does not produce, as used by "clean_df".
+DEFAULT_FILL_VALUE = -1.0
+
+
+class FeatureSchema:
+    """ The column layout of the featurized data of one preset version: the
+    ordered feature names, their dtypes and the values filling features a
+    batch does not produce. Every featurized batch is conformed to it, such
+    that batches can be stacked as fixed-width arrays.
+    Attributes:
+        preset: the class name of the preset.
+        version: the version of the preset.
+        columns: the ordered feature names.
+        dtypes: the dtype of every feature.
+        fill_values: the fill value of every feature.
+    """
+
+    def __init__(self,
+                 preset: str,
+                 version: int,
+                 columns: List[str],
+                 dtypes: Dict[str, str],
+                 fill_values: Dict[str, float]):
+        self.preset = preset
+        self.version = version
+        self.columns = pd.Index(columns)
+        self.dtypes = dtypes
+        self.fill_values = fill_values
+
+        if not self.columns.is_unique:
+            raise ValueError("Schema {} has duplicate feature names.".format(self.name))
+
+        # A single dtype allows conforming through one preallocated array.
+        unique_dtypes = set(dtypes[column] for column in columns)
+        self._dtype = np.dtype(unique_dtypes.pop()) if len(unique_dtypes) == 1 else None
+        self._fill = np.array([fill_values[column] for column in columns],
+                              dtype=self._dtype if self._dtype is not None else float)
+
+    @property
+    def name(self) -> str:
+        return "{}-v{}".format(self.preset, self.version)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    @classmethod
+    def from_labels(cls, columns: List[str], preset: str, version: int, dtype: str = "float32",
+                    fill_value: float = DEFAULT_FILL_VALUE) -> "FeatureSchema":
+        """ Build a schema from the ordered feature names of a preset, as
+        returned by "extendedMODFeaturizer.feature_labels".
+        """
+        return cls(preset, version, list(columns),
+                   {column: dtype for column in columns},
+                   {column: fill_value for column in columns})
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, preset: str, version: int,
+                   fill_value: float = DEFAULT_FILL_VALUE) -> "FeatureSchema":
+        """ Derive a schema from the numeric columns of a featurized frame.
+        Only complete frames describe the layout, e.g. the full featurized
+        data set, never a single batch.
+        Raises:
+            ValueError: if the frame has no rows or numeric columns, or a
+                feature no material of the frame has a value of.
+        """
+        df = df.select_dtypes(include="number")
+        if df.shape[0] == 0 or df.shape[1] == 0:
+            raise ValueError("Can not derive schema {}-v{} from an empty frame.".format(preset, version))
+        partial = df.columns[df.isna().all().to_numpy()]
+        if len(partial):
+            raise ValueError("Can not derive schema {}-v{} from a partial frame, missing values of {}"
+                             .format(preset, version, list(partial)))
+        return cls(preset, version, list(df.columns),
+                   {column: str(dtype) for column, dtype in df.dtypes.items()},
+                   {column: fill_value for column in df.columns})
+
+    def to_dict(self) -> Dict:
+        return {"preset": self.preset, "version": self.version, "columns": list(self.columns),
+                "dtypes": self.dtypes, "fill_values": self.fill_values}
+
+    def conform(self, df: pd.DataFrame, dtype: Optional[np.dtype] = None) -> pd.DataFrame:
+        """ Conform a featurized batch to the schema: missing features are
+        added, features outside the schema are left out, the columns are
+        ordered as in the schema and missing values are filled.
+        Arguments:
+            df: the featurized batch.
+            dtype: optional float dtype overriding the dtypes of the schema,
+                e.g. np.float64 for reproducibility checks.
+        Returns:
+            The conformed batch, with the same index.
+        """
+        extra = df.columns.difference(self.columns)
+        if len(extra):
+            LOG.info("Leaving out {} features not in schema {}: {}".format(len(extra), self.name, list(extra)))
+
+        dtype = np.dtype(dtype) if dtype is not None else self._dtype
+        if dtype is None:
+            df = df.reindex(columns=self.columns).fillna(self.fill_values)
+            return df.astype(self.dtypes)
+
+        positions = df.columns.get_indexer(self.columns)
+        present = positions >= 0
+        if not present.all():
+            LOG.info("Filling {} features missing from the batch.".format(int((~present).sum())))
+
+        matrix = np.empty((df.shape[0], len(self.columns)), dtype=dtype)
+        matrix[:] = self._fill
+        if present.any():
+            matrix[:, present] = df.iloc[:, positions[present]].to_numpy(dtype=dtype, na_value=np.nan)
+
+        missing = np.isnan(matrix) if dtype.kind == "f" else None
+        if missing is not None and missing.any():
+            matrix[missing] = np.broadcast_to(self._fill, matrix.shape)[missing]
+        return pd.DataFrame(matrix, index=df.index, columns=self.columns, copy=False)
+
+
+def schema_path(preset: str, version: int, directory: Optional[Path] = None) -> Path:
+    return Path(directory or GENERATED_DIR) / "{}-v{}.json".format(preset, version)
+
+
+def load_schema(preset: str, version: int, directory: Optional[Path] = None) -> Optional[FeatureSchema]:
+    """ Returns the registered schema of a preset version, or None. Without
+    a directory, the committed schemas are looked up before the generated.
+    """
+    directories = [directory] if directory else [SCHEMA_DIR, GENERATED_DIR]
+    for path in (schema_path(preset, version, directory) for directory in directories):
+        if path.is_file():
+            with open(path, "r") as f:
+                description = json.load(f)
+            return FeatureSchema(**description)
+    return None
+
+
+def register_schema(schema: FeatureSchema, directory: Optional[Path] = None) -> Path:
+    """ Write a schema to the registry, by default the directory of the
+    generated schemas, never the committed schemas in the package. A
+    registered version is never overwritten; a changed layout needs a new
+    preset version.
+    Raises:
+        FileExistsError: if the preset version is registered already.
+    """
+    if directory is None and load_schema(schema.preset, schema.version) is not None:
+        raise FileExistsError("Schema {} is registered already".format(schema.name))
+    path = schema_path(schema.preset, schema.version, directory)
+    if path.is_file():
+        raise FileExistsError("Schema {} is registered already in {}".format(schema.name, path))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(schema.to_dict(), f, indent=1)
+    os.replace(tmp_path, path)
+    LOG.info("Registered schema {} with {} features in {}".format(schema.name, len(schema), path))
+    return path
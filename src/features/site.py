@@ -0,0 +1,236 @@
+import copy
+import time
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from matminer.featurizers.base import BaseFeaturizer
+from matminer.featurizers.structure import SiteStatsFingerprint
+from matminer.featurizers.utils.stats import PropertyStats
+from pymatgen.analysis.local_env import NearNeighbors
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from src.data.utils import LOG
+from src.features.cache import SymmetryCache, featurizer_signature
+
+# Attributes holding the neighbor finding method of site featurizers, e.g.
+# "AverageBondAngle.method" and "CoordinationNumber.nn".
+_NEIGHBOR_ATTRIBUTES = ("method", "nn")
+
+
+class CachedNearNeighbors(NearNeighbors):
+    """ Neighbor finding method computing the neighbors of all sites of a
+    structure at once, and serving every site of that structure from the
+    cache. Only the current structure is kept, such that the memory is
+    bounded by the neighbor lists of a single structure.
+    With "per_site", only the neighbors of the requested sites are
+    computed, e.g. the representatives of the symmetrically distinct sites.
+    Attributes:
+        nn: the wrapped "pymatgen.analysis.local_env.NearNeighbors".
+        per_site: whether or not to compute the neighbors site by site.
+        hits: the number of site lookups served from the cache.
+        misses: the number of lookups computing neighbor lists, of a
+            structure, or of a site with "per_site".
+    """
+
+    def __init__(self, nn: NearNeighbors, per_site: bool = False):
+        self.nn = nn
+        self.per_site = per_site
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    @property
+    def structures_allowed(self) -> bool:
+        return self.nn.structures_allowed
+
+    @property
+    def molecules_allowed(self) -> bool:
+        return self.nn.molecules_allowed
+
+    @property
+    def extend_structure_molecules(self) -> bool:
+        return self.nn.extend_structure_molecules
+
+    def clear(self):
+        """ Evict the cached structure. """
+        self._structure = None
+        self._nn_info = None
+        self._site_nn_info = {}
+
+    def get_all_nn_info(self, structure) -> List[List[Dict]]:
+        if self.per_site:
+            return [self.get_nn_info(structure, n) for n in range(len(structure))]
+        if structure is not self._structure:
+            # A reference is kept, such that the identity check holds.
+            self._nn_info = self.nn.get_all_nn_info(structure)
+            self._structure = structure
+            self.misses += 1
+        else:
+            self.hits += 1
+        return self._nn_info
+
+    def get_nn_info(self, structure, n: int) -> List[Dict]:
+        if not self.per_site:
+            return self.get_all_nn_info(structure)[n]
+        if structure is not self._structure:
+            self._site_nn_info = {}
+            self._structure = structure
+        if n not in self._site_nn_info:
+            self._site_nn_info[n] = self.nn.get_nn_info(structure, n)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return self._site_nn_info[n]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_structure"], state["_nn_info"], state["_site_nn_info"] = None, None, {}
+        return state
+
+
+def share_neighbors(fingerprints: Iterable[BaseFeaturizer],
+                    per_site: bool = False) -> Tuple[List[BaseFeaturizer], List[CachedNearNeighbors]]:
+    """ Let the site featurizers share one neighbor cache per distinct
+    neighbor finding method. The featurizers are copied, leaving the
+    featurizers of the preset untouched. As a cache only holds the current
+    structure, all site featurizers must be applied to a structure before
+    moving to the next, in the same process.
+    Arguments:
+        fingerprints: the site featurizers.
+        per_site: whether or not the caches compute the neighbors of the
+            requested sites only, see "CachedNearNeighbors".
+    Returns:
+        The site featurizers using the caches, and the caches.
+    """
+    caches = {}
+    shared = []
+    for fingerprint in fingerprints:
+        shared_fingerprint = fingerprint
+        for attribute in _NEIGHBOR_ATTRIBUTES:
+            nn = getattr(fingerprint, attribute, None)
+            if not isinstance(nn, NearNeighbors) or isinstance(nn, CachedNearNeighbors):
+                continue
+            key = featurizer_signature([nn])
+            if key not in caches:
+                caches[key] = CachedNearNeighbors(nn, per_site=per_site)
+            if shared_fingerprint is fingerprint:
+                shared_fingerprint = copy.copy(fingerprint)
+                # Labels may name the neighbor finding method, as for
+                # "CoordinationNumber", and must not change.
+                shared_fingerprint.feature_labels = fingerprint.feature_labels
+            setattr(shared_fingerprint, attribute, caches[key])
+        shared.append(shared_fingerprint)
+    return shared, list(caches.values())
+
+
+def log_neighbor_caches(caches: Iterable[CachedNearNeighbors]):
+    for neighbor_cache in caches:
+        lookups = neighbor_cache.hits + neighbor_cache.misses
+        LOG.info("Neighbor cache {}: {} lookups, {} computed, hit rate {:.1%}".format(
+            neighbor_cache.nn.__class__.__name__, lookups, neighbor_cache.misses,
+            neighbor_cache.hits / lookups if lookups else 0.0))
+        neighbor_cache.clear()
+
+
+class SymmetrizedSiteStats(BaseFeaturizer):
+    """ Site statistics of several site featurizers, computed from the
+    symmetrically distinct sites of a structure only.
+    Symmetrically equivalent sites have identical local environments, such
+    that the statistics of "SiteStatsFingerprint" over all sites equal the
+    statistics over the features of the distinct sites, each repeated by
+    its multiplicity. Weighting by the multiplicities instead would not do,
+    as "PropertyStats" computes the weighted standard deviation with the
+    unbiased estimator.
+    The cost thereby scales with the number of distinct sites instead of the
+    size of the cell. All site featurizers are applied to one structure
+    before moving to the next, and a failing site featurizer only yields
+    NaN for its own features.
+    Attributes:
+        fingerprints: the site featurizers.
+        prefixes: the prefix of the feature labels of every site featurizer.
+        stats: the statistics computed over the sites.
+        symprec: the symmetry tolerance used to find the distinct sites.
+        symmetry_cache: optional cache of space group analyses to read the
+            distinct sites from. Its own tolerance is used if given.
+        neighbor_caches: the neighbor caches shared by the site featurizers.
+        last_timings: (name, wall, cpu, failed) of the symmetry analysis and
+            of every site featurizer in the last call of "featurize", such
+            that a profiler can record them separately.
+    """
+
+    def __init__(self,
+                 fingerprints: Iterable[BaseFeaturizer],
+                 prefixes: Iterable[str],
+                 stats: Tuple[str] = ("mean", "std_dev"),
+                 symprec: float = 0.01,
+                 symmetry_cache: Optional[SymmetryCache] = None):
+        # Only the representative sites are featurized, such that only
+        # their neighbors are computed.
+        self.fingerprints, self.neighbor_caches = share_neighbors(fingerprints, per_site=True)
+        self.prefixes = list(prefixes)
+        self.stats = tuple(stats)
+        self.symprec = symprec
+        self.symmetry_cache = symmetry_cache
+        self.last_timings = []
+
+        # Labels as produced by SiteStatsFingerprint, for compatibility.
+        self._labels = [SiteStatsFingerprint(fingerprint, stats=self.stats).feature_labels()
+                        for fingerprint in self.fingerprints]
+
+    def equivalent_sites(self, structure) -> Tuple[List[int], np.ndarray]:
+        """ Find one representative per set of symmetrically equivalent sites.
+        Arguments:
+            structure: a "pymatgen.Structure".
+        Returns:
+            The indices of the representative sites, and the number of sites
+            each of them represents.
+        """
+        try:
+            if self.symmetry_cache is not None:
+                groups = self.symmetry_cache.get(structure)["equivalent_indices"]
+            else:
+                symmetrized = SpacegroupAnalyzer(structure, symprec=self.symprec).get_symmetrized_structure()
+                groups = symmetrized.equivalent_indices
+        except Exception as e:
+            LOG.info("Symmetry analysis failed, using all sites: {!r}".format(e))
+            groups = [[i] for i in range(len(structure))]
+        return [group[0] for group in groups], np.array([len(group) for group in groups], dtype=int)
+
+    def featurize(self, structure) -> List[float]:
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        representatives, multiplicities = self.equivalent_sites(structure)
+        timings = [("equivalent_sites", time.perf_counter()-wall0, time.thread_time()-cpu0, False)]
+
+        features = []
+        for fingerprint, labels in zip(self.fingerprints, self._labels):
+            wall0, cpu0 = time.perf_counter(), time.thread_time()
+            failed = False
+            try:
+                site_features = np.array(
+                    [[0.0 if value is None else value for value in fingerprint.featurize(structure, i)]
+                     for i in representatives],
+                    dtype=float
+                )
+                site_features = np.repeat(site_features, multiplicities, axis=0)
+                features.extend(
+                    PropertyStats.calc_stat(site_features[:, j], stat)
+                    for j in range(site_features.shape[1]) for stat in self.stats
+                )
+            except Exception:
+                features.extend([np.nan] * len(labels))
+                failed = True
+            timings.append((fingerprint.__class__.__name__, time.perf_counter()-wall0,
+                            time.thread_time()-cpu0, failed))
+        self.last_timings = timings
+        return features
+
+    def feature_labels(self) -> List[str]:
+        return [prefix + label for prefix, labels in zip(self.prefixes, self._labels) for label in labels]
+
+    def citations(self) -> List[str]:
+        return [citation for fingerprint in self.fingerprints for citation in fingerprint.citations()]
+
+    def implementors(self) -> List[str]:
+        return ["Oliver Lerstøl Hebnes"]
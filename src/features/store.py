@@ -0,0 +1,340 @@
+import json
+import os
+import re
+
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.data.utils import LOG
+
+
+class FeatureStore:
+    """ Append-only store of featurized batches.
+    Every batch is written once as an immutable shard file, after which a
+    record listing its material ids is appended to a JSON-lines manifest.
+    A shard that is not referenced by the manifest (e.g. after a crash
+    between the two writes) is ignored. Resuming only needs the set of
+    completed material ids in the manifest, regardless of the order in
+    which they were featurized.
+    Materials removed from the Materials Project are tombstoned in a
+    separate JSON-lines log rather than rewritten out of their shards. A
+    tombstone hides the material until a later shard features it again.
+    Attributes:
+        directory: the directory holding the shards and the manifest.
+    """
+
+    _shard_pattern = re.compile(r"shard-(\d+)\.pkl$")
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.shard_dir = self.directory / "shards"
+        self.manifest_path = self.directory / "manifest.jsonl"
+        self.tombstone_path = self.directory / "tombstones.jsonl"
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+
+        self._records = self._read_manifest()
+        self._next_shard = self._find_next_shard()
+
+        # The position of the latest record of every material id, and the
+        # number of records when a material id was tombstoned.
+        self._latest: Dict[str, int] = {}
+        for position, record in enumerate(self._records):
+            self._index_record(position, record)
+        self._tombstones: Dict[str, int] = {}
+        for tombstone in self._read_lines(self.tombstone_path):
+            self._tombstones.update(dict.fromkeys(tombstone["material_ids"], tombstone["position"]))
+
+    @staticmethod
+    def _read_lines(path: Path) -> List[Dict]:
+        records = []
+        if not path.is_file():
+            return records
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # An interrupted append leaves a partial last line.
+                    LOG.info("Skipping corrupt line in {}".format(path))
+        return records
+
+    def _read_manifest(self) -> List[Dict]:
+        return self._read_lines(self.manifest_path)
+
+    def _index_record(self, position: int, record: Dict):
+        self._latest.update(dict.fromkeys(record["material_ids"], position))
+
+    def _find_next_shard(self) -> int:
+        numbers = [int(m.group(1)) for m in
+                   (self._shard_pattern.search(p.name) for p in self.shard_dir.iterdir()) if m]
+        return max(numbers, default=0) + 1
+
+    @staticmethod
+    def _append_line(path: Path, record: Dict):
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_manifest(self, record: Dict):
+        self._append_line(self.manifest_path, record)
+        self._records.append(record)
+        self._index_record(len(self._records) - 1, record)
+
+    def _rewrite_manifest(self):
+        """ Replace the manifest by the current records, e.g. after shards
+        were rewritten in place.
+        """
+        tmp_path = self.manifest_path.with_suffix(self.manifest_path.suffix + ".tmp")
+        with open(tmp_path, "w") as f:
+            for record in self._records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _write_atomic(df: pd.DataFrame, path: Path):
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    @property
+    def records(self) -> List[Dict]:
+        """ The manifest records of all shards, in order of writing. """
+        return list(self._records)
+
+    def _is_live(self, mpid: str) -> bool:
+        return self._latest[mpid] >= self._tombstones.get(mpid, 0)
+
+    def completed_ids(self) -> Set[str]:
+        """ Returns the material ids of every shard in the manifest, except
+        the tombstoned ones.
+        """
+        return {mpid for mpid in self._latest if self._is_live(mpid)}
+
+    def tombstoned_ids(self) -> Set[str]:
+        """ Returns the material ids hidden by a tombstone. """
+        return {mpid for mpid in self._tombstones if mpid in self._latest and not self._is_live(mpid)}
+
+    def tombstone(self, material_ids: List[str]):
+        """ Hide materials from the store, e.g. ones removed from the
+        Materials Project. Their shards are left untouched; "compact" leaves
+        them out, and a later shard featuring them again revives them.
+        """
+        material_ids = [str(mpid) for mpid in material_ids]
+        if not material_ids:
+            return
+        position = len(self._records)
+        self._append_line(self.tombstone_path, {
+            "material_ids": material_ids,
+            "position":     position,
+            "written":      datetime.now().isoformat(),
+        })
+        self._tombstones.update(dict.fromkeys(material_ids, position))
+        LOG.info("Tombstoned {} material ids".format(len(material_ids)))
+
+    def diff(self, material_ids: List[str], schema: Optional[str] = None) -> Dict[str, List[str]]:
+        """ Compare a set of material ids, e.g. the current ones of the
+        Materials Project, to the store, using the manifest only.
+        Arguments:
+            material_ids: the material ids the store should hold.
+            schema: the name of the current feature schema. Materials whose
+                latest shard follows another schema are stale. Shards
+                written before schemas were recorded are taken to follow
+                the current one, such that they are not all featurized
+                again.
+        Returns:
+            The "added" material ids missing from the store, the "stale"
+            ones featurized with another schema and the "removed" ones the
+            store holds beyond "material_ids".
+        """
+        material_ids = [str(mpid) for mpid in material_ids]
+        completed = self.completed_ids()
+
+        added = [mpid for mpid in material_ids if mpid not in completed]
+        stale = []
+        if schema is not None:
+            stale = [mpid for mpid in material_ids
+                     if mpid in completed and self._records[self._latest[mpid]].get("schema") not in (None, schema)]
+        removed = sorted(completed.difference(material_ids))
+        return {"added": added, "stale": stale, "removed": removed}
+
+    def write_shard(self,
+                    df_featurized: pd.DataFrame,
+                    df_time: Optional[pd.DataFrame] = None,
+                    schema: Optional[str] = None,
+                    featurizers: Optional[List[str]] = None) -> Path:
+        """ Write a featurized batch as a new shard and register it in the
+        manifest.
+        Arguments:
+            df_featurized: the featurized batch, indexed by material id.
+            df_time: optional timing information of the batch.
+            schema: the name of the feature schema the batch is conformed
+                to, if any.
+            featurizers: the identifiers of the featurizers that produced
+                the batch, recorded as provenance.
+        Returns:
+            The path to the written shard.
+        """
+        name = "shard-{:06d}".format(self._next_shard)
+        self._next_shard += 1
+
+        shard_path = self.shard_dir / (name + ".pkl")
+        self._write_atomic(df_featurized, shard_path)
+
+        timing = None
+        if df_time is not None:
+            timing = name + "-timing.pkl"
+            self._write_atomic(df_time, self.shard_dir / timing)
+
+        self._append_manifest({
+            "shard":        shard_path.name,
+            "timing":       timing,
+            "material_ids": [str(mpid) for mpid in df_featurized.index],
+            "rows":         int(df_featurized.shape[0]),
+            "schema":       schema,
+            "featurizers":  featurizers,
+            "written":      datetime.now().isoformat(),
+        })
+        return shard_path
+
+    def merge_columns(self,
+                      df_new: pd.DataFrame,
+                      featurizers: List[str],
+                      conform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                      schema: Optional[str] = None):
+        """ Merge the columns of newly applied featurizers into the shards,
+        matching rows by material id. Columns a shard already holds are
+        kept. Every touched shard is rewritten, and its manifest record
+        extended by the featurizers.
+        Arguments:
+            df_new: the new features, indexed by material id.
+            featurizers: the identifiers of the featurizers producing them.
+            conform: optional function conforming a merged shard, e.g. to the
+                feature schema of the extended preset.
+            schema: the name of the schema a conformed shard follows.
+        """
+        merged = 0
+        for record in self._records:
+            if not df_new.index.isin(record["material_ids"]).any():
+                continue
+            shard_path = self.shard_dir / record["shard"]
+            df_shard = pd.read_pickle(shard_path)
+
+            columns = [column for column in df_new.columns if column not in df_shard.columns]
+            df_shard = df_shard.join(df_new.loc[~df_new.index.duplicated(keep="last"), columns])
+            if conform is not None:
+                df_shard = conform(df_shard)
+            self._write_atomic(df_shard, shard_path)
+
+            record["featurizers"] = sorted(set(record.get("featurizers") or []) | set(featurizers))
+            if conform is not None:
+                record["schema"] = schema
+            merged += 1
+
+        self._rewrite_manifest()
+        LOG.info("Merged {} new features of {} featurizers into {} shards"
+                 .format(df_new.shape[1], len(featurizers), merged))
+
+    def read_timings(self) -> pd.DataFrame:
+        """ The timings of the written batches, one row per shard with a
+        timing file, along with the "material_ids" of the shard.
+        """
+        rows = []
+        for record in self._records:
+            path = self.shard_dir / record["timing"] if record.get("timing") else None
+            if path is None or not path.is_file():
+                continue
+            row = pd.read_pickle(path).iloc[0].to_dict()
+            row["material_ids"] = record["material_ids"]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def write_failures(self, df_failures: pd.DataFrame):
+        """ Append materials that could not be featurized to "failures.csv".
+        They are not part of the manifest, and are thus retried on resume.
+        """
+        path = self.directory / "failures.csv"
+        df_failures.to_csv(path, mode="a", header=not path.is_file(), index=False)
+
+    @staticmethod
+    def _stack(shards: List[pd.DataFrame], conformed: bool) -> pd.DataFrame:
+        """ Stack shards row-wise. Shards conformed to the same schema share
+        their columns and dtype, and are stacked as one array without
+        aligning columns.
+        """
+        if not shards:
+            return pd.DataFrame({})
+        if conformed:
+            index = pd.Index(np.concatenate([shard.index.to_numpy() for shard in shards]))
+            matrix = np.concatenate([shard.to_numpy() for shard in shards])
+            return pd.DataFrame(matrix, index=index, columns=shards[0].columns, copy=False)
+        return pd.concat(shards)
+
+    def compact(self, write: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """ Concatenate all shards in the manifest into one table. If a
+        material id occurs in several shards, the latest one is kept.
+        Tombstoned material ids are left out. A "material_id" column is
+        added for compatibility with the consolidated tables written before
+        the store.
+        Arguments:
+            write: whether or not to write the consolidated "featurized.pkl"
+                and "timing.csv" next to the manifest.
+        Returns:
+            The consolidated featurized and timing DataFrames.
+        """
+        shards  = [pd.read_pickle(self.shard_dir / r["shard"]) for r in self._records]
+        timings = [pd.read_pickle(self.shard_dir / r["timing"]) for r in self._records if r.get("timing")]
+
+        schemas = {r.get("schema") for r in self._records}
+        df = self._stack(shards, conformed=len(schemas) == 1 and None not in schemas)
+        df = df[~df.index.duplicated(keep="last")]
+        tombstoned = self.tombstoned_ids()
+        if tombstoned:
+            df = df[~df.index.isin(tombstoned)]
+        if df.shape[0] and "material_id" not in df.columns:
+            df["material_id"] = df.index
+        df_time = pd.concat(timings, ignore_index=True) if timings else pd.DataFrame({})
+
+        if write:
+            self._write_atomic(df, self.directory / "featurized.pkl")
+            df_time.to_csv(self.directory / "timing.csv")
+        LOG.info("Compacted {} shards into shape {}".format(len(shards), df.shape))
+        return df, df_time
+
+    def read(self, material_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """ Lazily compacted view of the store. The consolidated table is
+        only rebuilt when the manifest or tombstones changed after it was
+        written.
+        Arguments:
+            material_ids: optional material ids to read. Only the shards
+                holding their latest rows are read, and the ids not in the
+                store are left out.
+        """
+        if material_ids is not None:
+            return self._read_ids(material_ids)
+        consolidated = self.directory / "featurized.pkl"
+        logs = [path for path in (self.manifest_path, self.tombstone_path) if path.is_file()]
+        if consolidated.is_file() and self.manifest_path.is_file() and \
+           all(consolidated.stat().st_mtime >= path.stat().st_mtime for path in logs):
+            return pd.read_pickle(consolidated)
+        return self.compact()[0]
+
+    def _read_ids(self, material_ids: Iterable[str]) -> pd.DataFrame:
+        positions = {}
+        for mpid in dict.fromkeys(str(mpid) for mpid in material_ids):
+            if mpid in self._latest and self._is_live(mpid):
+                positions.setdefault(self._latest[mpid], []).append(mpid)
+        shards = [pd.read_pickle(self.shard_dir / self._records[position]["shard"]).loc[mpids]
+                  for position, mpids in sorted(positions.items())]
+
+        schemas = {self._records[position].get("schema") for position in positions}
+        df = self._stack(shards, conformed=len(schemas) == 1 and None not in schemas)
+        if df.shape[0] and "material_id" not in df.columns:
+            df["material_id"] = df.index
+        return df
@@ -0,0 +1,41 @@
+from typing import Iterable, List, Optional
+
+from matminer.featurizers import structure as matminer_structure
+from matminer.featurizers.base import BaseFeaturizer
+
+from src.features.cache import SymmetryCache
+
+
+class GlobalSymmetryFeatures(matminer_structure.GlobalSymmetryFeatures):
+    """ matminer's "GlobalSymmetryFeatures", reading the space group analysis
+    from a "SymmetryCache" instead of running spglib for every call. The
+    class name is kept, as it prefixes the feature labels.
+    Attributes:
+        symmetry_cache: the cache holding the space group analyses.
+    """
+
+    def __init__(self, desired_features: Optional[List[str]] = None,
+                 symmetry_cache: Optional[SymmetryCache] = None):
+        super().__init__(desired_features=desired_features)
+        self.symmetry_cache = symmetry_cache or SymmetryCache()
+
+    def featurize(self, s) -> List:
+        record = self.symmetry_cache.get(s)
+        values = {
+            "spacegroup_num":     record["spacegroup_number"],
+            "crystal_system":     record["crystal_system"],
+            "crystal_system_int": self.crystal_idx[record["crystal_system"]],
+            "is_centrosymmetric": record["is_laue"],
+            "n_symmetry_ops":     record["n_symmetry_ops"],
+        }
+        return [values[feature] for feature in self.features]
+
+
+def use_symmetry_cache(featurizers: Iterable[BaseFeaturizer],
+                       symmetry_cache: SymmetryCache) -> List[BaseFeaturizer]:
+    """ Replace the "GlobalSymmetryFeatures" among the featurizers by ones
+    reading from the symmetry cache, leaving the others as they are.
+    """
+    return [GlobalSymmetryFeatures(featurizer.features, symmetry_cache)
+            if isinstance(featurizer, matminer_structure.GlobalSymmetryFeatures) else featurizer
+            for featurizer in featurizers]
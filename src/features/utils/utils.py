@@ -1,20 +1,104 @@
 import numpy as np
+import pandas as pd
 import logging
 import sys
-def clean_df(df):
-    """Cleans dataframe by dropping missing values, replacing NaN's and infinities
-    and selecting only columns containing numerical data.
+
+from pymatgen.core.periodic_table import Element
+
+# Fixed vocabulary of the one-hot encoded element features, such that every
+# batch has the same columns.
+ELEMENTS = [element.symbol for element in Element]
+def clean_df(df, dtype=np.float32):
+    """Cleans dataframe by selecting only columns containing numerical or
+    boolean data, and replacing NaN's and infinities by -1, in a single pass into one
+    contiguous array of the requested dtype.
     Args:
         df (pd.DataFrame): the dataframe to clean.
+        dtype (np.dtype): the dtype of the cleaned features. Defaults to
+            np.float32, np.float64 can be used for reproducibility checks.
     Returns:
         pandas.DataFrame: the cleaned dataframe.
     """
 
-    df = df.select_dtypes(exclude=['object'])
-    df = df.replace([np.inf, -np.inf, np.nan], -1)
-    df = df.dropna(axis=1, how="all")
-    df = df.select_dtypes(include="number")
-    return df
+    df = df.select_dtypes(include=["number", "bool"])
+    values = df.to_numpy(dtype=dtype, copy=True, na_value=np.nan)
+    np.nan_to_num(values, copy=False, nan=-1, posinf=-1, neginf=-1)
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+def expand_rdf(df, column="RadialDistributionFunction|radial distribution function", n_bins=50):
+    """Replaces the column of radial distribution functions by one column per
+    distance, for the first "n_bins" distances. The distributions are stacked
+    into a single array in one pass over the rows, and attached as one block.
+    Rows without a distribution, e.g. where the featurizer failed, get NaN.
+    Args:
+        df (pd.DataFrame): the dataframe holding the column of
+            {"distances": ..., "distribution": ...} dictionaries.
+        column (str): the name of the column.
+        n_bins (int): the number of distances to keep.
+    Returns:
+        pandas.DataFrame: the dataframe with the column expanded.
+    """
+
+    if column not in df.columns:
+        return df
+
+    rdfs = df[column].to_numpy()
+    valid = [i for i, rdf in enumerate(rdfs) if isinstance(rdf, dict)]
+    df = df.drop(column, axis=1)
+    if not valid:
+        return df
+
+    distances = rdfs[valid[0]]["distances"][:n_bins]
+    block = np.full((len(rdfs), len(distances)), np.nan)
+    for i in valid:
+        block[i] = rdfs[i]["distribution"][:len(distances)]
+
+    columns = ["{}|d_{:.2f}".format(column, d) for d in distances]
+    return pd.concat([df, pd.DataFrame(block, index=df.index, columns=columns)], axis=1)
+
+def one_hot_elements(df, columns, vocabulary=ELEMENTS):
+    """Replaces columns of element symbols by one-hot encoded columns, one
+    per element of a fixed vocabulary, named as by "pd.get_dummies". The
+    encoding is written straight into a preallocated integer block, and
+    values outside the vocabulary, e.g. missing values, encode as all zeros.
+    Args:
+        df (pd.DataFrame): the dataframe to encode.
+        columns (list): the names of the columns of element symbols.
+        vocabulary (list): the element symbols to encode.
+    Returns:
+        pandas.DataFrame: the dataframe with the columns encoded.
+    """
+
+    columns = [column for column in columns if column in df.columns]
+    block = np.zeros((df.shape[0], len(columns)*len(vocabulary)), dtype=np.uint8)
+    rows = np.arange(df.shape[0])
+    for i, column in enumerate(columns):
+        codes = pd.Categorical(df[column], categories=vocabulary).codes
+        known = codes >= 0
+        block[rows[known], i*len(vocabulary) + codes[known]] = 1
+
+    names = ["{}_{}".format(column, symbol) for column in columns for symbol in vocabulary]
+    return pd.concat([df.drop(columns, axis=1), pd.DataFrame(block, index=df.index, columns=names)], axis=1)
+
+def split_locations(df, columns, n=3):
+    """Replaces columns of "number;number;number" strings by "n" float
+    columns each, named "<column>_<i>". Missing or malformed values give NaN.
+    Args:
+        df (pd.DataFrame): the dataframe to split.
+        columns (list): the names of the columns to split.
+        n (int): the number of numbers in every value.
+    Returns:
+        pandas.DataFrame: the dataframe with the columns split.
+    """
+
+    columns = [column for column in columns if column in df.columns]
+    blocks = []
+    for column in columns:
+        block = df[column].astype(str).str.split(";", n=n-1, expand=True).reindex(columns=range(n))
+        block = block.apply(pd.to_numeric, errors="coerce")
+        block.columns = ["{}_{}".format(column, i) for i in range(n)]
+        blocks.append(block)
+    return pd.concat([df.drop(columns, axis=1)] + blocks, axis=1)
 
 LOG = logging.getLogger("predicting-solid-state-qubit-candidates")
 LOG.setLevel(logging.INFO)
@@ -0,0 +1,447 @@
+import os
+import signal
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.data.utils import LOG
+from src.features.costmodel import CostModel, lpt_order
+from src.features.scheduling import MEMORY, TIMEOUT, classify_error
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the memory guard is disabled.
+    resource = None
+
+# The preset held by each worker process, set once by the initializer.
+_WORKER_FEATURIZER = None
+
+# The per-material guards of each worker process, see "_init_worker".
+_GUARD = {"memory_limit": None, "timeout": None}
+# Interval in seconds at which a guarded material is checked.
+_CHECK_INTERVAL = 0.5
+# Seconds a chunk may exceed its timeouts before the parent terminates its
+# worker, e.g. when stuck in a C call that the alarm can not interrupt.
+_DEADLINE_GRACE = 10.0
+
+
+class MaterialAborted(BaseException):
+    """ Raised in a worker when a material exceeds its memory ceiling or
+    timeout. It derives from "BaseException", such that the error handling
+    of the featurizers does not treat it as a failing featurizer.
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+def _init_worker(featurizerObject, memory_limit: Optional[int] = None, timeout: Optional[float] = None):
+    """ Warm a worker process with its own copy of the preset. Nested
+    multiprocessing inside matminer and concurrent groups are disabled, as
+    the parallelism is already across materials. The parent process
+    conforms the joined batch to the feature schema.
+    If a memory ceiling or timeout is given, every material is featurized
+    on its own under the guards.
+    """
+    global _WORKER_FEATURIZER
+    _WORKER_FEATURIZER = featurizerObject
+    _WORKER_FEATURIZER.set_n_jobs(1)
+    _WORKER_FEATURIZER.set_concurrent_groups(False)
+    _WORKER_FEATURIZER.conform_features = False
+
+    if memory_limit and resource is None:
+        LOG.info("Memory guard is not supported on this platform.")
+        memory_limit = None
+    _GUARD["memory_limit"] = memory_limit
+    _GUARD["timeout"] = timeout
+    if memory_limit or timeout:
+        signal.signal(signal.SIGALRM, _check_guard)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _memory() -> Tuple[int, int]:
+    """ Returns the virtual and resident memory of the process in bytes. """
+    with open("/proc/self/statm", "r") as f:
+        size, resident = f.read().split()[:2]
+    return int(size) * resource.getpagesize(), int(resident) * resource.getpagesize()
+
+
+def _check_guard(signum, frame):
+    """ Periodic check of the material being featurized. Once exceeded,
+    the check keeps raising on every tick until the guard is disarmed, such
+    that an abort swallowed by a featurizer's error handling also aborts
+    the following featurizers.
+    """
+    guard = _GUARD.get("current")
+    if guard is None or not guard["armed"]:
+        return
+    elapsed = time.perf_counter() - guard["start"]
+    if guard["memory_limit"]:
+        guard["peak"] = max(guard["peak"], _memory()[1] - guard["baseline"])
+
+    if guard["aborted"] is None:
+        if guard["timeout"] and elapsed > guard["timeout"]:
+            guard["aborted"] = (TIMEOUT, "exceeded {} s".format(guard["timeout"]))
+        elif guard["memory_limit"] and guard["peak"] > guard["memory_limit"]:
+            guard["aborted"] = (MEMORY, "exceeded {:.0f} MiB".format(guard["memory_limit"] / 2**20))
+    if guard["aborted"] is not None:
+        raise MaterialAborted(*guard["aborted"])
+
+
+def _disarm(guard: Dict):
+    """ Stop the checks of a guard. The flag is cleared first, such that a
+    tick already pending does not raise anymore.
+    """
+    guard["armed"] = False
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _featurize_guarded(df_row: pd.DataFrame) -> Tuple[Optional[Tuple[pd.DataFrame, pd.DataFrame]], Optional[Dict]]:
+    """ Featurize a single material under the memory ceiling and timeout.
+    The ceiling is checked on the resident memory the material adds, with
+    an address space limit of twice the ceiling as backstop for
+    allocations between two checks.
+    Returns:
+        The featurized material, or None and the record of the abort.
+    """
+    memory_limit, timeout = _GUARD["memory_limit"], _GUARD["timeout"]
+    guard = {"memory_limit": memory_limit, "timeout": timeout, "start": time.perf_counter(),
+             "peak": 0, "baseline": 0, "aborted": None, "armed": True}
+    if memory_limit:
+        virtual, guard["baseline"] = _memory()
+        limits = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (virtual + 2*memory_limit, limits[1]))
+    _GUARD["current"] = guard
+    signal.setitimer(signal.ITIMER_REAL, _CHECK_INTERVAL, _CHECK_INTERVAL)
+
+    result = None
+    try:
+        result = _WORKER_FEATURIZER.featurize(df_row)
+        _disarm(guard)
+    except MaterialAborted:
+        _disarm(guard)
+    except MemoryError:
+        _disarm(guard)
+        # Hit the address space backstop outside of a featurizer.
+        guard["aborted"] = (MEMORY, "exceeded the address space limit")
+    finally:
+        _disarm(guard)
+        _GUARD["current"] = None
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, limits)
+
+    if guard["aborted"] is None:
+        return result, None
+    return None, _aborted_record(df_row.index[0], *guard["aborted"],
+                                 wall=time.perf_counter() - guard["start"], memory=guard["peak"])
+
+
+def _aborted_record(mpid: str, kind: str, message: str, wall: float, memory: Optional[float]) -> Dict:
+    """ The record of an aborted material, with its measured cost. """
+    memory_message = " at {:.0f} MiB".format(memory / 2**20) if memory is not None else ""
+    return {
+        "material_id": mpid,
+        "error_class": kind,
+        "error":       "{}, aborted after {:.1f} s{}".format(message, wall, memory_message),
+        "wall":        wall,
+        "memory":      memory,
+    }
+
+
+def _featurize_chunk(df: pd.DataFrame,
+                     symmetry_records: Optional[Dict[str, Dict]] = None
+                     ) -> Tuple[pd.DataFrame, pd.DataFrame, List[Dict], Dict]:
+    """ Featurize a chunk in a worker, with the symmetry analyses of its
+    structures if given. Returns the timing and featurized DataFrames, the
+    records of aborted materials and the entries the chunk added to the
+    worker's caches.
+    """
+    if symmetry_records is not None:
+        _WORKER_FEATURIZER.set_symmetry_records(symmetry_records)
+    if not (_GUARD["memory_limit"] or _GUARD["timeout"]):
+        return _WORKER_FEATURIZER.featurize(df) + ([], _WORKER_FEATURIZER.take_cache_updates())
+
+    results, aborted = [], []
+    for i in range(df.shape[0]):
+        time0 = time.perf_counter()
+        try:
+            result, record = _featurize_guarded(df.iloc[i:i+1])
+        except (Exception, KeyboardInterrupt, SystemExit):
+            # Failing featurizers fail the batch, to be retried.
+            raise
+        except BaseException as e:
+            # E.g. a late abort of the guard, which must not escape the
+            # worker and fail the other materials of the batch.
+            kind = e.kind if isinstance(e, MaterialAborted) else classify_error(e)
+            result, record = None, _aborted_record(df.index[i], kind, str(e) or e.__class__.__name__,
+                                                   wall=time.perf_counter() - time0, memory=None)
+        if record is None:
+            results.append(result)
+        else:
+            aborted.append(record)
+
+    updates = _WORKER_FEATURIZER.take_cache_updates()
+    if not results:
+        return pd.DataFrame({}), pd.DataFrame({}), aborted, updates
+    return (pd.concat([df_time for df_time, _ in results]),
+            pd.concat([df_featurized for _, df_featurized in results]),
+            aborted, updates)
+
+
+def _featurize_group(featurizerObject, group: str, df: pd.DataFrame,
+                     symmetry_records: Optional[Dict[str, Dict]] = None) -> Tuple[pd.DataFrame, Dict, float]:
+    """ Featurize a single featurizer group in a process of the group
+    executor, see "extendedMODFeaturizer.set_concurrent_groups", with the
+    symmetry analyses of the structures if given. Returns the features of
+    the group, the entries the group added to the caches of the preset and
+    the time the group ran.
+    """
+    start = time.time()
+    if symmetry_records is not None:
+        featurizerObject.set_symmetry_records(symmetry_records)
+    df_features = featurizerObject._featurize_group(group, df)
+    return df_features, featurizerObject.take_cache_updates(), time.time() - start
+
+
+def _split(df: pd.DataFrame, chunksize: int) -> List[pd.DataFrame]:
+    return [df.iloc[i:i+chunksize] for i in range(0, df.shape[0], chunksize)]
+
+
+class FeaturizerPool:
+    """ Persistent pool of worker processes featurizing materials with a
+    copy of the same preset. The workers are started and warmed once, and
+    reused for every batch, instead of matminer starting a new pool for
+    every featurizer group of every batch.
+    Every worker runs in an executor of its own, such that a single worker
+    can be replaced without interrupting the others.
+    Materials can be guarded by a memory ceiling and a timeout. A material
+    exceeding either is aborted and recorded in "aborted" with its measured
+    cost, while the rest of the batch continues, and the worker that
+    featurized it is recycled. A chunk exceeding the timeouts of its
+    materials by more than a grace period, e.g. stuck in a C call the
+    alarm can not interrupt, has its worker terminated by the parent. If a
+    worker dies or is terminated, it is replaced and the unfinished
+    materials of its chunk are resubmitted one at a time, such that the
+    culprit is identified and recorded as well.
+    Attributes:
+        n_workers: the number of worker processes.
+        chunksize: the number of materials sent to a worker at a time.
+        cost_model: optional model of the featurization time of a material.
+            If given, the materials of a batch are submitted longest
+            predicted time first, such that a large cell does not start last
+            and leave the other workers idle.
+        memory_limit: optional ceiling in bytes on the memory a material
+            may add to a worker.
+        timeout: optional wall time in seconds a material may take.
+        aborted: the records of the aborted materials of the last batch.
+        cache_updates: the cache entries returned by the workers, see
+            "extendedMODFeaturizer.take_cache_updates".
+    """
+
+    def __init__(self, featurizerObject, n_workers: Optional[int] = None, chunksize: int = 1,
+                 cost_model: Optional[CostModel] = None,
+                 memory_limit: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.n_workers = n_workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.cost_model = cost_model
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.aborted: List[Dict] = []
+        self.cache_updates: List[Dict] = []
+        self._initargs = (featurizerObject, memory_limit, timeout)
+        self._executors: List[ProcessPoolExecutor] = [None] * self.n_workers
+        self._pids: List[int] = [None] * self.n_workers
+        for worker in range(self.n_workers):
+            self._start(worker)
+        self.warm()
+        LOG.info("Started featurizer pool with {} workers.".format(self.n_workers))
+
+    def _start(self, worker: int):
+        self._executors[worker] = ProcessPoolExecutor(max_workers=1,
+                                                      initializer=_init_worker,
+                                                      initargs=self._initargs)
+        self._pids[worker] = None
+
+    def recycle(self, worker: Optional[int] = None):
+        """ Replace a worker by a fresh one, or all of them if "None". A
+        worker that does not exit, e.g. stuck in a C call, is killed.
+        """
+        workers = range(self.n_workers) if worker is None else [worker]
+        for worker in workers:
+            pid = self._pids[worker]
+            if pid is not None:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            self._executors[worker].shutdown(wait=True, cancel_futures=True)
+            self._start(worker)
+        self.warm()
+
+    def warm(self):
+        """ Start every worker process and run its initializer, such that
+        startup is not paid by the first batch. The process id of every
+        worker is kept, to terminate it if needed.
+        """
+        futures = {worker: self._executors[worker].submit(_ping)
+                   for worker in range(self.n_workers) if self._pids[worker] is None}
+        for worker, future in futures.items():
+            self._pids[worker] = future.result()
+
+    @staticmethod
+    def _symmetry_records(chunk: pd.DataFrame, symmetry_cache) -> Optional[Dict[str, Dict]]:
+        if symmetry_cache is None:
+            return None
+        return symmetry_cache.records_for(chunk["structure"])
+
+    def _deadline(self, chunk: pd.DataFrame) -> Optional[float]:
+        """ The wall time after which the parent terminates the worker of a
+        chunk, or None without a timeout.
+        """
+        if not self.timeout:
+            return None
+        return self.timeout * chunk.shape[0] + _DEADLINE_GRACE
+
+    def featurize(self, df: pd.DataFrame, symmetry_cache=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """ Featurize the rows of the input dataframe across the workers.
+        Arguments:
+            df: the input dataframe, as for "extendedMODFeaturizer.featurize".
+            symmetry_cache: optional "SymmetryCache" holding the analyses of
+                the structures. Every chunk is sent with its own records.
+        Returns:
+            The timing DataFrame, with the group times summed over workers,
+            and the featurized DataFrame in the order of the input rows,
+            without the aborted materials.
+        """
+        rows = df.index
+        # The cost model predicts from the structures, which a subset
+        # featurizing e.g. the dos only does not download.
+        if self.cost_model is not None and "structure" in df.columns:
+            df = df.loc[lpt_order(self.cost_model.predict_structures(df["structure"]))]
+
+        time0 = time.time()
+        queue = deque(_split(df, self.chunksize))
+        idle = list(range(self.n_workers))
+        running = {}
+        results, aborted = [], []
+        while queue or running:
+            # A chunk is only submitted to an idle worker, such that its
+            # deadline runs from its start.
+            while queue and idle:
+                worker, chunk = idle.pop(), queue.popleft()
+                future = self._executors[worker].submit(_featurize_chunk, chunk,
+                                                        self._symmetry_records(chunk, symmetry_cache))
+                running[future] = (worker, chunk, time.perf_counter())
+
+            done, _ = wait(running, timeout=_CHECK_INTERVAL if self.timeout else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                worker, chunk, start = running.pop(future)
+                idle.append(worker)
+                try:
+                    df_chunk_time, df_chunk, chunk_aborted, updates = future.result()
+                except BrokenProcessPool:
+                    self._lost(worker, chunk, start, "worker died", MEMORY, queue, aborted)
+                    continue
+                results.append((df_chunk_time, df_chunk))
+                aborted.extend(chunk_aborted)
+                self.cache_updates.append(updates)
+                if chunk_aborted:
+                    # The aborted material may have left the worker's
+                    # memory fragmented or its state inconsistent.
+                    self.recycle(worker)
+
+            for future, (worker, chunk, start) in list(running.items()):
+                deadline = self._deadline(chunk)
+                if deadline is not None and time.perf_counter() - start > deadline:
+                    running.pop(future)
+                    idle.append(worker)
+                    self._lost(worker, chunk, start, "exceeded the deadline of {:.0f} s".format(deadline),
+                               TIMEOUT, queue, aborted)
+        time1 = time.time()
+
+        self.aborted = aborted
+        for record in aborted:
+            LOG.info("Aborted {}: {}".format(record["material_id"], record["error"]))
+
+        df_featurized = pd.concat([df_chunk for _, df_chunk in results]) if results else pd.DataFrame({})
+        df_featurized = df_featurized.reindex([mpid for mpid in rows if mpid in df_featurized.index])
+
+        df_time = pd.concat([df_chunk_time for df_chunk_time, _ in results]).sum().to_frame().T \
+            if results else pd.DataFrame({})
+        df_time["all"]         = [time1-time0]
+        df_time["df.rows"]     = [df_featurized.shape[0]]
+        df_time["df.features"] = [df_featurized.shape[1]]
+        df_time["workers"]     = [self.n_workers]
+        df_time["aborted"]     = [len(aborted)]
+
+        return df_time, df_featurized
+
+    def _lost(self, worker: int, chunk: pd.DataFrame, start: float, reason: str, kind: str,
+              queue: deque, aborted: List[Dict]):
+        """ Replace a worker that died or exceeded its deadline. The
+        materials of a lost chunk are requeued one at a time, a lost single
+        material is aborted.
+        """
+        wall = time.perf_counter() - start
+        LOG.info("Worker {} featurizing {}: {} after {:.1f} s, replacing it."
+                 .format(self._pids[worker], list(chunk.index), reason, wall))
+        self.recycle(worker)
+        if chunk.shape[0] > 1:
+            queue.extend(_split(chunk, 1))
+        else:
+            aborted.append(_aborted_record(chunk.index[0], kind, reason, wall=wall, memory=None))
+
+    def take_cache_updates(self) -> List[Dict]:
+        """ Returns the cache entries returned by the workers and clears them. """
+        updates, self.cache_updates = self.cache_updates, []
+        return updates
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+def measure_scaling(featurizerObject,
+                    df: pd.DataFrame,
+                    max_workers: Optional[int] = None) -> pd.DataFrame:
+    """ Measure the wall time of featurizing the same dataframe with a
+    persistent pool of 1 to "max_workers" workers. Pool startup is excluded
+    from the measurement, as it is paid once per run.
+    Arguments:
+        featurizerObject: the preset to measure.
+        df: the input dataframe.
+        max_workers: the largest number of workers, defaults to the
+            number of cores.
+    Returns:
+        A DataFrame with the wall time, speedup and parallel efficiency
+        for every number of workers.
+    """
+    max_workers = max_workers or os.cpu_count()
+
+    workers, wall = [], []
+    for n_workers in range(1, max_workers + 1):
+        featurizerObject.start_pool(n_workers)
+        try:
+            time0 = time.time()
+            featurizerObject.featurize(df)
+            wall.append(time.time() - time0)
+        finally:
+            featurizerObject.stop_pool()
+        workers.append(n_workers)
+        LOG.info("{} workers: {:.2f} s".format(n_workers, wall[-1]))
+
+    df_scaling = pd.DataFrame({"workers": workers, "wall": wall})
+    df_scaling["speedup"]    = df_scaling["wall"].iloc[0] / df_scaling["wall"]
+    df_scaling["efficiency"] = df_scaling["speedup"] / df_scaling["workers"]
+    return df_scaling
@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.io.cif import CifWriter
+
+from src.data import get_data_AFLOWML
+from src.data.get_data_AFLOWML import data_AFLOWML
+
+
+class _StubClient:
+    """ Predicts the lattice parameter of the submitted POSCAR. """
+    calls = []
+
+    def get_prediction(self, poscar, model):
+        _StubClient.calls.append(model)
+        a = float(poscar.splitlines()[2].split()[0])
+        return {"ml_egap": round(a, 3)}
+
+
+def _entries(n):
+    structures = [Structure(Lattice.cubic(3 + 0.1 * i), ["Si"], [[0, 0, 0]])
+                  for i in range(n)]
+    return pd.DataFrame({"full_formula": ["Si1"] * n,
+                         "material_id": ["mp-{}".format(i) for i in range(n)],
+                         "cif": [str(CifWriter(s)) for s in structures],
+                         "structure": structures})
+
+
+@pytest.fixture
+def aflowml(tmp_path, monkeypatch):
+    _StubClient.calls = []
+    monkeypatch.setattr(get_data_AFLOWML, "AFLOWmlAPI", _StubClient)
+    data = data_AFLOWML()
+    data.data_dir = tmp_path
+    (tmp_path / "raw" / "AFLOWML").mkdir(parents=True)
+    return data
+
+
+def _producer_alive():
+    return any(thread.name == "poscar_producer" and thread.is_alive()
+               for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize("queue_size", [1, 4])
+def test_predictions_in_entry_order(aflowml, queue_size):
+    entries = _entries(12)
+    result = aflowml.calculate_data(entries, n_jobs=2, queue_size=queue_size)
+
+    assert result["material_id"] == list(entries["material_id"])
+    assert result["ml_egap"] == [round(3 + 0.1 * i, 3) for i in range(12)]
+    assert _StubClient.calls == ["plmf"] * 12
+    checkpoint = pd.read_pickle(aflowml.data_dir / "raw" / "AFLOWML"
+                                / "new_AFLOW.pkl")
+    assert list(checkpoint["material_id"]) == ["mp-{}".format(i)
+                                               for i in range(11)]
+
+
+def test_entries_without_structure_are_skipped(aflowml):
+    entries = _entries(4)
+    entries.loc[2, ["structure", "cif"]] = np.nan
+    result = aflowml.calculate_data(entries, n_jobs=1)
+
+    assert result["material_id"] == ["mp-0", "mp-1", "mp-3"]
+    assert result["ml_egap"] == [3.0, 3.1, 3.3]
+
+
+def test_producer_stopped_when_submission_fails(aflowml, monkeypatch):
+    def fail(self, poscar, model):
+        raise ConnectionError("AFLOW-ML unavailable")
+
+    monkeypatch.setattr(_StubClient, "get_prediction", fail)
+    with pytest.raises(ConnectionError):
+        aflowml.calculate_data(_entries(20), n_jobs=1, queue_size=1)
+    assert not _producer_alive()
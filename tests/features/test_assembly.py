@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features.assembly import assemble_features, to_frame
+
+
+def test_blocks_aligned_to_index():
+    index = pd.Index(["mp-1", "mp-2", "mp-3"])
+    blocks = {
+        "composition": pd.DataFrame({"a": [1, 2, 3]}, index=index),
+        "structure":   pd.DataFrame({"b": [20.0, 10.0], "name": ["x", "y"]}, index=["mp-2", "mp-1"]),
+        "site":        pd.DataFrame({}),
+    }
+    matrix, columns = assemble_features(blocks, index)
+
+    assert matrix.dtype == np.float32 and matrix.flags["C_CONTIGUOUS"]
+    assert list(columns) == ["a", "b"]
+    np.testing.assert_array_equal(matrix, [[1, 10], [2, 20], [3, np.nan]])
+
+
+def test_duplicate_columns_rejected():
+    index = pd.Index(["mp-1"])
+    blocks = {"composition": pd.DataFrame({"a": [1.0]}, index=index),
+              "structure":   pd.DataFrame({"a": [2.0]}, index=index)}
+    with pytest.raises(ValueError, match="composition and structure"):
+        assemble_features(blocks, index)
+
+
+def test_to_frame_does_not_copy():
+    index = pd.Index(["mp-1", "mp-2"])
+    matrix, columns = assemble_features({"dos": pd.DataFrame({"a": [1.0, 2.0]}, index=index)},
+                                        index, dtype=np.float64)
+    df = to_frame(matrix, columns, index)
+    assert df["a"].dtype == np.float64
+    assert np.shares_memory(df.to_numpy(), matrix)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from pymatgen.core import Lattice, Structure
+
+from src.features.batching import AdaptiveBatchSizer, payload_nbytes
+
+
+class _Dos:
+    def __init__(self, n):
+        self.energies = np.zeros(n)
+        self.densities = {"up": np.zeros(n), "down": np.zeros(n)}
+
+
+def _structure(n_sites):
+    return Structure(Lattice.cubic(4.0), ["Na"] * n_sites, [[i / n_sites, 0, 0] for i in range(n_sites)])
+
+
+def test_payload_counts_arrays_and_sites():
+    small = pd.DataFrame({"structure": [_structure(1)], "dos": [_Dos(100)]})
+    large = pd.DataFrame({"structure": [_structure(8)], "dos": [_Dos(10000)]})
+
+    assert payload_nbytes(large) - payload_nbytes(small) >= 3 * 9900 * 8
+    assert payload_nbytes(large) > payload_nbytes(small.assign(dos=[_Dos(10000)]))
+
+
+def test_payload_ignores_missing_objects():
+    df = pd.DataFrame({"dos": [np.nan, None, "mp-1"]})
+    assert payload_nbytes(df) == int(df.memory_usage(index=True, deep=False).sum())
+
+
+def test_sizer_bounded_by_latency_target():
+    sizer = AdaptiveBatchSizer(initial_size=10, max_size=1000, target_seconds=100.0)
+    sizer.update(10, n_bytes=10, seconds=20.0)
+    assert sizer.next_size() == 50
+
+
+def test_sizer_bounded_by_memory_budget():
+    sizer = AdaptiveBatchSizer(initial_size=10, max_size=1000, target_seconds=1e6, max_bytes=1000)
+    sizer.update(10, n_bytes=100, seconds=1.0)
+    assert sizer.next_size() == 100
+
+
+def test_sizer_clamped_and_smoothed():
+    sizer = AdaptiveBatchSizer(initial_size=5000, min_size=2, max_size=100, smoothing=0.5)
+    assert sizer.next_size() == 100
+
+    sizer.update(1, n_bytes=1, seconds=1000.0)
+    assert sizer.next_size() == 2
+    sizer.update(1, n_bytes=1, seconds=0.0)
+    # Average of 1000 and 0 seconds per material.
+    assert sizer.next_size() == 2
+    sizer.update(0, n_bytes=0, seconds=0.0)
+    assert sizer.next_size() == 2
@@ -0,0 +1,70 @@
+import pandas as pd
+
+from matminer.featurizers.site import CoordinationNumber, GeneralizedRadialDistributionFunction
+from matminer.featurizers.structure import CoulombMatrix, SineCoulombMatrix
+from pymatgen.analysis.local_env import CrystalNN, VoronoiNN
+from pymatgen.core import Composition, Lattice, Structure
+
+from src.features.cache import CompositionCache, composition_key, featurizer_signature
+
+
+def test_composition_key_normalizes_formula():
+    assert composition_key(Composition("Na2Cl2")) == composition_key(Composition("NaCl"))
+    assert composition_key(Composition("NaCl")) != composition_key(Composition("NaCl2"))
+
+
+def test_composition_cache_broadcasts_and_counts():
+    cache = CompositionCache()
+    keys = pd.Series(["NaCl", "Fe", "NaCl"], index=["mp-1", "mp-2", "mp-3"])
+    assert cache.missing(keys) == ["NaCl", "Fe"]
+
+    cache.add(pd.DataFrame({"a": [1.0, 2.0]}, index=["NaCl", "Fe"]))
+    assert cache.missing(keys) == []
+    assert (cache.hits, cache.misses) == (3, 2)
+
+    df = cache.lookup(keys)
+    assert list(df.index) == ["mp-1", "mp-2", "mp-3"]
+    assert df["a"].tolist() == [1.0, 2.0, 1.0]
+
+
+def test_composition_cache_persisted(tmp_path):
+    path = tmp_path / "composition.pkl"
+    cache = CompositionCache(path)
+    cache.add(pd.DataFrame({"a": [1.0]}, index=["NaCl"]))
+    cache.save()
+
+    assert CompositionCache(path).lookup(pd.Series(["NaCl"]))["a"].tolist() == [1.0]
+
+
+def test_take_added_returns_new_entries_once():
+    cache = CompositionCache()
+    cache.add(pd.DataFrame({"a": [1.0]}, index=["NaCl"]))
+    cache.add(pd.DataFrame({"a": [2.0]}, index=["Fe"]))
+
+    assert sorted(cache.take_added().index) == ["Fe", "NaCl"]
+    assert cache.take_added().shape[0] == 0
+    assert len(cache) == 2
+
+
+def test_featurizer_signature_ignores_fitted_state():
+    structures = [Structure(Lattice.cubic(3.0), ["Fe"], [[0, 0, 0]]),
+                  Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])]
+    featurizer = CoulombMatrix()
+    signature = featurizer_signature([featurizer])
+
+    featurizer.fit(structures)
+
+    assert featurizer_signature([featurizer]) == signature
+    assert featurizer_signature([CoulombMatrix(diag_elems=False)]) != signature
+    assert featurizer_signature([SineCoulombMatrix()]) != signature
+
+
+def test_featurizer_signature_describes_nested_objects():
+    # The bins are "Gaussian" objects, whose reprs hold memory addresses.
+    signature = featurizer_signature([GeneralizedRadialDistributionFunction.from_preset("gaussian")])
+
+    assert featurizer_signature([GeneralizedRadialDistributionFunction.from_preset("gaussian")]) == signature
+    assert featurizer_signature([GeneralizedRadialDistributionFunction.from_preset("gaussian", width=0.5)]) \
+        != signature
+    assert featurizer_signature([CoordinationNumber(VoronoiNN())]) != \
+        featurizer_signature([CoordinationNumber(CrystalNN())])
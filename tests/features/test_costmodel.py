@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+from pymatgen.core import Lattice, Structure
+
+from src.features.costmodel import CostModel, lpt_order
+from src.features.store import FeatureStore
+
+
+def make_structures(n):
+    """ Cubic cells of 1 to n sites, alternating one and two elements. """
+    structures = {}
+    for i in range(1, n+1):
+        species = ["Fe" if i % 2 or j % 2 else "Co" for j in range(i)]
+        coords = [[j/i, 0, 0] for j in range(i)]
+        structures["mp-{}".format(i)] = Structure(Lattice.cubic(2.5*i), species, coords)
+    return pd.Series(structures)
+
+
+def true_wall(structures, coefficients=(np.log(0.01), 2.0, 0.5)):
+    nsites = structures.apply(len).to_numpy(dtype=float)
+    nelements = structures.apply(lambda s: len(s.composition.elements)).to_numpy(dtype=float)
+    return np.exp(coefficients[0]) * nsites**coefficients[1] * nelements**coefficients[2]
+
+
+def test_fit_batches_recovers_power_law():
+    structures = make_structures(20)
+    wall = true_wall(structures)
+    df_timing = pd.DataFrame({
+        "material_ids": [[mpid] for mpid in structures.index],
+        "composition":  0.25*wall,
+        "structure":    0.75*wall,
+        "all":          np.full(len(wall), 1e3),
+    })
+
+    model = CostModel.fit_batches(df_timing, structures)
+
+    np.testing.assert_allclose(model.coefficients, [np.log(0.01), 2.0, 0.5], atol=1e-8)
+    np.testing.assert_allclose(model.predict_structures(structures), wall, rtol=1e-8)
+
+
+def test_fit_batches_divides_work_over_materials():
+    structures = make_structures(12)
+    wall = pd.Series(true_wall(structures, (0.0, 1.0, 0.0)), index=structures.index)
+    # Pairs of materials with the same number of sites in every batch.
+    doubled = pd.concat([structures, structures.rename(lambda mpid: mpid + "-copy")])
+    df_timing = pd.DataFrame({
+        "material_ids": [[mpid, mpid + "-copy"] for mpid in structures.index],
+        "structure":    2*wall.to_numpy(),
+    })
+
+    model = CostModel.fit_batches(df_timing, doubled)
+
+    np.testing.assert_allclose(model.coefficients[:2], [0.0, 1.0], atol=1e-8)
+
+
+def test_fit_batches_without_timings_uses_default():
+    structures = make_structures(3)
+    assert np.array_equal(CostModel.fit_batches(pd.DataFrame(), structures).coefficients,
+                          CostModel().coefficients)
+
+    df_timing = pd.DataFrame({"material_ids": [["mp-1"], ["mp-unknown"]], "structure": [1.0, 2.0]})
+    assert np.array_equal(CostModel.fit_batches(df_timing, structures).coefficients,
+                          CostModel().coefficients)
+
+
+def test_fit_from_store_timings(tmp_path):
+    structures = make_structures(12)
+    wall = true_wall(structures)
+    store = FeatureStore(tmp_path)
+    for (mpid, structure), seconds in zip(structures.items(), wall):
+        store.write_shard(pd.DataFrame({"a": [1.0]}, index=[mpid]),
+                          pd.DataFrame({"composition": [seconds], "batch_size": [1]}))
+    store.write_shard(pd.DataFrame({"a": [1.0]}, index=["mp-legacy"]))
+
+    df_timing = FeatureStore(tmp_path).read_timings()
+
+    assert df_timing.shape[0] == len(structures)
+    assert df_timing["material_ids"].iloc[0] == ["mp-1"]
+    model = CostModel.fit_batches(df_timing, structures)
+    np.testing.assert_allclose(model.predict_structures(structures), wall, rtol=1e-6)
+
+
+def test_fit_to_profile():
+    structures = make_structures(12)
+    wall = true_wall(structures)
+    df_profile = pd.DataFrame({
+        "material_id": np.repeat(structures.index, 2),
+        "wall":        np.repeat(wall/2, 2),
+        "nsites":      np.repeat(structures.apply(len), 2),
+        "nelements":   np.repeat(structures.apply(lambda s: len(s.composition.elements)), 2),
+    })
+
+    model = CostModel.fit(df_profile)
+
+    np.testing.assert_allclose(model.coefficients, [np.log(0.01), 2.0, 0.5], atol=1e-8)
+
+
+def test_lpt_order():
+    costs = pd.Series({"mp-1": 1.0, "mp-2": 5.0, "mp-3": 3.0, "mp-4": 5.0})
+
+    assert list(lpt_order(costs)) == ["mp-2", "mp-4", "mp-3", "mp-1"]
+    # Labels without a prediction go last, in their original order.
+    assert list(lpt_order(costs, ["mp-x", "mp-1", "mp-y", "mp-3"])) == ["mp-3", "mp-1", "mp-x", "mp-y"]
@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from matminer.featurizers.composition import Stoichiometry
+from matminer.featurizers.dos import DOSFeaturizer
+from matminer.featurizers.site import CoordinationNumber
+from matminer.featurizers.structure import BondFractions, CoulombMatrix, DensityFeatures
+from pymatgen.core import Lattice, Structure
+from pymatgen.electronic_structure.core import Spin
+from pymatgen.electronic_structure.dos import Dos
+
+from src.features.featurizer import extendedMODFeaturizer
+
+
+class SmallPreset(extendedMODFeaturizer):
+    composition_featurizers = (Stoichiometry(),)
+    structure_featurizers = (DensityFeatures(),)
+    conform_features = False
+
+
+@pytest.fixture
+def df_structures():
+    structures = [
+        Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        Structure(Lattice.cubic(3.0), ["Fe"], [[0, 0, 0]]),
+    ]
+    return pd.DataFrame({"structure": structures}, index=pd.Index(["mp-1", "mp-2"], name="material_id"))
+
+
+def test_concurrent_groups_match_sequential(df_structures):
+    sequential = SmallPreset(n_jobs=1, tier="structure")
+    concurrent = SmallPreset(n_jobs=None, concurrent_groups=True, tier="structure")
+
+    _, df_sequential = sequential.featurize(df_structures)
+    try:
+        df_time, df_concurrent = concurrent.featurize(df_structures)
+    finally:
+        concurrent.stop_group_executor()
+
+    pd.testing.assert_frame_equal(df_sequential, df_concurrent)
+    assert {"composition.queue", "structure.queue", "critical_path"} <= set(df_time.columns)
+
+
+def test_concurrent_groups_return_cache_entries(df_structures):
+    preset = SmallPreset(n_jobs=1, concurrent_groups=True, tier="structure")
+    preset.enable_composition_cache(persist=False)
+    try:
+        preset.featurize(df_structures)
+    finally:
+        preset.stop_group_executor()
+
+    # Featurized in a group process, and merged into the preset's cache.
+    assert len(preset._composition_cache) == 2
+
+
+def test_group_executor_sized_by_tier(df_structures):
+    preset = SmallPreset(n_jobs=1, concurrent_groups=True, tier="composition")
+    try:
+        preset.featurize(df_structures)
+        assert preset._group_processes == 1
+
+        preset.set_tier("structure")
+        preset.featurize(df_structures)
+        assert preset._group_processes == min(2, os.cpu_count())
+    finally:
+        preset.stop_group_executor()
+
+
+def test_subset_applies_only_the_given_featurizers(df_structures):
+    preset = SmallPreset(n_jobs=1, tier="structure")
+    ids = preset.featurizer_ids()
+    [structure_id] = [featurizer_id for featurizer_id in ids if featurizer_id.startswith("structure_")]
+
+    subset = preset.subset([structure_id])
+    _, df_featurized = subset.featurize(df_structures)
+
+    assert list(subset.featurizer_ids()) == [structure_id]
+    assert preset.featurizer_prefix(structure_id) == "DensityFeatures"
+    assert all(column.startswith("DensityFeatures|") for column in df_featurized.columns)
+    # The preset itself is left as it is.
+    assert len(preset.featurizer_ids()) == 2
+
+
+class FittedPreset(extendedMODFeaturizer):
+    structure_featurizers = (CoulombMatrix(), BondFractions())
+    conform_features = False
+
+
+@pytest.fixture
+def df_cells():
+    structures = [Structure(Lattice.cubic(2.5*n), ["Fe"]*(n-1) + ["O"], [[i/n, 0, 0] for i in range(n)])
+                  for n in range(1, 9)]
+    return pd.DataFrame({"structure": structures},
+                        index=pd.Index(["mp-{}".format(n) for n in range(1, 9)], name="material_id"))
+
+
+def test_size_bounded_featurizers_fitted_to_all_materials(df_cells):
+    preset = FittedPreset(n_jobs=1, tier="structure")
+
+    preset.fit(df_cells, sample=2, random_state=0)
+
+    coulomb_matrix, bond_fractions = preset.structure_featurizers
+    assert coulomb_matrix._max_eigs == 8
+    sampled = df_cells.sample(2, random_state=0)
+    assert len(bond_fractions.fitted_bonds_) == len(BondFractions().fit(sampled["structure"]).fitted_bonds_)
+    # The preset's featurizers are left unfitted.
+    assert FittedPreset.structure_featurizers[0]._max_eigs is None
+
+
+def test_fitted_state_saved_and_applied_to_batches(df_cells, tmp_path):
+    preset = FittedPreset(n_jobs=1, tier="structure")
+    preset.fit(df_cells)
+    preset.save_fitted(tmp_path / "fitted.pkl")
+
+    loaded = FittedPreset(n_jobs=1, tier="structure")
+    assert loaded.load_fitted(tmp_path / "fitted.pkl")
+    assert loaded.is_fitted()
+    _, df_small = loaded.featurize(df_cells.iloc[:2])
+    _, df_large = loaded.featurize(df_cells.iloc[-2:])
+
+    # Batches are not fitted again, and thereby share their columns.
+    assert list(df_small.columns) == list(df_large.columns)
+    assert loaded.structure_featurizers[0]._max_eigs == 8
+
+
+class SitePreset(extendedMODFeaturizer):
+    structure_featurizers = (DensityFeatures(),)
+    site_featurizers = (CoordinationNumber(),)
+    dos_featurizers = (DOSFeaturizer(),)
+    conform_features = False
+
+
+def test_symmetrized_sites_read_the_symmetry_cache(df_structures):
+    preset = SitePreset(n_jobs=1, symmetrize_sites=True, tier="site")
+    preset.enable_symmetry_cache(persist=False)
+
+    _, df_featurized = preset.featurize(df_structures)
+
+    assert len(preset._symmetry_cache) == 2
+    assert df_featurized.index.tolist() == ["mp-1", "mp-2"]
+    assert df_featurized.filter(like="CoordinationNumber|").notna().all().all()
+
+
+def test_symmetry_cache_skipped_without_structures():
+    preset = SitePreset(n_jobs=1, symmetrize_sites=True)
+    preset.enable_symmetry_cache(persist=False)
+    [dos_id] = [featurizer_id for featurizer_id in preset.featurizer_ids() if featurizer_id.startswith("dos_")]
+    energies = np.linspace(-5, 5, 101)
+    df_dos = pd.DataFrame({"dos": [Dos(0.0, energies, {Spin.up: np.exp(-energies**2)})]},
+                          index=pd.Index(["mp-1"], name="material_id"))
+
+    _, df_featurized = preset.subset([dos_id]).featurize(df_dos)
+
+    assert df_featurized.index.tolist() == ["mp-1"]
+    assert len(preset._symmetry_cache) == 0
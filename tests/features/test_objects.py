@@ -0,0 +1,115 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymatgen.core import Lattice, Structure
+from pymatgen.electronic_structure.bandstructure import BandStructureSymmLine
+from pymatgen.electronic_structure.core import Orbital, Spin
+from pymatgen.electronic_structure.dos import CompleteDos, Dos
+
+from src.features import objects
+from src.features.objects import ObjectRef, ObjectStore
+
+
+@pytest.fixture
+def structure():
+    return Structure(Lattice.cubic(3.9), ["Sr", "Ti", "O", "O", "O"],
+                     [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+
+
+@pytest.fixture
+def complete_dos(structure):
+    energies = np.linspace(-5, 5, 101)
+    densities = {Spin.up: np.exp(-energies**2), Spin.down: np.exp(-(energies-1)**2)}
+    pdos = {site: {Orbital.s: {Spin.up: 0.1*densities[Spin.up], Spin.down: 0.1*densities[Spin.down]}}
+            for site in structure}
+    return CompleteDos(structure, Dos(0.5, energies, densities), pdos)
+
+
+@pytest.fixture
+def band_structure(structure):
+    kpoints = [[0.05*i, 0, 0] for i in range(11)]
+    eigenvalues = {Spin.up: np.array([np.linspace(-2, -1, 11), np.linspace(1, 3, 11)])}
+    return BandStructureSymmLine(kpoints, eigenvalues, structure.lattice.reciprocal_lattice, 0.0,
+                                 {"\\Gamma": [0, 0, 0], "X": [0.5, 0, 0]}, structure=structure)
+
+
+def test_round_trip(tmp_path, structure, complete_dos, band_structure):
+    store = ObjectStore(tmp_path)
+    store.put("structure", "mp-1", structure)
+    store.put("dos", "mp-1", complete_dos)
+    store.put("bandstructure", "mp-1", band_structure)
+
+    fresh = ObjectStore(tmp_path)
+    assert fresh.get("structure", "mp-1") == structure
+
+    dos = fresh.get("dos", "mp-1")
+    assert isinstance(dos, CompleteDos)
+    np.testing.assert_array_equal(dos.energies, complete_dos.energies)
+    np.testing.assert_array_equal(dos.densities[Spin.down], complete_dos.densities[Spin.down])
+    np.testing.assert_array_equal(dos.get_site_dos(dos.structure[1]).densities[Spin.up],
+                                  complete_dos.get_site_dos(structure[1]).densities[Spin.up])
+    assert dos.efermi == complete_dos.efermi
+
+    bands = fresh.get("bandstructure", "mp-1")
+    np.testing.assert_array_equal(bands.bands[Spin.up], band_structure.bands[Spin.up])
+    assert bands.get_band_gap() == band_structure.get_band_gap()
+
+
+def test_numeric_lists_are_stored_as_arrays(tmp_path, complete_dos):
+    store = ObjectStore(tmp_path)
+    store.put("dos", "mp-1", complete_dos)
+
+    with np.load(store.path("dos", "mp-1")) as data:
+        arrays = [name for name in data.files if name != "skeleton"]
+        assert arrays
+        assert all(data[name].dtype.kind == "f" for name in arrays)
+        assert len(str(data["skeleton"])) < 10 * sum(data[name].size for name in arrays)
+
+
+def test_missing_objects_are_marked_absent(tmp_path, band_structure):
+    store = ObjectStore(tmp_path)
+    store.put("bandstructure", "mp-1", None)
+    store.put("bandstructure", "mp-2", np.nan)
+
+    # Complete, such that they are not downloaded again.
+    assert store.complete(["mp-1", "mp-2", "mp-3"], ["bandstructure"]) == ["mp-1", "mp-2"]
+    assert not store.path("bandstructure", "mp-1").exists()
+    assert store.get("bandstructure", "mp-1") is None
+    assert store.load_frame(["mp-2"], ["bandstructure"]).loc["mp-2", "bandstructure"] is None
+
+    # A band structure published later replaces the marker.
+    store.put("bandstructure", "mp-1", band_structure)
+    assert not store.is_absent("bandstructure", "mp-1")
+    assert not store.absent_path("bandstructure", "mp-1").exists()
+
+
+def test_decoded_objects_not_kept_by_default(tmp_path, structure):
+    store = ObjectStore(tmp_path)
+    store.put("structure", "mp-1", structure)
+    store.get("structure", "mp-1")
+    store.get("structure", "mp-1")
+    assert (store.hits, store.misses) == (0, 2)
+
+    cached = ObjectStore(tmp_path, cache_size=1)
+    cached.get("structure", "mp-1")
+    cached.get("structure", "mp-1")
+    assert (cached.hits, cached.misses) == (1, 1)
+
+
+def test_load_frame_references_lazy_kinds(tmp_path, structure, complete_dos):
+    store = ObjectStore(tmp_path)
+    df = pd.DataFrame({"structure": [structure], "dos": [complete_dos]}, index=["mp-1"])
+    store.put_frame(df, ["structure", "dos"])
+
+    df_loaded = store.load_frame(["mp-1"], ["structure", "dos"])
+
+    assert df_loaded.loc["mp-1", "full_formula"] == "Sr1Ti1O3"
+    ref = df_loaded.loc["mp-1", "dos"]
+    assert isinstance(ref, ObjectRef)
+    ref = pickle.loads(pickle.dumps(ref))
+    resolved = objects.resolve(pd.Series([ref, 1.0]))
+    np.testing.assert_array_equal(resolved.iloc[0].energies, complete_dos.energies)
+    assert resolved.iloc[1] == 1.0
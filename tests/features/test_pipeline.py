@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from src.features.pipeline import prefetch_batches
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_batches_in_order(prefetch):
+    batches = [[1, 2], [3], [4, 5, 6]]
+    result = list(prefetch_batches(batches, sum, prefetch=prefetch))
+    assert result == [([1, 2], 3), ([3], 3), ([4, 5, 6], 15)]
+
+
+def test_downloads_bounded_by_prefetch():
+    downloaded = []
+
+    def download(batch):
+        downloaded.append(batch)
+        return batch
+
+    items = prefetch_batches(range(10), download, prefetch=2)
+    assert next(items) == (0, 0)
+    # One batch being processed, two waiting and one blocked on the queue.
+    time.sleep(0.2)
+    assert len(downloaded) <= 4
+    assert [batch for batch, _ in items] == list(range(1, 10))
+
+
+def test_download_error_raised_in_consumer():
+    def download(batch):
+        if batch == 2:
+            raise ValueError("bad batch")
+        return batch
+
+    items = prefetch_batches(range(5), download, prefetch=2)
+    assert next(items) == (0, 0)
+    assert next(items) == (1, 1)
+    with pytest.raises(ValueError, match="bad batch"):
+        next(items)
+
+
+def test_no_prefetch_downloads_lazily():
+    downloaded = []
+    items = prefetch_batches(range(3), lambda batch: downloaded.append(batch), prefetch=0)
+    next(items)
+    assert downloaded == [0]
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from matminer.featurizers.base import BaseFeaturizer
+from matminer.featurizers.composition import ElectronegativityDiff, Stoichiometry
+from matminer.featurizers.site import CoordinationNumber, GaussianSymmFunc
+from pymatgen.core import Lattice, Structure
+
+from src.features.featurizer import extendedMODFeaturizer
+from src.features.profiling import FeaturizerProfiler
+from src.features.site import SymmetrizedSiteStats
+
+
+class Length(BaseFeaturizer):
+    def featurize(self, x):
+        if x == "bad":
+            raise ValueError(x)
+        return [len(x)]
+
+    def feature_labels(self):
+        return ["length"]
+
+    def citations(self):
+        return []
+
+    def implementors(self):
+        return []
+
+
+@pytest.fixture
+def structures():
+    return pd.Series([Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+                      Structure(Lattice.cubic(3.0), ["Fe"], [[0, 0, 0]])],
+                     index=pd.Index(["mp-1", "mp-2"], name="material_id"))
+
+
+def test_records_every_featurizer_and_material():
+    profiler = FeaturizerProfiler()
+    df = pd.DataFrame({"x": ["ab", "bad"]}, index=["mp-1", "mp-2"])
+
+    df = profiler.featurize_dataframe(df, [Length()], "x", "composition", multiindex=False)
+
+    assert df["length"].iloc[0] == 2 and np.isnan(df["length"].iloc[1])
+    records = profiler.frame()
+    assert len(profiler) == 2
+    assert records["failed"].tolist() == [False, True]
+    assert records["nsites"].tolist() == [-1, -1]
+    assert records["wall"].dtype == np.float32
+
+
+def test_summary_per_featurizer(structures):
+    profiler = FeaturizerProfiler()
+    profiler.set_sizes(structures)
+    df = pd.DataFrame({"x": ["a", "bad"]}, index=structures.index)
+    profiler.featurize_dataframe(df, [Length()], "x", "composition", names=["length"])
+
+    summary = profiler.summary()
+    assert summary.loc[("composition", "length"), "calls"] == 2
+    assert summary.loc[("composition", "length"), "failures"] == 1
+
+
+def test_symmetrized_site_stats_timed_per_fingerprint(structures):
+    profiler = FeaturizerProfiler()
+    profiler.set_sizes(structures)
+    stats = SymmetrizedSiteStats([CoordinationNumber(), GaussianSymmFunc()], ["CN|", "GSF|"])
+
+    profiler.featurize_dataframe(pd.DataFrame({"s": structures}), [stats], "s", "site", multiindex=False)
+
+    records = profiler.frame()
+    assert set(records["featurizer"]) == {"equivalent_sites", "CoordinationNumber", "GaussianSymmFunc"}
+    assert records.groupby("featurizer", observed=True).size().tolist() == [2, 2, 2]
+
+
+def test_oxidation_state_conversion_timed(structures):
+    class OxidPreset(extendedMODFeaturizer):
+        composition_featurizers = (Stoichiometry(),)
+        oxid_composition_featurizers = (ElectronegativityDiff(),)
+        conform_features = False
+
+    preset = OxidPreset(n_jobs=1, tier="composition")
+    profiler = preset.enable_profiling()
+    _, df = preset.featurize(pd.DataFrame({"structure": structures}))
+
+    assert "CompositionToOxidComposition" in set(profiler.frame()["featurizer"])
+    assert df.shape[0] == 2
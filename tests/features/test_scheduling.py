@@ -0,0 +1,81 @@
+import requests
+
+from src.features import scheduling
+from src.features.scheduling import RetryScheduler, classify_error
+
+
+def test_classify_error():
+    assert classify_error(MemoryError()) == scheduling.MEMORY
+    assert classify_error(ConnectionError()) == scheduling.NETWORK
+    assert classify_error(requests.exceptions.HTTPError()) == scheduling.NETWORK
+    assert classify_error(ValueError()) == scheduling.FEATURIZER
+
+
+def test_batches_in_queue_order():
+    scheduler = RetryScheduler(["mp-1", "mp-2", "mp-3"])
+    assert scheduler.next_batch(2) == ["mp-1", "mp-2"]
+    assert scheduler.next_batch(2) == ["mp-3"]
+    scheduler.success(["mp-1", "mp-2"])
+    scheduler.success(["mp-3"])
+    assert scheduler.next_batch(2) is None
+
+
+def test_failing_batch_split_without_charging_attempts():
+    scheduler = RetryScheduler(["mp-1", "mp-2", "mp-3"], max_attempts=1, base_delay=0.0)
+    batch = scheduler.next_batch(3)
+    scheduler.failure(batch, ValueError("mp-2 fails"))
+    assert scheduler.failed == {}
+
+    # Retried one by one, only the culprit is given up.
+    for _ in range(3):
+        singleton = scheduler.next_batch(3)
+        assert len(singleton) == 1
+        if singleton == ["mp-2"]:
+            scheduler.failure(singleton, ValueError("mp-2 fails"))
+        else:
+            scheduler.success(singleton)
+    assert scheduler.next_batch(3) is None
+    assert list(scheduler.failed) == ["mp-2"]
+    assert scheduler.failures_frame()["attempts"].tolist() == [1]
+
+
+def test_singleton_given_up_after_max_attempts():
+    scheduler = RetryScheduler(["mp-1"], max_attempts=3, base_delay=0.0)
+    for _ in range(3):
+        scheduler.failure(scheduler.next_batch(1), ValueError("broken"))
+    assert scheduler.next_batch(1) is None
+    assert scheduler.failed["mp-1"] == (scheduling.FEATURIZER, "ValueError('broken')")
+
+
+def test_network_error_charges_batch_and_keeps_it_together():
+    scheduler = RetryScheduler(["mp-1", "mp-2"], max_attempts=2, base_delay=0.0)
+    scheduler.failure(scheduler.next_batch(2), ConnectionError())
+    assert scheduler.next_batch(2) == ["mp-1", "mp-2"]
+    scheduler.failure(["mp-1", "mp-2"], ConnectionError())
+    assert set(scheduler.failed) == {"mp-1", "mp-2"}
+
+
+def test_backoff_defers_failed_material():
+    scheduler = RetryScheduler(["mp-1", "mp-2"], base_delay=60.0)
+    scheduler.failure(scheduler.next_batch(1), ValueError())
+    assert scheduler.next_batch(2) == ["mp-2"]
+
+
+def test_abort_gives_up_without_retry():
+    scheduler = RetryScheduler(["mp-1", "mp-2"], max_attempts=3)
+    batch = scheduler.next_batch(2)
+    scheduler.abort("mp-1", scheduling.TIMEOUT, "took 30 s")
+    scheduler.success([mpid for mpid in batch if mpid != "mp-1"])
+    assert scheduler.next_batch(2) is None
+    assert scheduler.failed == {"mp-1": (scheduling.TIMEOUT, "took 30 s")}
+
+
+def test_missing_materials_charged_without_splitting():
+    scheduler = RetryScheduler(["mp-1", "mp-2", "mp-3"], max_attempts=1, base_delay=0.0)
+    assert scheduler.next_batch(3) == ["mp-1", "mp-2", "mp-3"]
+    scheduler.success(["mp-1"])
+    scheduler.failure(["mp-2", "mp-3"], scheduling.MissingMaterialError("Not in the response"))
+
+    assert scheduler.next_batch(3) is None
+    assert set(scheduler.failed) == {"mp-2", "mp-3"}
+    assert scheduler.failures_frame()["error_class"].tolist() == [scheduling.MISSING] * 2
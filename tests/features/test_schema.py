@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from matminer.featurizers.composition import Stoichiometry
+from matminer.featurizers.structure import CoulombMatrix, DensityFeatures
+from pymatgen.core import Lattice, Structure
+from sklearn.exceptions import NotFittedError
+
+from src.features import schema
+from src.features.featurizer import extendedMODFeaturizer
+from src.features.preset import PRESET_HEBNES_2021
+from src.features.schema import FeatureSchema
+
+COMMITTED_DIR = schema.SCHEMA_DIR
+
+
+class SmallPreset(extendedMODFeaturizer):
+    composition_featurizers = (Stoichiometry(),)
+    structure_featurizers = (DensityFeatures(),)
+
+    def postprocess_structure(self, df):
+        return df.drop(columns=["DensityFeatures|vpa"])
+
+
+class FittedPreset(extendedMODFeaturizer):
+    structure_featurizers = (CoulombMatrix(),)
+
+
+@pytest.fixture(autouse=True)
+def schema_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(schema, "SCHEMA_DIR", tmp_path / "committed")
+    monkeypatch.setattr(schema, "GENERATED_DIR", tmp_path / "generated")
+    return tmp_path / "generated"
+
+
+@pytest.fixture
+def df_structures():
+    structures = [
+        Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        Structure(Lattice.cubic(3.0), ["Fe"], [[0, 0, 0]]),
+    ]
+    return pd.DataFrame({"structure": structures}, index=pd.Index(["mp-1", "mp-2"], name="material_id"))
+
+
+def test_conform_fills_orders_and_leaves_out():
+    feature_schema = FeatureSchema.from_labels(["a", "b", "c"], "Preset", 1)
+    df = pd.DataFrame({"c": [1.0, np.nan], "x": [5.0, 6.0], "a": [np.inf, 2.0]}, index=["mp-1", "mp-2"])
+
+    conformed = feature_schema.conform(df)
+
+    assert list(conformed.columns) == ["a", "b", "c"]
+    assert list(conformed.index) == ["mp-1", "mp-2"]
+    assert (conformed.dtypes == np.float32).all()
+    np.testing.assert_array_equal(conformed.to_numpy(), [[np.inf, -1, 1], [2, -1, -1]])
+    assert (feature_schema.conform(df, dtype=np.float64).dtypes == np.float64).all()
+
+
+def test_from_frame_refuses_empty_and_partial_frames():
+    with pytest.raises(ValueError, match="empty"):
+        FeatureSchema.from_frame(pd.DataFrame({"a": []}, dtype=float), "Preset", 1)
+    with pytest.raises(ValueError, match="partial"):
+        FeatureSchema.from_frame(pd.DataFrame({"a": [1.0], "b": [np.nan]}), "Preset", 1)
+
+    feature_schema = FeatureSchema.from_frame(pd.DataFrame({"a": [1.0], "s": ["x"]}), "Preset", 1)
+    assert list(feature_schema.columns) == ["a"]
+
+
+def test_registered_version_is_never_overwritten(schema_dir):
+    feature_schema = FeatureSchema.from_labels(["a"], "Preset", 1)
+    schema.register_schema(feature_schema)
+    with pytest.raises(FileExistsError):
+        schema.register_schema(FeatureSchema.from_labels(["b"], "Preset", 1))
+    assert list(schema.load_schema("Preset", 1).columns) == ["a"]
+
+
+def test_schema_built_from_feature_labels(schema_dir, df_structures):
+    preset = SmallPreset(n_jobs=1, tier="structure")
+
+    feature_schema = preset.get_schema()
+
+    assert (schema_dir / "SmallPreset-structure-v1.json").is_file()
+    assert "DensityFeatures|density" in feature_schema.columns
+    assert "DensityFeatures|vpa" not in feature_schema.columns
+    _, df_featurized = preset.featurize(df_structures)
+    assert list(df_featurized.columns) == list(feature_schema.columns)
+    assert not (df_featurized == -1).all().any()
+
+
+def test_empty_batch_does_not_change_schema(df_structures):
+    preset = SmallPreset(n_jobs=1, tier="structure")
+
+    empty = preset.conform(pd.DataFrame(index=pd.Index([], name="material_id")))
+    _, df_featurized = preset.featurize(df_structures)
+
+    assert list(empty.columns) == list(df_featurized.columns)
+    assert not (df_featurized == -1).all().any()
+
+
+def test_unfitted_featurizers_have_no_schema(schema_dir, df_structures):
+    preset = FittedPreset(n_jobs=1, tier="structure")
+    with pytest.raises(NotFittedError):
+        preset.get_schema()
+
+    # Fitted to a batch, the featurizers still have no schema.
+    preset.conform_features = False
+    preset.featurize(df_structures.iloc[:1])
+    with pytest.raises(NotFittedError):
+        preset.get_schema()
+    assert not schema_dir.exists()
+
+    preset.fit(df_structures)
+    assert len(preset.get_schema()) == len(preset.feature_labels())
+
+
+def test_schema_of_other_fit_is_refused(df_structures):
+    preset = FittedPreset(n_jobs=1, tier="structure")
+    preset.fit(df_structures)
+    preset.get_schema()
+
+    refitted = FittedPreset(n_jobs=1, tier="structure")
+    refitted.fit(df_structures.iloc[1:])
+    with pytest.raises(ValueError, match="does not match"):
+        refitted.get_schema()
+
+
+def test_committed_schema_matches_feature_labels():
+    committed = schema.load_schema("PRESET_HEBNES_2021-composition", 1, directory=COMMITTED_DIR)
+    assert list(committed.columns) == PRESET_HEBNES_2021(tier="composition").feature_labels()
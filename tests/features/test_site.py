@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from matminer.featurizers.site import AGNIFingerprints, AverageBondAngle, AverageBondLength, CoordinationNumber
+from matminer.featurizers.structure import SiteStatsFingerprint
+from pymatgen.analysis.local_env import VoronoiNN
+from pymatgen.core import Lattice, Structure
+
+from src.features import site
+from src.features.featurizer import extendedMODFeaturizer
+from src.features.site import SymmetrizedSiteStats
+
+
+@pytest.fixture
+def perovskite():
+    return Structure(Lattice.cubic(3.9), ["Sr", "Ti", "O", "O", "O"],
+                     [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+
+
+def test_matches_site_stats_fingerprint(perovskite):
+    fingerprints = [CoordinationNumber(), AGNIFingerprints()]
+    stats = SymmetrizedSiteStats(fingerprints, ["CoordinationNumber|", "AGNIFingerprints|"])
+
+    expected = np.concatenate([SiteStatsFingerprint(fingerprint, stats=("mean", "std_dev")).featurize(perovskite)
+                               for fingerprint in fingerprints])
+    np.testing.assert_allclose(stats.featurize(perovskite), expected, rtol=1e-10, atol=1e-12)
+    assert len(stats.feature_labels()) == len(expected)
+    assert stats.feature_labels()[0].startswith("CoordinationNumber|")
+
+
+def test_equivalent_sites_with_multiplicities(perovskite):
+    stats = SymmetrizedSiteStats([CoordinationNumber()], ["CN|"])
+    representatives, multiplicities = stats.equivalent_sites(perovskite)
+    assert len(representatives) == 3
+    assert sorted(multiplicities.tolist()) == [1, 1, 3]
+
+
+def test_failing_fingerprint_only_fills_its_features(perovskite):
+    class Failing(CoordinationNumber):
+        def featurize(self, struct, idx):
+            raise ValueError("fails")
+
+    stats = SymmetrizedSiteStats([Failing(), AGNIFingerprints()], ["Failing|", "AGNI|"])
+    features = np.array(stats.featurize(perovskite))
+    n_failing = len(SiteStatsFingerprint(CoordinationNumber()).feature_labels())
+    assert np.isnan(features[:n_failing]).all()
+    assert not np.isnan(features[n_failing:]).any()
+
+
+class SitePreset(extendedMODFeaturizer):
+    site_featurizers = (AverageBondAngle(VoronoiNN()), AverageBondLength(VoronoiNN()))
+    conform_features = False
+
+
+@pytest.mark.parametrize("symmetrize_sites", [False, True])
+def test_site_featurizers_share_neighbors(perovskite, monkeypatch, symmetrize_sites):
+    logged = []
+    monkeypatch.setattr(site, "log_neighbor_caches",
+                        lambda caches: logged.extend((cache.hits, cache.misses) for cache in caches))
+    structures = [perovskite, perovskite.copy(), Structure(Lattice.cubic(3.0), ["Fe"], [[0, 0, 0]])]
+    df = pd.DataFrame({"structure": structures}, index=["mp-1", "mp-2", "mp-3"])
+
+    preset = SitePreset(symmetrize_sites=symmetrize_sites)
+    df_site = preset.featurize_site(df)
+
+    expected = pd.concat([SiteStatsFingerprint(fingerprint, stats=preset.site_stats).featurize_dataframe(
+        df[["structure"]], "structure", multiindex=False, ignore_errors=True).drop(columns=["structure"])
+        for fingerprint in SitePreset.site_featurizers], axis=1)
+    np.testing.assert_allclose(df_site.to_numpy(dtype=float), expected.to_numpy(dtype=float), rtol=1e-10)
+    assert df_site.columns[0].startswith("AverageBondAngle|")
+
+    # One shared cache, computing the neighbors once per structure, or once
+    # per distinct site when symmetrizing.
+    [(hits, misses)] = logged
+    assert misses == (3 + 3 + 1 if symmetrize_sites else len(structures))
+    assert hits >= misses
+
+
+class RenamedCoordinationNumber(CoordinationNumber):
+    pass
+
+
+class SharedLabelsPreset(extendedMODFeaturizer):
+    site_featurizers = (CoordinationNumber(), RenamedCoordinationNumber())
+    conform_features = False
+
+
+def test_fingerprints_sharing_feature_names(perovskite):
+    df = pd.DataFrame({"structure": [perovskite]}, index=["mp-1"])
+
+    df_site = SharedLabelsPreset().featurize_site(df)
+
+    n_labels = len(SiteStatsFingerprint(CoordinationNumber()).feature_labels())
+    assert df_site.shape == (1, 2*n_labels)
+    assert df_site.columns[n_labels].startswith("RenamedCoordinationNumber|")
+    np.testing.assert_allclose(df_site.iloc[0, :n_labels], df_site.iloc[0, n_labels:])
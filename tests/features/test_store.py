@@ -0,0 +1,140 @@
+import os
+import time
+
+import pandas as pd
+
+from src.features.store import FeatureStore
+
+
+def _batch(material_ids, value=0.0):
+    return pd.DataFrame({"a": [value] * len(material_ids), "b": [value + 1] * len(material_ids)},
+                        index=pd.Index(material_ids, name="material_id"))
+
+
+def test_write_shard_and_resume(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"]), pd.DataFrame({"featurize": [1.0]}))
+    store.write_shard(_batch(["mp-3"]))
+
+    resumed = FeatureStore(tmp_path)
+    assert resumed.completed_ids() == {"mp-1", "mp-2", "mp-3"}
+    assert [record["rows"] for record in resumed.records] == [2, 1]
+    assert resumed.write_shard(_batch(["mp-4"])).name == "shard-000003.pkl"
+
+
+def test_unreferenced_shard_and_partial_line_ignored(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1"]))
+    # A crash after writing a shard, and during the manifest append.
+    _batch(["mp-2"]).to_pickle(store.shard_dir / "shard-000002.pkl")
+    with open(store.manifest_path, "a") as f:
+        f.write('{"shard": "shard-000002.pkl", "material_ids": ["mp')
+
+    resumed = FeatureStore(tmp_path)
+    assert resumed.completed_ids() == {"mp-1"}
+    # The orphaned shard number is not reused.
+    assert resumed.write_shard(_batch(["mp-2"])).name == "shard-000003.pkl"
+
+
+def test_compact_keeps_latest_shard(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"], 0.0), pd.DataFrame({"featurize": [1.0]}))
+    store.write_shard(_batch(["mp-2"], 5.0), pd.DataFrame({"featurize": [2.0]}))
+
+    df, df_time = store.compact()
+    assert sorted(df.index) == ["mp-1", "mp-2"]
+    assert df.loc["mp-2", "a"] == 5.0
+    assert list(df["material_id"]) == list(df.index)
+    assert list(df_time["featurize"]) == [1.0, 2.0]
+    assert (tmp_path / "featurized.pkl").is_file()
+
+
+def test_read_uses_consolidated_until_manifest_changes(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1"]))
+    store.compact()
+    assert list(store.read().index) == ["mp-1"]
+
+    store.write_shard(_batch(["mp-2"]))
+    assert sorted(store.read().index) == ["mp-1", "mp-2"]
+
+
+def test_merge_columns_by_material_id(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"]), featurizers=["structure_featurizers/A-1"])
+    store.write_shard(_batch(["mp-3"]), featurizers=["structure_featurizers/A-1"])
+    store.write_shard(_batch(["mp-4"]), featurizers=["structure_featurizers/A-1"])
+    df_new = pd.DataFrame({"a": [9.0, 9.0], "c": [3.0, 4.0]}, index=["mp-3", "mp-1"])
+
+    store.merge_columns(df_new, ["dos_featurizers/B-2"],
+                        conform=lambda df: df[["a", "b", "c"]].fillna(-1), schema="Preset-v2")
+
+    resumed = FeatureStore(tmp_path)
+    shards = [pd.read_pickle(resumed.shard_dir / record["shard"]) for record in resumed.records]
+    # Existing columns are kept, and rows without new features are filled.
+    assert [shard["a"].tolist() for shard in shards] == [[0.0, 0.0], [0.0], [0.0]]
+    assert [shard["c"].tolist() for shard in shards[:2]] == [[4.0, -1.0], [3.0]]
+    # Shards without any of the materials are not rewritten.
+    assert list(shards[2].columns) == ["a", "b"]
+    assert [record["featurizers"] for record in resumed.records] == [
+        ["dos_featurizers/B-2", "structure_featurizers/A-1"],
+        ["dos_featurizers/B-2", "structure_featurizers/A-1"],
+        ["structure_featurizers/A-1"],
+    ]
+    assert [record["schema"] for record in resumed.records] == ["Preset-v2", "Preset-v2", None]
+
+
+def test_diff_against_manifest(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"]))
+    store.write_shard(_batch(["mp-3"]), schema="Preset-v1")
+    store.write_shard(_batch(["mp-4"]), schema="Preset-v2")
+
+    diff = FeatureStore(tmp_path).diff(["mp-5", "mp-1", "mp-3", "mp-4"], schema="Preset-v2")
+
+    assert diff["added"] == ["mp-5"]
+    # Shards without a recorded schema are taken to match.
+    assert diff["stale"] == ["mp-3"]
+    assert diff["removed"] == ["mp-2"]
+
+
+def test_tombstone_hides_until_featurized_again(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"]))
+    store.tombstone(["mp-1"])
+
+    resumed = FeatureStore(tmp_path)
+    assert resumed.completed_ids() == {"mp-2"}
+    assert resumed.tombstoned_ids() == {"mp-1"}
+    assert resumed.diff(["mp-1", "mp-2"])["added"] == ["mp-1"]
+    assert list(resumed.compact(write=False)[0].index) == ["mp-2"]
+
+    resumed.write_shard(_batch(["mp-1"], value=5.0))
+    again = FeatureStore(tmp_path)
+    assert again.completed_ids() == {"mp-1", "mp-2"}
+    assert again.read().loc["mp-1", "a"] == 5.0
+
+
+def test_read_rebuilds_after_tombstone(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"]))
+    assert list(store.read().index) == ["mp-1", "mp-2"]
+
+    store.tombstone(["mp-2"])
+    os.utime(store.tombstone_path, (time.time() + 1, time.time() + 1))
+
+    assert list(store.read().index) == ["mp-1"]
+
+
+def test_read_material_ids_from_their_latest_shards(tmp_path):
+    store = FeatureStore(tmp_path)
+    store.write_shard(_batch(["mp-1", "mp-2"], 0.0))
+    store.write_shard(_batch(["mp-2", "mp-3"], 5.0))
+    store.tombstone(["mp-3"])
+
+    df = store.read(["mp-2", "mp-1", "mp-3", "mp-4", "mp-2"])
+
+    assert sorted(df.index) == ["mp-1", "mp-2"]
+    assert df.loc["mp-2", "a"] == 5.0
+    assert list(df["material_id"]) == list(df.index)
+    assert not (tmp_path / "featurized.pkl").exists()
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from matminer.featurizers import structure as matminer_structure
+from matminer.featurizers.structure import DensityFeatures
+from pymatgen.core import Lattice, Structure
+
+from src.features.cache import SymmetryCache, structure_key
+from src.features.featurizer import extendedMODFeaturizer
+from src.features.symmetry import GlobalSymmetryFeatures, use_symmetry_cache
+
+
+@pytest.fixture
+def structures():
+    return [Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+            Structure(Lattice.tetragonal(3.0, 4.0), ["Fe", "Fe"], [[0, 0, 0], [0.5, 0.5, 0.3]])]
+
+
+class SymmetryPreset(extendedMODFeaturizer):
+    structure_featurizers = (DensityFeatures(), matminer_structure.GlobalSymmetryFeatures())
+    conform_features = False
+
+
+def test_structure_key_ignores_periodic_images(structures):
+    shifted = structures[0].copy()
+    shifted.translate_sites([0], [1.0, 0, 0], frac_coords=True, to_unit_cell=False)
+    assert structure_key(shifted) == structure_key(structures[0])
+    assert structure_key(structures[0]) != structure_key(structures[1])
+
+
+def test_cache_analyses_once_and_persists(structures, tmp_path):
+    path = tmp_path / "symmetry.pkl"
+    symmetry_cache = SymmetryCache(path)
+    record = symmetry_cache.get(structures[0])
+    assert record["spacegroup_number"] == 221
+    assert symmetry_cache.get(structures[0].copy()) is record
+    assert (symmetry_cache.hits, symmetry_cache.misses) == (1, 1)
+    symmetry_cache.save()
+
+    assert len(SymmetryCache(path)) == 1
+    # Analyses with another tolerance are not reused.
+    assert len(SymmetryCache(path, symprec=0.1)) == 0
+
+
+def test_subset_holds_batch_records_only(structures):
+    symmetry_cache = SymmetryCache()
+    symmetry_cache.analyse(structures)
+    subset = symmetry_cache.subset(structures[1:])
+    assert len(subset) == 1 and subset.path is None
+    assert subset.get(structures[1]) is symmetry_cache.get(structures[1])
+
+
+def test_global_symmetry_features_match_matminer(structures):
+    expected = matminer_structure.GlobalSymmetryFeatures()
+    [cached] = use_symmetry_cache([expected], SymmetryCache())
+    assert isinstance(cached, GlobalSymmetryFeatures)
+    assert cached.feature_labels() == expected.feature_labels()
+    for s in structures:
+        assert cached.featurize(s) == expected.featurize(s)
+
+
+@pytest.mark.parametrize("n_workers", [None, 2])
+def test_analyses_kept_in_parent(structures, tmp_path, n_workers):
+    df = pd.DataFrame({"structure": structures}, index=["mp-1", "mp-2"])
+    preset = SymmetryPreset(n_jobs=2, tier="structure")
+    preset.enable_symmetry_cache(tmp_path / "symmetry.pkl")
+    if n_workers:
+        preset.start_pool(n_workers)
+    try:
+        _, df_featurized = preset.featurize(df)
+    finally:
+        preset.stop_pool()
+    preset.save_caches()
+
+    assert df_featurized["GlobalSymmetryFeatures|spacegroup_num"].tolist() == [221, 129]
+    assert len(SymmetryCache(tmp_path / "symmetry.pkl")) == 2
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from src.features.utils.utils import clean_df, expand_rdf, one_hot_elements, split_locations
+
+
+RDF = "RadialDistributionFunction|radial distribution function"
+
+
+def test_expand_rdf_keeps_first_bins():
+    distances = np.arange(0.1, 1.0, 0.1)
+    df = pd.DataFrame({
+        "a": [1.0, 2.0],
+        RDF: [{"distances": distances, "distribution": np.arange(9.0)},
+              {"distances": distances, "distribution": np.arange(9.0)*2}],
+    })
+
+    expanded = expand_rdf(df, RDF, n_bins=3)
+
+    assert list(expanded.columns) == ["a"] + ["{}|d_{:.2f}".format(RDF, d) for d in distances[:3]]
+    np.testing.assert_array_equal(expanded.iloc[:, 1:].to_numpy(), [[0, 1, 2], [0, 2, 4]])
+
+
+def test_expand_rdf_fills_failed_rows_with_nan():
+    distances = np.array([0.5, 1.0])
+    df = pd.DataFrame({RDF: [np.nan, {"distances": distances, "distribution": np.ones(2)}]})
+
+    expanded = expand_rdf(df, RDF, n_bins=50)
+
+    assert expanded.shape == (2, 2)
+    assert expanded.iloc[0].isna().all()
+    assert (expanded.iloc[1] == 1).all()
+
+
+def test_expand_rdf_without_column_is_noop():
+    df = pd.DataFrame({"a": [1.0]})
+    assert expand_rdf(df, RDF) is df
+
+
+def test_one_hot_elements_uses_fixed_vocabulary():
+    df = pd.DataFrame({"x": [0.5, 0.7, 0.9], "species": ["Fe", "O", None]})
+
+    encoded = one_hot_elements(df, ["species", "missing"], vocabulary=["O", "Fe", "Si"])
+
+    assert list(encoded.columns) == ["x", "species_O", "species_Fe", "species_Si"]
+    np.testing.assert_array_equal(encoded.iloc[:, 1:].to_numpy(), [[0, 1, 0], [1, 0, 0], [0, 0, 0]])
+
+
+def test_one_hot_elements_matches_get_dummies():
+    df = pd.DataFrame({"species": ["Fe", "O", "Fe"]})
+
+    encoded = one_hot_elements(df, ["species"], vocabulary=["Fe", "O"])
+    expected = pd.get_dummies(df, columns=["species"]).astype(np.uint8)
+
+    pd.testing.assert_frame_equal(encoded, expected)
+
+
+def test_split_locations_gives_nan_for_malformed():
+    df = pd.DataFrame({"loc": ["0.1;0.2;0.3", "bad", np.nan]})
+
+    split = split_locations(df, ["loc"], n=3)
+
+    assert list(split.columns) == ["loc_0", "loc_1", "loc_2"]
+    np.testing.assert_allclose(split.iloc[0], [0.1, 0.2, 0.3])
+    assert split.iloc[1:].isna().all().all()
+
+
+def test_clean_df_drops_non_numeric_and_replaces_invalid():
+    df = pd.DataFrame({"a": [1.0, np.nan], "b": [np.inf, -np.inf], "c": ["x", "y"], "d": [1, 2], "e": [True, False]})
+
+    cleaned = clean_df(df)
+
+    assert list(cleaned.columns) == ["a", "b", "d", "e"]
+    assert (cleaned.dtypes == np.float32).all()
+    np.testing.assert_array_equal(cleaned.to_numpy(), [[1, -1, 1, 1], [-1, -1, 2, 0]])
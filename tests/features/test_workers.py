@@ -0,0 +1,178 @@
+import signal
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from matminer.featurizers.composition import Stoichiometry
+from matminer.featurizers.dos import DOSFeaturizer
+from matminer.featurizers.structure import DensityFeatures
+from pymatgen.core import Lattice, Structure
+from pymatgen.electronic_structure.core import Spin
+from pymatgen.electronic_structure.dos import Dos
+
+from src.features import workers
+from src.features.costmodel import CostModel
+from src.features.featurizer import extendedMODFeaturizer
+from src.features.scheduling import TIMEOUT
+from src.features.workers import FeaturizerPool
+
+
+class SmallPreset(extendedMODFeaturizer):
+    composition_featurizers = (Stoichiometry(),)
+    structure_featurizers = (DensityFeatures(),)
+    conform_features = False
+
+
+@pytest.fixture
+def df_structures():
+    structures = [Structure(Lattice.cubic(3.0 + 0.1 * i), ["Fe"] * (1 + i % 2), [[0, 0, 0], [0.5, 0.5, 0.5]][:1 + i % 2])
+                  for i in range(6)]
+    return pd.DataFrame({"structure": structures},
+                        index=pd.Index(["mp-{}".format(i) for i in range(6)], name="material_id"))
+
+
+def test_pool_matches_in_process(df_structures):
+    preset = SmallPreset(n_jobs=1, tier="structure")
+    _, df_expected = preset.featurize(df_structures)
+
+    pool = FeaturizerPool(SmallPreset(tier="structure"), n_workers=2, chunksize=2)
+    try:
+        df_time, df_featurized = pool.featurize(df_structures)
+        # The pool is reused for the next batch.
+        _, df_again = pool.featurize(df_structures.iloc[::-1])
+    finally:
+        pool.shutdown()
+
+    pd.testing.assert_frame_equal(df_featurized, df_expected)
+    assert list(df_again.index) == list(df_structures.index[::-1])
+    assert df_time["workers"].iloc[0] == 2
+    assert df_time["df.rows"].iloc[0] == 6
+    assert pool.aborted == []
+
+
+class DosPreset(extendedMODFeaturizer):
+    dos_featurizers = (DOSFeaturizer(),)
+    conform_features = False
+
+
+def test_cost_model_skipped_without_structures():
+    energies = np.linspace(-5, 5, 101)
+    df_dos = pd.DataFrame({"dos": [Dos(0.0, energies, {Spin.up: np.exp(-(energies-i)**2)}) for i in range(3)]},
+                          index=pd.Index(["mp-{}".format(i) for i in range(3)], name="material_id"))
+
+    pool = FeaturizerPool(DosPreset(), n_workers=1, cost_model=CostModel())
+    try:
+        _, df_featurized = pool.featurize(df_dos)
+    finally:
+        pool.shutdown()
+
+    assert list(df_featurized.index) == list(df_dos.index)
+
+
+def test_worker_composition_cache_merged_into_parent(df_structures, tmp_path):
+    preset = SmallPreset(tier="composition")
+    preset.enable_composition_cache(tmp_path / "composition.pkl")
+    preset.start_pool(2, chunksize=3)
+    try:
+        preset.featurize(df_structures)
+    finally:
+        preset.stop_pool()
+    preset.save_caches()
+
+    assert len(preset._composition_cache) == 1
+    assert (tmp_path / "composition.pkl").is_file()
+
+
+class SlowStoichiometry(Stoichiometry):
+    """ Sleeps on cobalt compounds, interruptibly unless "blocking", as in
+    a long C call the alarm can not interrupt.
+    """
+
+    def __init__(self, blocking=False):
+        super().__init__()
+        self.blocking = blocking
+
+    def featurize(self, comp):
+        if "Co" in [element.symbol for element in comp.elements]:
+            if self.blocking:
+                signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+            time.sleep(60)
+        return super().featurize(comp)
+
+
+class SlowPreset(extendedMODFeaturizer):
+    composition_featurizers = (SlowStoichiometry(),)
+    conform_features = False
+
+
+class BlockingPreset(extendedMODFeaturizer):
+    composition_featurizers = (SlowStoichiometry(blocking=True),)
+    conform_features = False
+
+
+@pytest.fixture
+def df_with_cobalt(df_structures):
+    df = df_structures.copy()
+    df.loc["mp-3", "structure"] = Structure(Lattice.cubic(3.0), ["Co"], [[0, 0, 0]])
+    return df
+
+
+def test_timeout_aborts_material_and_recycles_its_worker(df_with_cobalt):
+    pool = FeaturizerPool(SlowPreset(tier="composition"), n_workers=2, chunksize=3, timeout=1)
+    pids = list(pool._pids)
+    try:
+        df_time, df_featurized = pool.featurize(df_with_cobalt)
+    finally:
+        pool.shutdown()
+
+    assert [record["material_id"] for record in pool.aborted] == ["mp-3"]
+    assert pool.aborted[0]["error_class"] == TIMEOUT
+    assert list(df_featurized.index) == ["mp-0", "mp-1", "mp-2", "mp-4", "mp-5"]
+    assert sum(old != new for old, new in zip(pids, pool._pids)) == 1
+
+
+def test_deadline_terminates_only_the_stuck_worker(df_with_cobalt, monkeypatch):
+    monkeypatch.setattr(workers, "_DEADLINE_GRACE", 1.0)
+    pool = FeaturizerPool(BlockingPreset(tier="composition"), n_workers=2, chunksize=1, timeout=1)
+    pids = list(pool._pids)
+    try:
+        time0 = time.perf_counter()
+        _, df_featurized = pool.featurize(df_with_cobalt)
+        elapsed = time.perf_counter() - time0
+    finally:
+        pool.shutdown()
+
+    assert elapsed < 30
+    assert [record["material_id"] for record in pool.aborted] == ["mp-3"]
+    assert "deadline" in pool.aborted[0]["error"]
+    assert list(df_featurized.index) == ["mp-0", "mp-1", "mp-2", "mp-4", "mp-5"]
+    # Only the worker of the stuck material was replaced.
+    assert sum(old != new for old, new in zip(pids, pool._pids)) == 1
+
+
+def test_lost_chunk_is_resubmitted_one_material_at_a_time(df_with_cobalt, monkeypatch):
+    monkeypatch.setattr(workers, "_DEADLINE_GRACE", 1.0)
+    pool = FeaturizerPool(BlockingPreset(tier="composition"), n_workers=2, chunksize=3, timeout=1)
+    try:
+        _, df_featurized = pool.featurize(df_with_cobalt)
+    finally:
+        pool.shutdown()
+
+    assert [record["material_id"] for record in pool.aborted] == ["mp-3"]
+    assert list(df_featurized.index) == ["mp-0", "mp-1", "mp-2", "mp-4", "mp-5"]
+
+
+def test_late_abort_is_recorded_not_raised(df_structures, monkeypatch):
+    def abort(df_row):
+        raise workers.MaterialAborted(TIMEOUT, "late tick")
+
+    monkeypatch.setattr(workers, "_WORKER_FEATURIZER", SmallPreset(tier="composition"))
+    monkeypatch.setattr(workers, "_featurize_guarded", abort)
+    monkeypatch.setitem(workers._GUARD, "timeout", 1)
+
+    df_time, df_featurized, aborted, _ = workers._featurize_chunk(df_structures.iloc[:2])
+
+    assert df_featurized.empty
+    assert [record["error_class"] for record in aborted] == [TIMEOUT, TIMEOUT]